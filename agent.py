@@ -1,52 +1,102 @@
 import uuid
+import os
 import sys
 import json
-import paramiko
-import subprocess
+import time
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
 
+from job_runner import (JobRunner, SUCCEEDED, job_cancel_response, job_status_response, job_stream_response,
+                        parse_timeout)
+from ssh_session_cache import SSHSessionCache
+
 app = Flask(__name__)
 
 import uuid
 
 CORS(app)
 
+# --- Load tracking, reported in /health and with every poll so the backend can place work ---
+import collections
+import threading
+
+TASK_SLOTS = 1  # the polling loop runs one task at a time
+LATENCY_SAMPLES = 20
+load_lock = threading.Lock()
+task_counts = {"running": 0, "queued": 0}
+# Authenticated sessions are reused across tasks and opened ahead of time from backend hints
+ssh_sessions = SSHSessionCache(idle_timeout=int(os.environ.get("AGENT_SSH_IDLE_TIMEOUT", 300)))
+target_latency = {}  # "host:port" -> deque of recent connect+run times in seconds
+
+def record_latency(target, seconds):
+    with load_lock:
+        target_latency.setdefault(target, collections.deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+def load_report():
+    """Snapshot of how busy this agent is
+
+    running_tasks, queued_tasks and free_slots count polled ssh-test tasks only, since
+    those are what the server leases to this agent; /deploy jobs are reported under "deploy".
+    """
+    try:
+        cpu_load = os.getloadavg()[0]
+    except (AttributeError, OSError):  # not available on Windows
+        cpu_load = None
+    with load_lock:
+        latency_ms = {target: round(sum(samples) / len(samples) * 1000, 1)
+                      for target, samples in target_latency.items() if samples}
+        return {
+            "running_tasks": task_counts["running"],
+            "queued_tasks": task_counts["queued"],
+            "ssh_sessions": len(ssh_sessions),
+            "free_slots": max(TASK_SLOTS - task_counts["running"], 0),
+            "deploy": deploy_jobs.stats(),
+            "cpu_load": cpu_load,
+            "cpu_count": os.cpu_count(),
+            "target_latency_ms": latency_ms
+        }
+
+def run_ssh_commands(ssh_data):
+    """Run ssh_data["commands"] over a cached session to ssh_data["host"], returns the per-command results"""
+    target = f"{ssh_data['host']}:{ssh_data.get('port', 22)}"
+    started = time.time()
+    results = []
+    for cmd in ssh_data.get("commands", ["hostname", "uptime"]):
+        output = ssh_sessions.exec_command(
+            ssh_data["host"], ssh_data["username"], cmd,
+            port=ssh_data.get("port", 22),
+            password=ssh_data.get("password"),
+            key_filename=ssh_data.get("key_filename")
+        )
+        results.append({
+            "command": cmd,
+            "output": output["stdout"],
+            "error": output["stderr"]
+        })
+    record_latency(target, time.time() - started)
+    return results
+
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat()})
+    return jsonify({"status": "healthy", "timestamp": datetime.now().isoformat(), "load": load_report()})
 
 @app.route("/ssh-test", methods=["POST"])
 def ssh_test():
     data = request.json
     print("[DEBUG] Received payload:", data)
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(
-            hostname=data["host"],
-            port=data.get("port", 22),
-            username=data["username"],
-            password=data["password"],
-            timeout=10
-        )
-
-        results = []
-        for cmd in data.get("commands", ["hostname", "uptime"]):
-            stdin, stdout, stderr = client.exec_command(cmd)
-            results.append({
-                "command": cmd,
-                "output": stdout.read().decode(),
-                "error": stderr.read().decode()
-            })
-
-        client.close()
+        results = run_ssh_commands(data)
         return jsonify({"success": True, "results": results})
 
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+# Deploy scripts run in a bounded worker pool so long deploys never hold a Flask thread
+DEPLOY_WORKERS = int(os.environ.get("AGENT_DEPLOY_WORKERS", 2))
+DEPLOY_TIMEOUT = float(os.environ.get("AGENT_DEPLOY_TIMEOUT", 3600))
+deploy_jobs = JobRunner(max_workers=DEPLOY_WORKERS, name="deploy")
+
 @app.route("/deploy", methods=["POST"])
 def deploy():
     data = request.json
@@ -55,15 +105,33 @@ def deploy():
 
     try:
         if deploy_type == "shell":
-            result = subprocess.run(data["script"], shell=True, capture_output=True, text=True)
+            try:
+                timeout = parse_timeout(data.get("timeout", DEPLOY_TIMEOUT))
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e), "test_id": test_id}), 400
+            job = deploy_jobs.submit(data["script"], shell=True, timeout=timeout)
+            if data.get("wait"):
+                # Old synchronous contract: block until the script exits
+                job.wait()
+                response = {
+                    "success": job.status == SUCCEEDED,
+                    "output": job.collected("stdout"),
+                    "error": job.collected("stderr") or job.error or "",
+                    "test_id": test_id,
+                    "job_id": job.job_id
+                }
+                print("Deploy response:", response)
+                return jsonify(response)
             response = {
-                "success": result.returncode == 0,
-                "output": result.stdout,
-                "error": result.stderr,
-                "test_id": test_id
+                "success": True,
+                "status": job.status,
+                "job_id": job.job_id,
+                "test_id": test_id,
+                "status_url": f"/deploy/{job.job_id}",
+                "stream_url": f"/deploy/{job.job_id}/stream"
             }
             print("Deploy response:", response)
-            return jsonify(response)
+            return jsonify(response), 202
         else:
             response = {
                 "success": False,
@@ -77,52 +145,103 @@ def deploy():
         print("Deploy response:", response)
         return jsonify(response)
 
+@app.route("/deploy/<job_id>", methods=["GET"])
+def deploy_status(job_id):
+    return job_status_response(deploy_jobs, job_id)
+
+@app.route("/deploy/<job_id>/stream", methods=["GET"])
+def deploy_stream(job_id):
+    return job_stream_response(deploy_jobs, job_id)
+
+@app.route("/deploy/<job_id>", methods=["DELETE"])
+def deploy_cancel(job_id):
+    return job_cancel_response(deploy_jobs, job_id)
+
 
 # --- Agent polling loop for outbound communication ---
 import requests
-import time
+from result_spool import ResultSpool
 
 BACKEND_API_URL = "http://13.58.212.239:5000/api/tasks"  # Set to your backend public API URL
 RESULTS_API_URL = "http://13.58.212.239:5000/api/results"  # Set to your backend public API URL
+HEARTBEAT_API_URL = "http://13.58.212.239:5000/api/agents/heartbeat"  # Set to your backend public API URL
+HEARTBEAT_INTERVAL = 15  # seconds; keeps pool leases alive while a long task blocks the polling loop
 AGENT_ID = str(uuid.uuid4())
+TENANT_ID = os.environ.get("AGENT_TENANT_ID")  # agents of the same tenant form one placement pool
+
+# Results that could not be posted are kept here and replayed in order once the backend is back
+SPOOL_PATH = os.environ.get("AGENT_SPOOL_PATH", "agent_results.spool")
+SPOOL_MAX_BYTES = int(os.environ.get("AGENT_SPOOL_MAX_BYTES", 50 * 1024 * 1024))
+result_spool = None  # opened by get_result_spool() on first use, so importing this module creates no files
+result_spool_lock = threading.Lock()
+
+def get_result_spool():
+    global result_spool
+    with result_spool_lock:
+        if result_spool is None:
+            result_spool = ResultSpool(SPOOL_PATH, max_bytes=SPOOL_MAX_BYTES)
+        return result_spool
+
+def post_result(result_payload):
+    """POST one result to the backend, returns True if it was accepted"""
+    try:
+        resp = requests.post(RESULTS_API_URL, json=result_payload, timeout=10)
+        print(f"[AGENT] Sent results for task {result_payload.get('task_id')}, backend response: {resp.status_code} {resp.text}")
+        return resp.status_code < 500
+    except Exception as e:
+        print(f"[AGENT][ERROR] Failed to send results: {e}")
+        return False
+
+def deliver_result(result_payload):
+    """Send a result, spooling it to disk if the backend is unreachable"""
+    spool = get_result_spool()
+    if len(spool) == 0 and post_result(result_payload):
+        return
+    spool.append(result_payload)  # fsync'ed with its batch, or by the polling loop's sync_if_due()
+    sent = spool.replay(post_result)
+    print(f"[AGENT] Result spool: replayed {sent}, {len(spool)} pending")
 
 def poll_for_tasks():
     print(f"[AGENT] Starting polling loop... AGENT_ID: {AGENT_ID}")
+    spool = get_result_spool()
     while True:
         try:
+            spool.sync_if_due()
+            if len(spool):
+                sent = spool.replay(post_result)
+                print(f"[AGENT] Result spool: replayed {sent}, {len(spool)} pending")
             print(f"[AGENT] Polling backend for tasks with AGENT_ID: {AGENT_ID}")
-            response = requests.get(f"{BACKEND_API_URL}?agent_id={AGENT_ID}", timeout=10)
+            params = {"agent_id": AGENT_ID, "load": json.dumps(load_report())}
+            if TENANT_ID:
+                params["tenant_id"] = TENANT_ID
+            response = requests.get(BACKEND_API_URL, params=params, timeout=10)
             print(f"[AGENT] Backend response: {response.status_code} {response.text}")
             if response.status_code == 200:
                 tasks = response.json().get("tasks", [])
                 if not tasks:
                     print("[AGENT] No tasks received from backend.")
+                # Open sessions for announced targets and for every queued task behind the first one,
+                # so they are authenticated by the time the loop gets to them
+                upcoming = response.json().get("hints", []) + [
+                    task["data"] for task in tasks[1:] if task.get("type") == "ssh-test" and task.get("data")]
+                if upcoming:
+                    print(f"[AGENT] Prewarming {ssh_sessions.prewarm(upcoming)} SSH sessions")
+                spooled_task_ids = spool.pending_task_ids()
+                task_counts["queued"] = len(tasks)
                 for task in tasks:
+                    task_counts["queued"] -= 1
                     print(f"[AGENT] Received task: {task}")
+                    if task.get("task_id") in spooled_task_ids:
+                        print(f"[AGENT] Result for task {task.get('task_id')} already spooled, not running it again")
+                        continue
                     # Example: SSH test task
                     if task.get("type") == "ssh-test":
                         ssh_data = task["data"]
                         print(f"[AGENT][DEBUG] SSH payload: host={ssh_data.get('host')}, port={ssh_data.get('port', 22)}, username={ssh_data.get('username')}, password={ssh_data.get('password')}, commands={ssh_data.get('commands', ['hostname', 'uptime'])}")
                         # Reuse existing ssh_test logic
+                        task_counts["running"] += 1
                         try:
-                            client = paramiko.SSHClient()
-                            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                            client.connect(
-                                hostname=ssh_data["host"],
-                                port=ssh_data.get("port", 22),
-                                username=ssh_data["username"],
-                                password=ssh_data["password"],
-                                timeout=10
-                            )
-                            results = []
-                            for cmd in ssh_data.get("commands", ["hostname", "uptime"]):
-                                stdin, stdout, stderr = client.exec_command(cmd)
-                                results.append({
-                                    "command": cmd,
-                                    "output": stdout.read().decode(),
-                                    "error": stderr.read().decode()
-                                })
-                            client.close()
+                            results = run_ssh_commands(ssh_data)
                             result_payload = {
                                 "agent_id": AGENT_ID,
                                 "task_id": task.get("task_id"),
@@ -138,19 +257,25 @@ def poll_for_tasks():
                                 "error": str(e)
                             }
                             print(f"[AGENT][ERROR] SSH test failed: {str(e)}")
+                        finally:
+                            task_counts["running"] -= 1
+                        result_payload["load"] = load_report()
                         # Send results back to backend
-                        try:
-                            resp = requests.post(RESULTS_API_URL, json=result_payload, timeout=10)
-                            print(f"[AGENT] Sent results for task {task.get('task_id')}, backend response: {resp.status_code} {resp.text}")
-                        except Exception as e:
-                            print(f"[AGENT][ERROR] Failed to send results: {e}")
+                        deliver_result(result_payload)
             else:
                 print(f"[AGENT] Polling failed: {response.status_code}")
         except Exception as e:
             print(f"[AGENT] Polling error: {e}")
         time.sleep(10)  # Poll every 10 seconds
 
-import threading
+def send_heartbeats():
+    while True:
+        try:
+            requests.post(HEARTBEAT_API_URL, json={"agent_id": AGENT_ID, "tenant_id": TENANT_ID,
+                                                   "load": load_report()}, timeout=10)
+        except Exception as e:
+            print(f"[AGENT][ERROR] Heartbeat failed: {e}")
+        time.sleep(HEARTBEAT_INTERVAL)
 
 def run_flask_server():
     print("[AGENT] Starting Flask server on port 5001...")
@@ -161,5 +286,6 @@ if __name__ == "__main__":
     # Start Flask server in a background thread
     flask_thread = threading.Thread(target=run_flask_server, daemon=True)
     flask_thread.start()
+    threading.Thread(target=send_heartbeats, daemon=True).start()
     # Start polling loop in main thread
     poll_for_tasks()
\ No newline at end of file
@@ -0,0 +1,109 @@
+"""
+Agent Liveness Registry
+Tracks which polling agents are online from their heartbeats.
+
+Every poll or result counts as a heartbeat. Expiry deadlines live in a min-heap, so a
+heartbeat costs O(log n) and the expiry thread sleeps until exactly the next deadline
+instead of scanning every agent. Online and offline counts are kept as running totals.
+"""
+
+import heapq
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class AgentRegistry:
+    """
+    Online/offline state of every registered agent
+
+    - `heartbeat()` registers an agent or refreshes it, bringing an offline agent back online
+    - agents silent for `timeout` seconds go offline; offline agents are forgotten after
+      another `forget_after` seconds
+    - `counts()` is O(1)
+
+    The heap holds (deadline, agent_id) entries. A heartbeat pushes a new entry rather than
+    updating the old one in place; entries whose deadline no longer matches the agent's
+    current one are skipped when popped, and the heap is rebuilt once they outnumber live ones.
+    """
+
+    def __init__(self, timeout: float = 300, forget_after: float = 86400):
+        self.timeout = timeout
+        self.forget_after = forget_after
+        self.agents: Dict[str, Dict] = {}
+        self.online = 0
+        self.offline = 0
+        self.expired = 0
+        self._heap: List = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def heartbeat(self, agent_id: str, **fields) -> Dict:
+        """Record that an agent is alive; `fields` (e.g. pool_id) are stored on its entry"""
+        now = time.time()
+        with self._cond:
+            agent = self.agents.get(agent_id)
+            if agent is None:
+                agent = self.agents[agent_id] = {'status': 'active', 'registered_at': now}
+                self.online += 1
+            elif agent['status'] != 'active':
+                agent['status'] = 'active'
+                self.offline -= 1
+                self.online += 1
+            agent.update((k, v) for k, v in fields.items() if v is not None)
+            agent['last_seen'] = now
+            self._schedule(agent_id, agent, now + self.timeout)
+            return agent
+
+    def get(self, agent_id: str) -> Optional[Dict]:
+        return self.agents.get(agent_id)
+
+    def is_online(self, agent_id: str) -> bool:
+        agent = self.agents.get(agent_id)
+        return agent is not None and agent['status'] == 'active'
+
+    def counts(self) -> Dict:
+        return {'online': self.online, 'offline': self.offline, 'registered': len(self.agents),
+                'expired': self.expired}
+
+    def expire(self, now: Optional[float] = None) -> float:
+        """Process every deadline up to `now`, returns the next deadline (or inf)"""
+        now = time.time() if now is None else now
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, agent_id = heapq.heappop(self._heap)
+                agent = self.agents.get(agent_id)
+                if agent is None or agent['expires'] != deadline:
+                    continue  # superseded by a later heartbeat
+                if agent['status'] == 'active':
+                    agent['status'] = 'offline'
+                    self.online -= 1
+                    self.offline += 1
+                    self.expired += 1
+                    print(f"[SERVER] Agent {agent_id} offline: no heartbeat for {self.timeout}s")
+                    self._schedule(agent_id, agent, deadline + self.forget_after)
+                else:
+                    del self.agents[agent_id]
+                    self.offline -= 1
+            return self._heap[0][0] if self._heap else float('inf')
+
+    def start(self):
+        """Run expiry in a daemon thread that wakes exactly at each deadline"""
+        self._thread = threading.Thread(target=self._run, name="agent-expiry", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def _schedule(self, agent_id, agent, deadline):
+        agent['expires'] = deadline
+        heapq.heappush(self._heap, (deadline, agent_id))
+        if len(self._heap) > 2 * len(self.agents) + 1024:
+            self._heap = [(a['expires'], a_id) for a_id, a in self.agents.items()]
+            heapq.heapify(self._heap)
+        if self._heap[0][0] == deadline:
+            self._cond.notify()  # the expiry thread may be sleeping towards a later deadline
+
+    def _run(self):
+        with self._cond:
+            while True:
+                next_deadline = self.expire()
+                self._cond.wait(None if next_deadline == float('inf') else max(next_deadline - time.time(), 0))
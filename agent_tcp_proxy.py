@@ -1,14 +1,569 @@
+import argparse
+import errno
+import http.server
+import ipaddress
+import json
+import os
+import selectors
+import signal
 import socket
+import sys
 import threading
+import time
+from array import array
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 LISTEN_HOST = '0.0.0.0'
 LISTEN_PORT = 2222
 FORWARD_HOST = 'PRIVATE_SERVER_IP'  # Replace with your private server IP
 FORWARD_PORT = 22  # SSH port
+BUFFER_SIZE = 256 * 1024  # bytes in flight per direction of each connection
+LISTEN_BACKLOG = 1024
+ACCEPT_BATCH = 64  # connections accepted per readiness event
+MAX_CONNECTIONS = 256  # per route; connections beyond it are refused
+IDLE_TIMEOUT = 3600  # seconds without traffic in either direction before a connection is closed
+CONNECT_TIMEOUT = 10  # seconds to reach the upstream
+DRAIN_TIMEOUT = 30  # seconds open connections get to finish on shutdown
+SWEEP_INTERVAL = 1.0  # seconds between timeout checks
+STATS_HOST = "127.0.0.1"
+
+# Per-route counters live in one preallocated array per route, indexed by these slots, so
+# accounting a chunk is a single in-place add with no allocation
+STAT_NAMES = ("bytes_in", "bytes_out", "connections_total", "refused", "connect_errors", "connect_timeouts",
+              "idle_closed", "io_errors", "connected", "connect_seconds_total", "connect_seconds_max",
+              "closed", "duration_seconds_total")
+(BYTES_IN, BYTES_OUT, CONNECTIONS_TOTAL, REFUSED, CONNECT_ERRORS, CONNECT_TIMEOUTS, IDLE_CLOSED, IO_ERRORS,
+ CONNECTED, CONNECT_SECONDS_TOTAL, CONNECT_SECONDS_MAX, CLOSED, DURATION_SECONDS_TOTAL) = range(len(STAT_NAMES))
+# Zero-copy path: data moves socket -> pipe -> socket inside the kernel
+SPLICE_SUPPORTED = sys.platform.startswith("linux") and hasattr(os, "splice")
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+
+class _BufferPool:
+    """
+    Preallocated copy buffers lent to directions only while they hold unsent data
+
+    Idle connections (most SSH sessions, most of the time) hold no buffer, so memory
+    follows the data in flight rather than the number of connections.
+    """
+
+    __slots__ = ("size", "free", "max_free")
+
+    def __init__(self, size, max_free=64):
+        self.size = size
+        self.max_free = max_free
+        self.free = [memoryview(bytearray(size)) for _ in range(min(8, max_free))]
+
+    def get(self):
+        return self.free.pop() if self.free else memoryview(bytearray(self.size))
+
+    def put(self, view):
+        if len(self.free) < self.max_free:
+            self.free.append(view)
+
+
+class _Direction:
+    """
+    One direction of a proxied connection
+
+    Bytes read from `src` wait in a pooled buffer (or, with splice, a kernel pipe) until
+    `dst` accepts them; nothing more is read from `src` until they are all written,
+    which gives natural backpressure. EOF on `src` is forwarded as a half-close on `dst`.
+    """
+
+    __slots__ = ("src", "dst", "size", "pool", "view", "start", "pending", "pipe_r", "pipe_w", "eof", "shut",
+                 "transferred", "counters", "slot")
+
+    def __init__(self, src, dst, buffer_size, pool, counters, slot):
+        self.src = src
+        self.dst = dst
+        self.size = buffer_size
+        self.pool = pool
+        self.transferred = 0  # bytes read from src over the connection's life
+        self.counters = counters  # the route's stats array; `slot` is BYTES_IN or BYTES_OUT
+        self.slot = slot
+        self.start = 0
+        self.pending = 0  # bytes read from src, not yet written to dst
+        self.eof = False  # src sent FIN
+        self.shut = False  # FIN forwarded to dst
+        self.view = self.pipe_r = self.pipe_w = None
+        if pool is None:
+            self.pipe_r, self.pipe_w = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+            try:
+                fcntl.fcntl(self.pipe_w, F_SETPIPE_SZ, buffer_size)
+            except OSError:
+                pass  # above /proc/sys/fs/pipe-max-size: keep the default pipe size
+
+    def fill(self):
+        """Read once from src; returns bytes read (0 at EOF), or None if it would block"""
+        try:
+            if self.pipe_w is not None:
+                count = os.splice(self.src.fileno(), self.pipe_w, self.size,
+                                  flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            else:
+                if self.view is None:
+                    self.view = self.pool.get()
+                count = self.src.recv_into(self.view)
+                self.start = 0
+        except (BlockingIOError, InterruptedError):
+            self._release()
+            return None
+        if count == 0:
+            self.eof = True
+            self._release()
+        else:
+            self.transferred += count
+            self.counters[self.slot] += count
+        self.pending = count
+        return count
+
+    def flush(self):
+        """Write as much pending data to dst as it takes; forwards EOF once drained"""
+        while self.pending:
+            try:
+                if self.pipe_r is not None:
+                    count = os.splice(self.pipe_r, self.dst.fileno(), self.pending,
+                                      flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                else:
+                    count = self.dst.send(self.view[self.start:self.start + self.pending])
+                    self.start += count
+            except (BlockingIOError, InterruptedError):
+                return
+            self.pending -= count
+        self._release()
+        if self.eof and not self.shut:
+            self.shut = True
+            try:
+                self.dst.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    def _release(self):
+        if self.view is not None:
+            self.pool.put(self.view)
+            self.view = None
+
+    def close(self):
+        self.pending = 0
+        self._release()
+        for fd in (self.pipe_r, self.pipe_w):
+            if fd is not None:
+                os.close(fd)
+        self.pipe_r = self.pipe_w = None
+
+
+class _Connection:
+    """A client socket, its upstream socket and the two directions between them"""
+
+    __slots__ = ("engine", "route", "client", "upstream", "up", "down", "connecting", "events",
+                 "peer", "started", "last_active", "connect_seconds", "closed")
+
+    def __init__(self, engine, route, client, upstream, peer):
+        self.engine = engine
+        self.route = route
+        self.client = client
+        self.upstream = upstream
+        self.up = _Direction(client, upstream, engine.buffer_size, engine.buffers, route.stats, BYTES_IN)
+        self.down = _Direction(upstream, client, engine.buffer_size, engine.buffers, route.stats, BYTES_OUT)
+        self.connecting = True
+        self.events = [0, 0]  # registered selector events for (upstream, client)
+        self.peer = peer
+        self.started = time.monotonic()
+        self.last_active = engine.now
+        self.connect_seconds = None
+        self.closed = False
+        route.active += 1
+        route.stats[CONNECTIONS_TOTAL] += 1
+
+    def on_event(self, is_client, mask):
+        self.last_active = self.engine.now
+        try:
+            if self.connecting:
+                error = self.upstream.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error:
+                    raise OSError(error, os.strerror(error))
+                self.connecting = False
+                self.connect_seconds = elapsed = time.monotonic() - self.started
+                stats = self.route.stats
+                stats[CONNECTED] += 1
+                stats[CONNECT_SECONDS_TOTAL] += elapsed
+                if elapsed > stats[CONNECT_SECONDS_MAX]:
+                    stats[CONNECT_SECONDS_MAX] = elapsed
+            else:
+                if mask & selectors.EVENT_READ:
+                    direction = self.up if is_client else self.down
+                    if not direction.pending and not direction.eof and direction.fill() is not None:
+                        direction.flush()  # usually the peer can take it right away
+                if mask & selectors.EVENT_WRITE:
+                    (self.down if is_client else self.up).flush()
+            if self.up.shut and self.down.shut:
+                self.close()
+            else:
+                self.update_interest()
+        except OSError:
+            self.close(CONNECT_ERRORS if self.connecting else IO_ERRORS)
+
+    def update_interest(self):
+        read, write = selectors.EVENT_READ, selectors.EVENT_WRITE
+        if self.connecting:
+            wanted = (write, 0)
+        else:
+            wanted = ((read if not self.down.pending and not self.down.eof else 0) | (write if self.up.pending else 0),
+                      (read if not self.up.pending and not self.up.eof else 0) | (write if self.down.pending else 0))
+        for index, sock in ((0, self.upstream), (1, self.client)):
+            self.engine._set_interest(sock, self.events[index], wanted[index], (self, index == 1))
+            self.events[index] = wanted[index]
+
+    def expired(self, now):
+        if self.connecting:
+            return now - self.started > self.route.connect_timeout
+        return now - self.last_active > self.route.idle_timeout
+
+    def snapshot(self, now):
+        return {"route": self.route.name, "client": f"{self.peer[0]}:{self.peer[1]}",
+                "age_seconds": round(time.monotonic() - self.started, 3),
+                "idle_seconds": round(now - self.last_active, 3),
+                "connecting": self.connecting,
+                "connect_ms": None if self.connect_seconds is None else round(self.connect_seconds * 1000, 3),
+                "bytes_in": self.up.transferred, "bytes_out": self.down.transferred}
+
+    def close(self, reason=None):
+        """Close both sockets; `reason` is the stats slot counting why (None for a normal close)"""
+        if self.closed:
+            return
+        self.closed = True
+        self.route.active -= 1
+        stats = self.route.stats
+        stats[CLOSED] += 1
+        stats[DURATION_SECONDS_TOTAL] += time.monotonic() - self.started
+        if reason is not None:
+            stats[reason] += 1
+        for index, sock in ((0, self.upstream), (1, self.client)):
+            if self.events[index]:
+                self.engine.selector.unregister(sock)
+                self.events[index] = 0
+            sock.close()
+        self.up.close()
+        self.down.close()
+        self.engine.connections.discard(self)
+
+
+class Route:
+    """One listen address forwarded to one upstream, with its own limits"""
+
+    __slots__ = ("name", "listen_host", "listen_port", "forward_host", "forward_port", "max_connections",
+                 "idle_timeout", "connect_timeout", "sock", "forward_family", "forward_addr", "active", "stats")
+
+    def __init__(self, listen_host, listen_port, forward_host, forward_port, name=None,
+                 max_connections=MAX_CONNECTIONS, idle_timeout=IDLE_TIMEOUT, connect_timeout=CONNECT_TIMEOUT):
+        self.name = name or f"{listen_host}:{listen_port}->{forward_host}:{forward_port}"
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.forward_host = forward_host
+        self.forward_port = forward_port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.sock = self.forward_family = self.forward_addr = None
+        self.active = 0
+        self.stats = array("d", bytes(8 * len(STAT_NAMES)))
+
+    def snapshot(self):
+        counters = dict(zip(STAT_NAMES, self.stats))
+        report = {"name": self.name, "listen": f"{self.listen_host}:{self.listen_port}",
+                  "forward": f"{self.forward_host}:{self.forward_port}", "active": self.active}
+        for name in STAT_NAMES[:CONNECT_SECONDS_TOTAL] + ("closed",):
+            report[name] = int(counters[name])
+        connected, closed = counters["connected"], counters["closed"]
+        report["connect_ms_avg"] = round(counters["connect_seconds_total"] / connected * 1000, 3) if connected else None
+        report["connect_ms_max"] = round(counters["connect_seconds_max"] * 1000, 3)
+        report["duration_seconds_avg"] = round(counters["duration_seconds_total"] / closed, 3) if closed else None
+        return report
+
+
+def _split_address(value, default_host=None):
+    host, _, port = value.rpartition(":")
+    return host or default_host, int(port)
+
+
+def load_routes(path):
+    """
+    Read proxy routes from a JSON file
+
+    {
+      "defaults": {"max_connections": 256, "idle_timeout": 3600, "connect_timeout": 10},
+      "drain_timeout": 30,
+      "stats_port": 9102,
+      "stats_interval": 60,
+      "routes": [
+        {"name": "db01-ssh", "listen": "0.0.0.0:2222", "forward": "10.0.0.5:22", "max_connections": 32},
+        {"name": "app-subnet", "listen": "0.0.0.0:2300", "forward_subnet": "10.0.1.0/28", "forward_port": 22}
+      ]
+    }
+
+    A `forward_subnet` route expands to one route per host address, on consecutive
+    listen ports starting at the given one (10.0.1.1 on 2300, 10.0.1.2 on 2301, ...).
 
-def handle_client(client_socket):
+    Returns:
+        (list of Route, settings dict with drain_timeout, stats_port and stats_interval)
+    """
+    with open(path) as f:
+        config = json.load(f)
+    defaults = config.get("defaults", {})
+    routes = []
+    for entry in config.get("routes", []):
+        options = {key: entry.get(key, defaults.get(key, default)) for key, default in (
+            ("max_connections", MAX_CONNECTIONS), ("idle_timeout", IDLE_TIMEOUT),
+            ("connect_timeout", CONNECT_TIMEOUT))}
+        listen_host, listen_port = _split_address(entry["listen"], LISTEN_HOST)
+        if "forward_subnet" in entry:
+            hosts = list(ipaddress.ip_network(entry["forward_subnet"], strict=False).hosts())
+            for offset, host in enumerate(hosts):
+                name = f"{entry.get('name', entry['forward_subnet'])}/{host}"
+                routes.append(Route(listen_host, listen_port + offset, str(host),
+                                    entry.get("forward_port", FORWARD_PORT), name=name, **options))
+        else:
+            forward_host, forward_port = _split_address(entry["forward"])
+            routes.append(Route(listen_host, listen_port, forward_host, forward_port,
+                                name=entry.get("name"), **options))
+    return routes, {"drain_timeout": config.get("drain_timeout", DRAIN_TIMEOUT),
+                    "stats_port": config.get("stats_port"), "stats_interval": config.get("stats_interval", 0)}
+
+
+class ProxyEngine:
+    """
+    Single-threaded, selector-based TCP proxy
+
+    One thread serves every listener and connection: no per-connection threads, no
+    per-chunk allocations (copies go through pooled preallocated buffers), and on Linux
+    the payload can bypass user space entirely through os.splice.
+
+    Connections that exceed their route's connect or idle timeout are closed by a sweep
+    every SWEEP_INTERVAL; drain() stops accepting and lets open connections finish.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE, use_splice=None, backlog=LISTEN_BACKLOG, stats_interval=0):
+        self.buffer_size = buffer_size
+        self.use_splice = SPLICE_SUPPORTED if use_splice is None else bool(use_splice) and SPLICE_SUPPORTED
+        self.backlog = backlog
+        self.buffers = None if self.use_splice else _BufferPool(buffer_size)
+        self.selector = selectors.DefaultSelector()
+        self.routes = []
+        self.connections = set()
+        self.now = time.monotonic()
+        self.started = time.time()
+        self.stats_interval = stats_interval  # seconds between [STATS] dumps to stdout, 0 for none
+        self._drain_deadline = None
+        self._running = False
+        self._thread = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def add_route(self, listen_host, listen_port=None, forward_host=None, forward_port=None, **options):
+        """
+        Listen on listen_host:listen_port and forward connections to forward_host:forward_port
+
+        Takes either the four addresses (plus Route options) or a Route.
+        Returns the bound listen port.
+        """
+        route = listen_host if isinstance(listen_host, Route) else Route(
+            listen_host, listen_port, forward_host, forward_port, **options)
+        family, _, _, _, route.forward_addr = socket.getaddrinfo(
+            route.forward_host, route.forward_port, type=socket.SOCK_STREAM)[0]
+        route.forward_family = family
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((route.listen_host, route.listen_port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        route.sock = sock
+        self.routes.append(route)
+        self.selector.register(sock, selectors.EVENT_READ, route)
+        return sock.getsockname()[1]
+
+    def serve_forever(self):
+        self._running = True
+        last_sweep = last_dump = self.now
+        while self._running:
+            events = self.selector.select(timeout=SWEEP_INTERVAL)
+            self.now = time.monotonic()
+            for key, mask in events:
+                handler = key.data
+                if handler is None:
+                    self._drain_wakeup()
+                elif isinstance(handler, Route):
+                    self._accept(handler)
+                else:
+                    connection, is_client = handler
+                    connection.on_event(is_client, mask)
+            if self.now - last_sweep >= SWEEP_INTERVAL:
+                last_sweep = self.now
+                self._sweep()
+            if self.stats_interval and self.now - last_dump >= self.stats_interval:
+                last_dump = self.now
+                print(f"[STATS] {json.dumps(self.stats(connections=False))}", flush=True)
+            if self._drain_deadline is not None:
+                self._close_listeners()
+                if not self.connections:
+                    break
+                if self.now > self._drain_deadline:
+                    print(f"Drain timeout: closing {len(self.connections)} open connection(s)")
+                    break
+        for connection in list(self.connections):
+            connection.close()
+        self._close_listeners()
+        self._running = False
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, name="proxy-engine", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stats(self, connections=True):
+        """
+        Counters for every route (and open connection), busiest routes first
+
+        Safe to call from another thread: it only reads counters and copies the connection set.
+        """
+        now = time.monotonic()
+        routes = sorted((route.snapshot() for route in self.routes),
+                        key=lambda r: r["bytes_in"] + r["bytes_out"], reverse=True)
+        report = {"uptime_seconds": round(time.time() - self.started, 1), "draining": self.draining,
+                  "active": len(self.connections), "routes": routes}
+        if connections:
+            report["connections"] = [c.snapshot(now) for c in list(self.connections)]
+        return report
+
+    @property
+    def draining(self):
+        return self._drain_deadline is not None
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Stop accepting, then stop once open connections finish (or after `timeout`)"""
+        self._drain_deadline = time.monotonic() + timeout
+        self._wake()
+
+    def stop(self):
+        """Stop now, closing open connections"""
+        self._running = False
+        self._wake()
+        self.join()
+
+    def join(self, timeout=None):
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _accept(self, route):
+        if self._drain_deadline is not None:
+            return
+        for _ in range(ACCEPT_BATCH):
+            try:
+                client, peer = route.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"[{route.name}] Accept failed: {e}")
+                return
+            if route.active >= route.max_connections:
+                # Refuse right away rather than leave the client hanging in the backlog
+                print(f"[{route.name}] Refusing connection: {route.max_connections} connections open")
+                route.stats[REFUSED] += 1
+                client.close()
+                continue
+            upstream = socket.socket(route.forward_family, socket.SOCK_STREAM)
+            for sock in (client, upstream):
+                sock.setblocking(False)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _Connection(self, route, client, upstream, peer)
+            self.connections.add(connection)
+            error = upstream.connect_ex(route.forward_addr)
+            if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", -1)):
+                print(f"[{route.name}] Connect to {route.forward_host}:{route.forward_port} failed: "
+                      f"{os.strerror(error)}")
+                connection.close(CONNECT_ERRORS)
+                continue
+            connection.update_interest()
+
+    def _sweep(self):
+        for connection in [c for c in self.connections if c.expired(self.now)]:
+            route = connection.route
+            print(f"[{route.name}] Closing {'unconnected' if connection.connecting else 'idle'} connection")
+            connection.close(CONNECT_TIMEOUTS if connection.connecting else IDLE_CLOSED)
+
+    def _close_listeners(self):
+        for route in self.routes:
+            if route.sock is not None:
+                self.selector.unregister(route.sock)
+                route.sock.close()
+                route.sock = None
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending
+
+    def _set_interest(self, sock, current, wanted, data):
+        if wanted == current:
+            return
+        if not current:
+            self.selector.register(sock, wanted, data)
+        elif not wanted:
+            self.selector.unregister(sock)
+        else:
+            self.selector.modify(sock, wanted, data)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+
+class _StatsHandler(http.server.BaseHTTPRequestHandler):
+    engine = None
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path != "/stats":
+            self.send_error(404)
+            return
+        body = json.dumps(self.engine.stats(connections="connections=0" not in query), indent=2).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stats(engine, port, host=STATS_HOST):
+    """
+    Serve GET /stats (JSON; ?connections=0 for route totals only) from a background thread
+
+    Returns:
+        The HTTPServer; its server_address holds the bound port
+    """
+    handler = type("StatsHandler", (_StatsHandler,), {"engine": engine})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="proxy-stats", daemon=True).start()
+    return server
+
+
+def handle_client(client_socket, forward_host=None, forward_port=None):
+    """Thread-per-direction proxying (the original engine, kept as a fallback and benchmark baseline)"""
     remote = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    remote.connect((FORWARD_HOST, FORWARD_PORT))
+    remote.connect((forward_host or FORWARD_HOST, forward_port or FORWARD_PORT))
     def forward(src, dst):
         while True:
             data = src.recv(4096)
@@ -18,14 +573,73 @@ def handle_client(client_socket):
     threading.Thread(target=forward, args=(client_socket, remote)).start()
     threading.Thread(target=forward, args=(remote, client_socket)).start()
 
-def main():
+def serve_threaded(listen_host, listen_port, forward_host, forward_port, backlog=LISTEN_BACKLOG):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind((LISTEN_HOST, LISTEN_PORT))
-    server.listen(5)
-    print(f"Proxy listening on {LISTEN_HOST}:{LISTEN_PORT}, forwarding to {FORWARD_HOST}:{FORWARD_PORT}")
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((listen_host, listen_port))
+    server.listen(backlog)
     while True:
         client_sock, addr = server.accept()
-        threading.Thread(target=handle_client, args=(client_sock,)).start()
+        threading.Thread(target=handle_client, args=(client_sock, forward_host, forward_port)).start()
+
+def main():
+    parser = argparse.ArgumentParser(description="TCP proxy for backend-initiated SSH/Ansible connections")
+    parser.add_argument("--config", help="JSON file with many routes (see load_routes); replaces the single-route flags")
+    parser.add_argument("--listen-host", default=LISTEN_HOST)
+    parser.add_argument("--listen-port", type=int, default=LISTEN_PORT)
+    parser.add_argument("--forward-host", default=FORWARD_HOST)
+    parser.add_argument("--forward-port", type=int, default=FORWARD_PORT)
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT)
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT)
+    parser.add_argument("--stats-port", type=int, help=f"serve GET /stats on {STATS_HOST}:PORT")
+    parser.add_argument("--stats-interval", type=float, default=0, help="print [STATS] every N seconds")
+    parser.add_argument("--engine", choices=["selector", "threads"], default="selector")
+    parser.add_argument("--buffer-size", type=int, default=BUFFER_SIZE)
+    parser.add_argument("--no-splice", action="store_true", help="copy through user-space buffers")
+    args = parser.parse_args()
+
+    if args.engine == "threads":
+        print(f"Proxy listening on {args.listen_host}:{args.listen_port}, "
+              f"forwarding to {args.forward_host}:{args.forward_port} (threads engine)")
+        serve_threaded(args.listen_host, args.listen_port, args.forward_host, args.forward_port)
+        return
+
+    if args.config:
+        routes, settings = load_routes(args.config)
+        drain_timeout = settings["drain_timeout"]
+        stats_port = args.stats_port or settings["stats_port"]
+        stats_interval = args.stats_interval or settings["stats_interval"]
+    else:
+        routes = [Route(args.listen_host, args.listen_port, args.forward_host, args.forward_port,
+                        max_connections=args.max_connections, idle_timeout=args.idle_timeout,
+                        connect_timeout=args.connect_timeout)]
+        drain_timeout = args.drain_timeout
+        stats_port, stats_interval = args.stats_port, args.stats_interval
+    engine = ProxyEngine(buffer_size=args.buffer_size, use_splice=not args.no_splice, stats_interval=stats_interval)
+    for route in routes:
+        engine.add_route(route)
+        print(f"Proxy listening on {route.listen_host}:{route.listen_port}, "
+              f"forwarding to {route.forward_host}:{route.forward_port} ({route.name})")
+    print(f"{len(routes)} route(s), selector engine, zero-copy splice: {'on' if engine.use_splice else 'off'}, "
+          f"buffer {args.buffer_size} bytes")
+    if stats_port:
+        serve_stats(engine, stats_port)
+        print(f"Stats on http://{STATS_HOST}:{stats_port}/stats")
+
+    def shutdown(signum, frame):
+        if engine.draining:
+            print("Stopping now")
+            engine.stop()
+            return
+        print(f"Draining: no new connections, {len(engine.connections)} open get up to {drain_timeout}s")
+        engine.drain(drain_timeout)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    engine.serve_forever()
+    print("Proxy stopped")
 
 if __name__ == "__main__":
     main()
@@ -3,25 +3,140 @@
 from flask import Flask, request, jsonify # pip install Flask
 import uuid
 import logging
-import queue # For a simple in-memory queue, replace with Redis/DB for production
+import collections
+import threading
+import time
+from job_runner import parse_wait
+from task_pool import TaskPool
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+MAX_POLL_WAIT = 30 # Upper bound on how long a GET /api/commands may block waiting for work
+MAX_RESULT_WAIT = 30 # Upper bound on how long a result fetch may block waiting for the agent
+DEFAULT_POOL_BATCH = 10 # Commands leased from a pool per poll when the agent sets no max_commands
+
+class AgentQueue:
+    """
+    One agent's pending commands
+
+    Pollers block in `take()` until a command is queued (or `wake()` is called because
+    the agent's pool got work) instead of sleeping blindly between polls.
+    """
+
+    def __init__(self):
+        self.commands = collections.deque()
+        self.version = 0 # Bumped on every put/wake so a waiter cannot miss one
+        self._cond = threading.Condition()
+
+    def put(self, command_payload):
+        with self._cond:
+            self.commands.append(command_payload)
+            self.version += 1
+            self._cond.notify_all()
+
+    def wake(self):
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+
+    def take(self, max_commands=None):
+        """Pop up to `max_commands` (all if None) queued commands without blocking"""
+        with self._cond:
+            count = len(self.commands) if max_commands is None else min(max_commands, len(self.commands))
+            return [self.commands.popleft() for _ in range(count)]
+
+    def wait(self, version, timeout):
+        """Block until something is queued or woken after `version` was read, or `timeout` passes"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.version == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def __len__(self):
+        return len(self.commands)
+
 # --- Simple In-Memory Queue (Replace with persistent storage like Redis, DB for production) ---
-command_queue = {} # Stores commands {agent_id: [command_payload1, command_payload2]}
+command_queue = {} # Stores commands {agent_id: AgentQueue}
 command_results = {} # Stores results {correlation_id: result_payload}
+command_pools = {} # Stores shared queues {pool_id: TaskPool} for redundant agents
+leased_commands = {} # Stores {correlation_id: pool_id} for commands handed out by a pool
+registry_lock = threading.Lock() # Guards creation of per-agent queues and pools
+results_cond = threading.Condition() # Notified whenever a result arrives
+
+def wait_for_results(correlation_ids, timeout, wait_for_all=True):
+    """
+    Results that have arrived for `correlation_ids`, blocking up to `timeout` seconds
+    until all of them (or, with wait_for_all=False, any of them) are in
+
+    Returns:
+        (results dict {correlation_id: result_payload}, list of pending correlation ids)
+    """
+    deadline = time.monotonic() + timeout
+    with results_cond:
+        while True:
+            results = {cid: command_results[cid] for cid in correlation_ids if cid in command_results}
+            pending = [cid for cid in correlation_ids if cid not in results]
+            remaining = deadline - time.monotonic()
+            if not pending or (results and not wait_for_all) or remaining <= 0:
+                return results, pending
+            results_cond.wait(remaining)
+
+def get_agent_queue(agent_id):
+    with registry_lock:
+        if agent_id not in command_queue:
+            command_queue[agent_id] = AgentQueue()
+        return command_queue[agent_id]
+
+def get_command_pool(pool_id):
+    with registry_lock:
+        if pool_id not in command_pools:
+            command_pools[pool_id] = TaskPool(pool_id, id_key="correlation_id")
+        return command_pools[pool_id]
 
 # --- API Endpoint for Agents to Poll for Commands ---
 @app.route("/api/commands", methods=["GET"])
 def get_commands_for_agent():
+    """
+    Pending commands for an agent
+
+    `max_commands` caps the batch (default: everything queued for the agent, plus up to
+    DEFAULT_POOL_BATCH pool commands); `wait` long-polls up to that many seconds
+    (at most MAX_POLL_WAIT) when nothing is pending.
+    """
     agent_id = request.args.get("agent_id")
     if not agent_id:
         return jsonify({"error": "agent_id is required"}), 400
+    pool_id = request.args.get("pool_id")
+    max_commands = request.args.get("max_commands", type=int)
+    if max_commands is not None and max_commands < 1:
+        return jsonify({"error": "max_commands must be at least 1"}), 400
+    try:
+        wait = parse_wait(request.args.get("wait", 0), MAX_POLL_WAIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Retrieve commands for this agent
-    commands_to_send = command_queue.get(agent_id, [])
-    command_queue[agent_id] = [] # Clear commands after sending
+    agent_queue = get_agent_queue(agent_id)
+    deadline = time.monotonic() + wait
+    while True:
+        version = agent_queue.version
+        commands_to_send = agent_queue.take(max_commands)
+        # Agents that are members of a pool also lease from the pool's shared queue
+        if pool_id:
+            pool_batch = DEFAULT_POOL_BATCH if max_commands is None else max_commands - len(commands_to_send)
+            if pool_batch > 0:
+                leased = get_command_pool(pool_id).lease(agent_id, max_tasks=pool_batch)
+                for command in leased:
+                    leased_commands[command["correlation_id"]] = pool_id
+                commands_to_send = commands_to_send + leased
+        remaining = deadline - time.monotonic()
+        if commands_to_send or remaining <= 0:
+            break
+        agent_queue.wait(version, remaining)
 
     logging.info(f"Agent '{agent_id}' polled. Sending {len(commands_to_send)} commands.")
     return jsonify(commands_to_send)
@@ -34,36 +149,107 @@ def receive_command_results():
     if not correlation_id:
         return jsonify({"error": "correlation_id is required"}), 400
 
-    command_results[correlation_id] = result_payload
+    with results_cond:
+        command_results[correlation_id] = result_payload
+        results_cond.notify_all()
+    pool_id = leased_commands.pop(correlation_id, None)
+    if pool_id:
+        command_pools[pool_id].ack(correlation_id)
     logging.info(f"Received results for correlation_id: {correlation_id}")
     return jsonify({"status": "success"})
 
+# --- Endpoints for Orchestrators to Fetch Results ---
+@app.route("/api/commands/results/<correlation_id>", methods=["GET"])
+def get_command_result(correlation_id):
+    """Result of one command; `wait` blocks up to that many seconds (at most MAX_RESULT_WAIT) for it"""
+    try:
+        wait = parse_wait(request.args.get("wait", 0), MAX_RESULT_WAIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    results, _ = wait_for_results([correlation_id], wait)
+    if not results:
+        return jsonify({"status": "pending", "correlation_id": correlation_id}), 202
+    return jsonify(results[correlation_id])
+
+@app.route("/api/commands/results/batch", methods=["POST"])
+def get_command_results_batch():
+    """
+    Results for many commands in one request
+
+    Body: {"correlation_ids": [...], "wait": seconds, "wait_for": "all" | "any"}
+    Blocks until every result (or the first one, for "any") is in or `wait` passes.
+    """
+    data = request.json or {}
+    correlation_ids = data.get("correlation_ids")
+    if not isinstance(correlation_ids, list) or not correlation_ids:
+        return jsonify({"error": "correlation_ids must be a non-empty list"}), 400
+    wait_for = data.get("wait_for", "all")
+    if wait_for not in ("all", "any"):
+        return jsonify({"error": "wait_for must be 'all' or 'any'"}), 400
+    try:
+        wait = parse_wait(data.get("wait", 0), MAX_RESULT_WAIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    results, pending = wait_for_results(correlation_ids, wait, wait_for_all=wait_for == "all")
+    return jsonify({"results": results, "pending": pending})
+
 # --- Endpoint to Queue a Command for the Agent ---
 @app.route("/api/queue_command", methods=["POST"])
 def queue_command():
     data = request.json
     target_agent_id = data.get("agent_id")
+    pool_id = data.get("pool_id") # Any live member of the pool may run the command
     target_host = data.get("target_host")
+    target_hosts = data.get("target_hosts") # Run the same command on many hosts in one round trip
+    host_group = data.get("host_group") # ... or on a host group defined on the agent
     target_type = data.get("target_type")
     command_to_execute = data.get("command")
 
-    if not all([target_agent_id, target_host, target_type, command_to_execute]):
+    if not all([target_agent_id or pool_id, target_host or target_hosts or host_group, command_to_execute]):
+        return jsonify({"error": "Missing required fields"}), 400
+    if not target_type and not host_group:
         return jsonify({"error": "Missing required fields"}), 400
+    if target_hosts is not None and not isinstance(target_hosts, list):
+        return jsonify({"error": "target_hosts must be a list"}), 400
+    max_concurrency = data.get("max_concurrency")
+    if "max_concurrency" in data and (not isinstance(max_concurrency, int) or isinstance(max_concurrency, bool)
+                                      or max_concurrency < 1):
+        return jsonify({"error": "max_concurrency must be an integer >= 1"}), 400
 
     correlation_id = str(uuid.uuid4())
     command_payload = {
         "correlation_id": correlation_id,
-        "target_host": target_host,
         "target_type": target_type,
         "command": command_to_execute
     }
+    if target_hosts:
+        command_payload["target_hosts"] = target_hosts
+    elif host_group:
+        command_payload["host_group"] = host_group
+    else:
+        command_payload["target_host"] = target_host
+    if max_concurrency:
+        command_payload["max_concurrency"] = max_concurrency
 
-    if target_agent_id not in command_queue:
-        command_queue[target_agent_id] = []
-    command_queue[target_agent_id].append(command_payload)
+    if pool_id:
+        pool = get_command_pool(pool_id)
+        pool.submit(command_payload, agent_id=target_agent_id)
+        for member_id in pool.stats()["members"]: # Any of them may lease it, wake their long-polls
+            get_agent_queue(member_id).wake()
+        logging.info(f"Queued command for pool '{pool_id}' (Correlation ID: {correlation_id})")
+        return jsonify({"status": "queued", "correlation_id": correlation_id, "pool_id": pool_id})
+
+    get_agent_queue(target_agent_id).put(command_payload)
 
     logging.info(f"Queued command for agent '{target_agent_id}' (Correlation ID: {correlation_id})")
     return jsonify({"status": "queued", "correlation_id": correlation_id})
 
+# --- Endpoint to inspect a pool ---
+@app.route("/api/pools/<pool_id>", methods=["GET"])
+def get_pool_status(pool_id):
+    if pool_id not in command_pools:
+        return jsonify({"error": "Pool not found"}), 404
+    return jsonify(command_pools[pool_id].stats())
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True) # Ensure port 5000 is open in cloud server firewall
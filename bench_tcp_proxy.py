@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark: agent_tcp_proxy engines
+Runs the selector engine (with and without os.splice) and the original thread-per-direction
+engine in front of a local echo server, each proxy in its own process, and measures:
+
+  - throughput: MB/s echoed through the proxy by a few bulk streams
+  - concurrency: many connections doing small request/response round trips (like
+    interactive SSH), with the proxy's thread count and resident memory under that load
+
+Usage:
+    python bench_tcp_proxy.py [--megabytes 200] [--streams 4] [--connections 500] [--round-trips 20]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ENGINES = {
+    "selector+splice": ["--engine", "selector"],
+    "selector": ["--engine", "selector", "--no-splice"],
+    "threads": ["--engine", "threads"],
+}
+
+ECHO_SERVER = """
+import asyncio, sys
+async def echo(reader, writer):
+    while data := await reader.read(262144):
+        writer.write(data)
+        await writer.drain()
+    writer.close()
+async def main():
+    server = await asyncio.start_server(echo, "127.0.0.1", int(sys.argv[1]), backlog=4096)
+    await server.serve_forever()
+asyncio.run(main())
+"""
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    sys.exit(f"nothing listening on port {port}")
+
+
+def proc_status(pid):
+    """(threads, RSS in MB) of a process, from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) / 1024
+    except OSError:
+        return None, None
+
+
+async def bulk_stream(port, total):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    chunk = os.urandom(256 * 1024)
+
+    async def send():
+        sent = 0
+        while sent < total:
+            writer.write(chunk)
+            await writer.drain()
+            sent += len(chunk)
+
+    sender = asyncio.create_task(send())
+    received = 0
+    # Count bytes rather than wait for EOF: the threads engine does not forward half-closes
+    while received < total:
+        data = await reader.read(1024 * 1024)
+        if not data:
+            break
+        received += len(data)
+    await sender
+    writer.close()
+    return received
+
+
+async def throughput(port, megabytes, streams):
+    per_stream = megabytes * 1024 * 1024 // streams
+    started = time.perf_counter()
+    received = await asyncio.gather(*(bulk_stream(port, per_stream) for _ in range(streams)))
+    return sum(received) / (1024 * 1024) / (time.perf_counter() - started)
+
+
+async def concurrency(port, connections, round_trips, proxy_pid):
+    message = b"x" * 64
+    opened = []
+    for _ in range(connections):
+        opened.append(await asyncio.open_connection("127.0.0.1", port))
+    threads, rss = proc_status(proxy_pid)
+
+    async def chat(reader, writer):
+        for _ in range(round_trips):
+            writer.write(message)
+            await reader.readexactly(len(message))
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(chat(reader, writer) for reader, writer in opened))
+    return connections * round_trips / (time.perf_counter() - started), threads, rss
+
+
+def main():
+    sys.stdout.reconfigure(line_buffering=True)
+    parser = argparse.ArgumentParser(description="Benchmark agent_tcp_proxy engines")
+    parser.add_argument("--megabytes", type=int, default=200)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--round-trips", type=int, default=20)
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    args = parser.parse_args()
+
+    echo_port = free_port()
+    echo = subprocess.Popen([sys.executable, "-c", ECHO_SERVER, str(echo_port)])
+    wait_for_port(echo_port)
+    print(f"{args.megabytes} MB over {args.streams} streams; {args.connections} connections x "
+          f"{args.round_trips} round trips\n")
+    print(f"{'engine':<18}{'MB/s':>10}{'round trips/s':>16}{'threads':>10}{'RSS MB':>10}")
+    try:
+        for name in args.engines:
+            port = free_port()
+            proxy = subprocess.Popen([sys.executable, "agent_tcp_proxy.py", "--listen-host", "127.0.0.1",
+                                      "--listen-port", str(port), "--forward-host", "127.0.0.1",
+                                      "--forward-port", str(echo_port)] + ENGINES[name],
+                                     stdout=subprocess.DEVNULL)
+            try:
+                wait_for_port(port)
+                mb_per_second = asyncio.run(throughput(port, args.megabytes, args.streams))
+                trips_per_second, threads, rss = asyncio.run(
+                    concurrency(port, args.connections, args.round_trips, proxy.pid))
+                print(f"{name:<18}{mb_per_second:>10.0f}{trips_per_second:>16.0f}"
+                      f"{threads if threads is not None else '-':>10}{rss if rss is not None else 0:>10.1f}")
+            finally:
+                proxy.terminate()
+                proxy.wait()
+    finally:
+        echo.terminate()
+        echo.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark: windows_agent Linux execution backends
+Runs the same command N times through execute_command_on_private_server with the
+in-process paramiko backend (cached session) and the ssh subprocess backend, against
+a local in-process SSH server, and prints per-command latency for each.
+
+Usage:
+    python bench_windows_agent_ssh.py [--iterations 50] [--command "uptime"]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from local_ssh_server import LocalSSHServer
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def run_backend(windows_agent, backend, command, iterations):
+    windows_agent.LINUX_SSH_BACKEND = backend
+    windows_agent.ssh_sessions.close_all()
+    payload = {"target_host": "127.0.0.1", "target_type": "linux", "command": command, "correlation_id": "bench"}
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = windows_agent.execute_command_on_private_server(payload)
+        samples.append(time.perf_counter() - started)
+        if result["status"] != "success":
+            sys.exit(f"{backend} backend failed: {result}")
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark windows_agent Linux execution backends")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--command", default="echo benchmark")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)  # windows_agent writes agent_log.txt to the working directory
+    import windows_agent
+
+    server = LocalSSHServer().start()
+    creds = {"username": server.username, "port": server.port,
+             "ssh_key_path": server.write_client_key(os.path.join(work_dir, "id_rsa"))}
+    windows_agent.get_credentials = lambda target_type, target_host: creds
+    windows_agent.SSH_EXECUTABLE = "ssh"
+    windows_agent.SSH_EXTRA_ARGS = ["-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+                                    "-o", "BatchMode=yes", "-o", "LogLevel=ERROR"]
+
+    backends = ["paramiko"] + (["subprocess"] if shutil.which("ssh") else [])
+    print(f"{args.iterations} x {args.command!r} against 127.0.0.1:{server.port}\n")
+    print(f"{'backend':<12}{'first ms':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}{'connections':>13}")
+    for backend in backends:
+        connections_before = server.connections
+        samples = run_backend(windows_agent, backend, args.command, args.iterations)
+        print(f"{backend:<12}{samples[0] * 1000:>10.1f}{statistics.mean(samples) * 1000:>10.1f}"
+              f"{percentile(samples, 50) * 1000:>10.1f}{percentile(samples, 95) * 1000:>10.1f}"
+              f"{sum(samples):>10.2f}{server.connections - connections_before:>13}")
+    if "subprocess" not in backends:
+        print("\nssh client not found, subprocess backend skipped")
+
+    windows_agent.ssh_sessions.close_all()
+    server.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
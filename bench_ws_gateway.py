@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Load test: ws_gateway connection capacity by worker count
+For each worker count, starts a gateway on a local port, connects many simulated agents
+from several client processes (each agent registers, resumes and answers heartbeats and
+commands like ws_agent), then routes commands to random agents through the broker.
+
+Prints per worker count: agent connections/s, heartbeat round trips/s, routed commands/s
+and how the agents spread over the workers.
+
+Usage:
+    python bench_ws_gateway.py [--workers 1 2 4] [--agents 2000] [--clients 4] [--commands 500]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+from ws_gateway import BrokerClient
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def simulated_agent(url, agent_id, heartbeats, stop, on_ready):
+    async with websockets.connect(url, compression="deflate", open_timeout=60) as ws:
+        await ws.send(agent_id)
+        await ws.send(json.dumps({"type": "resume", "agent_id": agent_id, "in_flight": []}))
+        await ws.recv()  # resume_ack
+        connected_at = time.perf_counter()
+        for _ in range(heartbeats):
+            await ws.send(json.dumps({"type": "heartbeat", "agent_id": agent_id, "in_flight": []}))
+            while json.loads(await ws.recv()).get("type") != "heartbeat_ack":
+                pass
+        heartbeats_done_at = time.perf_counter()
+        on_ready(agent_id)
+
+        async def answer_commands():
+            async for message in ws:
+                data = json.loads(message)
+                if "correlation_id" in data:
+                    await ws.send(json.dumps({"agent_id": agent_id, "correlation_id": data["correlation_id"],
+                                              "result": {"stdout": data.get("cmd", ""), "returncode": 0}}))
+
+        answering = asyncio.create_task(answer_commands())
+        await stop.wait()
+        answering.cancel()
+        return connected_at, heartbeats_done_at
+
+
+def client_process(url, agent_ids, heartbeats, results, stop_event):
+    async def run():
+        stop = asyncio.Event()
+        all_ready = asyncio.Event()
+        ready = set()
+
+        def on_ready(agent_id):
+            ready.add(agent_id)
+            if len(ready) == len(agent_ids):
+                all_ready.set()
+
+        async def tracked(agent_id):
+            try:
+                return await simulated_agent(url, agent_id, heartbeats, stop, on_ready)
+            finally:
+                on_ready(agent_id)  # failed agents count as settled too
+
+        started = time.perf_counter()
+        agents = [asyncio.create_task(tracked(agent_id)) for agent_id in agent_ids]
+        # Report once every agent is connected and done with its heartbeats, then hold the connections
+        await all_ready.wait()
+        results.put(("ready", started))
+        while not stop_event.is_set():
+            await asyncio.sleep(0.1)
+        stop.set()
+        timings = await asyncio.gather(*agents, return_exceptions=True)
+        ok = [t for t in timings if not isinstance(t, Exception)]
+        results.put(("done", started, [t[0] for t in ok], [t[1] for t in ok], len(timings) - len(ok)))
+
+    asyncio.run(run())
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit(f"gateway did not start on port {port}")
+
+
+async def route_commands(broker_port, agent_ids, count):
+    controller = await BrokerClient("bench-controller", port=broker_port).connect()
+    stats = await controller.stats()
+    started = time.perf_counter()
+    targets = [random.choice(agent_ids) for _ in range(count)]
+    results = await asyncio.gather(*(controller.request(agent_id, {"cmd": f"echo {i}"}, timeout=30)
+                                     for i, agent_id in enumerate(targets)), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    controller.close()
+    failures = sum(1 for r in results if isinstance(r, Exception) or r.get("returncode") != 0)
+    return stats, count / elapsed, failures
+
+
+def run_once(workers, agents, clients, heartbeats, commands):
+    port, broker_port = free_port(), free_port()
+    gateway = subprocess.Popen([sys.executable, "ws_gateway.py", "--workers", str(workers), "--host", "127.0.0.1",
+                                "--port", str(port), "--broker-port", str(broker_port)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        time.sleep(0.5 + 0.2 * workers)  # let every worker bind before connecting
+        context = multiprocessing.get_context("spawn")
+        results, stop_event = context.Queue(), context.Event()
+        agent_ids = [f"bench-{i}" for i in range(agents)]
+        processes = [context.Process(target=client_process,
+                                     args=(f"ws://127.0.0.1:{port}", agent_ids[i::clients], heartbeats,
+                                           results, stop_event))
+                     for i in range(clients)]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            results.get(timeout=300)
+
+        stats, commands_per_second, command_failures = asyncio.run(route_commands(broker_port, agent_ids, commands))
+
+        stop_event.set()
+        done = [results.get(timeout=60) for _ in processes]
+        for process in processes:
+            process.join()
+        started = min(d[1] for d in done)
+        connected = [t for d in done for t in d[2]]
+        heartbeat_done = [t for d in done for t in d[3]]
+        failed = sum(d[4] for d in done)
+        return {
+            "connections_per_s": len(connected) / (max(connected) - started),
+            "heartbeats_per_s": len(heartbeat_done) * heartbeats / (max(heartbeat_done) - started),
+            "commands_per_s": commands_per_second,
+            "failed": failed + command_failures,
+            "spread": sorted(stats["workers"].get(f"worker-{i}", 0) for i in range(workers)),
+        }
+    finally:
+        gateway.terminate()
+        gateway.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test ws_gateway across worker counts")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--agents", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--heartbeats", type=int, default=5, help="heartbeat round trips per agent")
+    parser.add_argument("--commands", type=int, default=500, help="commands routed through the broker")
+    args = parser.parse_args()
+
+    print(f"{args.agents} agents from {args.clients} client processes, {multiprocessing.cpu_count()} CPU(s)\n")
+    print(f"{'workers':>8}{'conn/s':>10}{'hb rt/s':>10}{'cmd/s':>10}{'failed':>8}  agents per worker")
+    for workers in args.workers:
+        r = run_once(workers, args.agents, args.clients, args.heartbeats, args.commands)
+        print(f"{workers:>8}{r['connections_per_s']:>10.0f}{r['heartbeats_per_s']:>10.0f}"
+              f"{r['commands_per_s']:>10.0f}{r['failed']:>8}  {r['spread']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Background Job Runner
+Runs shell commands in a bounded pool of worker threads so HTTP handlers can
+return a job ID immediately and fetch or stream the output later. The job_*_response
+helpers implement the status, stream and cancel routes shared by the Flask apps.
+"""
+
+import collections
+import math
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import Response, jsonify, request, stream_with_context
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+FINISHED_STATES = (SUCCEEDED, FAILED, TIMEOUT, CANCELLED)
+
+
+def parse_timeout(value):
+    """Client-supplied timeout as positive seconds, raises ValueError for anything else (null included)"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timeout: {value!r}")
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid timeout: {value!r}") from None
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(f"Timeout must be a positive number of seconds, got {value!r}")
+    return seconds
+
+
+def parse_wait(value, limit):
+    """Seconds a request may block, clamped to [0, limit]; raises ValueError unless `value` is a finite number"""
+    if value is None or isinstance(value, bool):
+        raise ValueError("wait must be a number of seconds")
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("wait must be a number of seconds") from None
+    if not math.isfinite(seconds):
+        raise ValueError("wait must be a finite number of seconds")
+    return min(max(seconds, 0), limit)
+
+
+class Job:
+    """A single command run with its incrementally captured output"""
+
+    def __init__(self, command, shell=True, timeout=None, cwd=None, max_output_bytes=10 * 1024 * 1024, key=None):
+        self.job_id = str(uuid.uuid4())
+        self.command = command
+        self.key = key  # jobs sharing a key never run at the same time
+        self.shell = shell
+        self.timeout = timeout
+        self.cwd = cwd
+        self.status = QUEUED
+        self.returncode = None
+        self.error = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+
+        self.max_output_bytes = max_output_bytes
+        self.output_bytes = 0
+        self.truncated = False
+        self._chunks = collections.deque()  # (stream, data) tuples
+        self._base = 0  # absolute index of _chunks[0]
+        self._process = None
+        self._cancel_requested = False
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def append_output(self, stream, data):
+        with self._cond:
+            self._chunks.append((stream, data))
+            self.output_bytes += len(data)
+            while self.output_bytes > self.max_output_bytes and len(self._chunks) > 1:
+                _, dropped = self._chunks.popleft()
+                self.output_bytes -= len(dropped)
+                self._base += 1
+                self.truncated = True
+            self._cond.notify_all()
+
+    def read_output(self, offset=0, wait=0.0):
+        """
+        Return output chunks from `offset` on
+
+        Args:
+            offset: Absolute chunk index returned as `next_offset` by a previous call
+            wait: Seconds to block for new output if there is none yet
+        Returns:
+            (chunks, next_offset) where chunks is a list of {"stream", "data"} dicts
+        """
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while offset >= self._base + len(self._chunks) and not self.finished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            start = max(offset, self._base) - self._base
+            chunks = [{"stream": s, "data": d} for s, d in list(self._chunks)[start:]]
+            return chunks, self._base + len(self._chunks)
+
+    def collected(self, stream):
+        with self._cond:
+            return "".join(d for s, d in self._chunks if s == stream)
+
+    def wait(self, timeout=None):
+        """Block until the job has finished, returns True if it did"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self.finished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _start(self):
+        """QUEUED -> RUNNING, returns False if the job was cancelled first"""
+        with self._cond:
+            if self.status != QUEUED:
+                return False
+            self.started_at = datetime.now().isoformat()
+            self._set_status(RUNNING)
+            return True
+
+    def _set_status(self, status):
+        with self._cond:
+            self.status = status
+            if status in FINISHED_STATES:
+                self.finished_at = datetime.now().isoformat()
+            self._cond.notify_all()
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "command": self.command,
+            "key": self.key,
+            "status": self.status,
+            "returncode": self.returncode,
+            "error": self.error,
+            "timeout": self.timeout,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "output_bytes": self.output_bytes,
+            "truncated": self.truncated,
+        }
+
+
+class JobRunner:
+    """
+    Bounded pool of worker threads executing Jobs
+
+    At most `max_workers` commands run at the same time; further submissions wait
+    in a FIFO queue. A job submitted with a `key` also waits while another job with the
+    same key is running. Finished jobs are kept for `max_finished_jobs` lookups.
+    """
+
+    def __init__(self, max_workers=4, max_finished_jobs=200, name="job"):
+        self.max_workers = max_workers
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, Job] = collections.OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._busy_keys = set()
+        self._deferred: Dict[str, collections.deque] = {}  # key -> jobs waiting for that key
+        for i in range(max_workers):
+            threading.Thread(target=self._worker, name=f"{name}-worker-{i}", daemon=True).start()
+
+    def submit(self, command, shell=True, timeout=None, cwd=None, key=None) -> Job:
+        job = Job(command, shell=shell, timeout=timeout, cwd=cwd, key=key)
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._evict_finished()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id) -> bool:
+        """Cancel a queued or running job, returns False if it is unknown or already finished"""
+        job = self.get(job_id)
+        if not job or job.finished:
+            return False
+        job._cancel_requested = True
+        with job._cond:
+            # Under the job's lock, so a worker dequeuing it now cannot flip it back to RUNNING
+            if job.status == QUEUED:
+                job._set_status(CANCELLED)
+                return True
+        if job._process:
+            _terminate(job._process)
+        return True
+
+    def stats(self):
+        with self._lock:
+            queued = sum(1 for j in self.jobs.values() if j.status == QUEUED)
+            running = self._running
+        return {
+            "max_workers": self.max_workers,
+            "running": running,
+            "queued": queued,
+            "free_slots": max(self.max_workers - running, 0),
+        }
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            return [job.to_dict() for job in self.jobs.values()]
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            del self.jobs[job_id]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job.status != QUEUED:
+                continue
+            with self._lock:
+                if job.key is not None:
+                    if job.key in self._busy_keys:
+                        # Parked until the running job with the same key finishes
+                        self._deferred.setdefault(job.key, collections.deque()).append(job)
+                        continue
+                    self._busy_keys.add(job.key)
+                self._running += 1
+            try:
+                self._run(job)
+            except Exception as e:
+                # One bad job (e.g. an unusable timeout) must never take a worker down with it
+                if job._process:
+                    _terminate(job._process)
+                job.error = f"{type(e).__name__}: {e}"
+                job._set_status(FAILED)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if job.key is not None:
+                        self._release_key(job.key)
+
+    def _release_key(self, key):
+        self._busy_keys.discard(key)
+        waiting = self._deferred.get(key)
+        while waiting:
+            job = waiting.popleft()
+            if job.status == QUEUED:
+                self._queue.put(job)
+                break
+        if not waiting:
+            self._deferred.pop(key, None)
+
+    def _run(self, job: Job):
+        if not job._start():
+            return
+        try:
+            job._process = subprocess.Popen(
+                job.command, shell=job.shell, cwd=job.cwd, text=True, errors="replace", bufsize=1,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                start_new_session=(os.name != "nt"))
+        except Exception as e:
+            job.error = str(e)
+            job._set_status(FAILED)
+            return
+        if job._cancel_requested:
+            _terminate(job._process)
+
+        readers = [threading.Thread(target=_pump, args=(job, job._process.stdout, "stdout"), daemon=True),
+                   threading.Thread(target=_pump, args=(job, job._process.stderr, "stderr"), daemon=True)]
+        for reader in readers:
+            reader.start()
+
+        timed_out = False
+        try:
+            job._process.wait(timeout=job.timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            _terminate(job._process)
+            job._process.wait()
+        for reader in readers:
+            reader.join()
+
+        job.returncode = job._process.returncode
+        if job._cancel_requested:
+            job._set_status(CANCELLED)
+        elif timed_out:
+            job.error = f"Timed out after {job.timeout} seconds"
+            job._set_status(TIMEOUT)
+        else:
+            job._set_status(SUCCEEDED if job.returncode == 0 else FAILED)
+
+
+def _pump(job, pipe, stream):
+    for line in iter(pipe.readline, ""):
+        job.append_output(stream, line)
+    pipe.close()
+
+
+def _terminate(process):
+    """Kill the whole process group so shell children do not outlive the job"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name != "nt":
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+MAX_STATUS_WAIT = 30  # longest long-poll a status request may ask for
+STREAM_WAIT = 15
+
+
+def job_status_response(runner: JobRunner, job_id):
+    """Job status plus output produced since `offset` (long-polls up to `wait` seconds)"""
+    job = runner.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    offset = request.args.get("offset", 0, type=int)
+    try:
+        wait = parse_wait(request.args.get("wait", 0), MAX_STATUS_WAIT)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    chunks, next_offset = job.read_output(offset, wait=wait)
+    result = job.to_dict()
+    result.update({"success": True, "output": chunks, "next_offset": next_offset})
+    return jsonify(result)
+
+
+def job_stream_response(runner: JobRunner, job_id):
+    """Chunked plain-text stream of the job's stdout and stderr until it exits"""
+    job = runner.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+
+    def generate():
+        offset = request.args.get("offset", 0, type=int)
+        while True:
+            chunks, offset = job.read_output(offset, wait=STREAM_WAIT)
+            for chunk in chunks:
+                yield chunk["data"]
+            if job.finished and not chunks:
+                yield f"\n[job {job.status}, returncode={job.returncode}]\n"
+                return
+
+    return Response(stream_with_context(generate()), mimetype="text/plain")
+
+
+def job_cancel_response(runner: JobRunner, job_id):
+    if not runner.cancel(job_id):
+        return jsonify({"success": False, "error": "Job not found or already finished"}), 404
+    return jsonify({"success": True, "job_id": job_id, "status": "cancelling"})
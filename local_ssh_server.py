@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Local SSH Server
+Minimal in-process SSH server built on paramiko, used by the tests and benchmarks
+to exercise the agents' SSH paths on Linux without a real sshd.
+
+Exec requests run the command with the local shell; direct-tcpip channels (SSH
+tunnels, `ssh -J`) are forwarded to their destination; password and public-key
+authentication are supported.
+"""
+
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, owner):
+        self.owner = owner
+        self.forwards = {}  # chanid -> upstream socket of accepted direct-tcpip channels
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        if username == self.owner.username and password == self.owner.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        if username == self.owner.username and key == self.owner.client_key:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        # Connect first so an unreachable destination fails the channel open, like sshd
+        try:
+            upstream = socket.create_connection(destination, timeout=10)
+        except OSError:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        upstream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.forwards[chanid] = upstream
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_run_exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+def _run_exec(channel, command):
+    try:
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Forward output as it is produced, like sshd does
+        stderr_pump = threading.Thread(target=_pump, args=(process.stderr, channel.sendall_stderr), daemon=True)
+        stderr_pump.start()
+        _pump(process.stdout, channel.sendall)
+        stderr_pump.join()
+        channel.send_exit_status(process.wait())
+    finally:
+        channel.close()
+
+
+def _forward(channel, upstream):
+    """Relay a direct-tcpip channel to its destination until either side closes"""
+    upstream.settimeout(None)
+
+    def upstream_to_channel():
+        try:
+            while data := upstream.recv(32768):
+                channel.sendall(data)
+        except OSError:
+            pass
+        channel.close()
+
+    threading.Thread(target=upstream_to_channel, daemon=True).start()
+    try:
+        while data := channel.recv(32768):
+            upstream.sendall(data)
+    except OSError:
+        pass
+    upstream.close()
+
+
+def _pump(pipe, send):
+    while True:
+        data = os.read(pipe.fileno(), 32768)
+        if not data:
+            break
+        send(data)
+    pipe.close()
+
+
+class LocalSSHServer:
+    """
+    SSH server listening on 127.0.0.1 in background threads
+
+    `connections` counts accepted TCP connections, which lets callers check
+    whether sessions are being reused.
+    """
+
+    def __init__(self, username="agent", password="secret"):
+        self.username = username
+        self.password = password
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.client_key = paramiko.RSAKey.generate(2048)
+        self.connections = 0
+        self._transports = []
+        self._sock = None
+        self.port = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(128)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._sock:
+            self._sock.close()
+        for transport in self._transports:
+            transport.close()
+
+    def write_client_key(self, path):
+        """Write the private key accepted for `username` (for ssh -i / key_filename)"""
+        self.client_key.write_private_key_file(path)
+        os.chmod(path, 0o600)
+        return path
+
+    def _accept_loop(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def _serve(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        self._transports.append(transport)
+        interface = _ServerInterface(self)
+        try:
+            transport.start_server(server=interface)
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        # paramiko only keeps weak references to channels: hold the accepted ones until they
+        # close, otherwise they are garbage collected (and closed) before the exec request
+        channels = []
+        while transport.is_active():
+            channel = transport.accept(timeout=1)
+            channels = [c for c in channels if not c.closed]
+            if channel is not None:
+                channels.append(channel)
+                upstream = interface.forwards.pop(channel.chanid, None)
+                if upstream:
+                    threading.Thread(target=_forward, args=(channel, upstream), daemon=True).start()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
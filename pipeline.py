@@ -1,9 +1,11 @@
 # orchestrator.py - Runs on your cloud server
 
 import requests # pip install requests
+import sys
 import time
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 CLOUD_SERVER_API_URL = "http://localhost:5000" # Point to your Flask API if running locally, or public IP if accessed externally
@@ -12,9 +14,9 @@ AGENT_ID = "onprem-windows-bridge-001" # Target agent ID
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Function to send a command to the agent via the API ---
-def send_command_to_agent(target_host, target_type, command_str):
+def send_command_to_agent(target_host, target_type, command_str, agent_id=None):
     payload = {
-        "agent_id": AGENT_ID,
+        "agent_id": agent_id or AGENT_ID,
         "target_host": target_host,
         "target_type": target_type,
         "command": command_str
@@ -28,21 +30,174 @@ def send_command_to_agent(target_host, target_type, command_str):
         logging.error(f"Error sending command: {e}")
         return None
 
-# --- Function to check for command results ---
+# --- Functions to fetch command results ---
+RESULT_WAIT_SECONDS = 25 # Per-request wait; the API holds the request open until the result arrives
+
 def get_command_results(correlation_id, timeout=60):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        # In a real system, you'd have a database or Redis to store results
-        # and an API endpoint to query them, or the agent pushes to a different endpoint.
-        # For this simple example, we'll assume the Flask API stores results in memory.
-        results = requests.get(f"{CLOUD_SERVER_API_URL}/api/commands/results", params={"correlation_id": correlation_id})
-        if correlation_id in app.command_results: # Accessing global Flask variable - not ideal for production
-            return app.command_results.pop(correlation_id) # Retrieve and clear
-        time.sleep(5) # Wait before checking again
-    return {"status": "timeout", "message": "Command timed out"}
+    """Block until the agent reports the command's result (returned as soon as it arrives)"""
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return {"status": "timeout", "message": "Command timed out"}
+        wait = min(RESULT_WAIT_SECONDS, remaining)
+        try:
+            response = requests.get(f"{CLOUD_SERVER_API_URL}/api/commands/results/{correlation_id}",
+                                    params={"wait": wait}, timeout=wait + 10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching result for {correlation_id}: {e}")
+            time.sleep(min(1, max(deadline - time.time(), 0)))
+            continue
+        if response.status_code == 200:
+            return response.json()
+
+def get_many_command_results(correlation_ids, timeout=60, wait_for="all"):
+    """
+    Results for many commands, one long-polling request per round instead of one poll per command
+
+    Commands still pending after `timeout` seconds get a {"status": "timeout"} entry. With
+    wait_for="any" it returns as soon as at least one result is in and leaves pending ones out.
+    """
+    deadline = time.time() + timeout
+    results = {}
+    pending = list(correlation_ids)
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        wait = min(RESULT_WAIT_SECONDS, remaining)
+        try:
+            response = requests.post(f"{CLOUD_SERVER_API_URL}/api/commands/results/batch",
+                                     json={"correlation_ids": pending, "wait": wait, "wait_for": wait_for},
+                                     timeout=wait + 10)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching results: {e}")
+            time.sleep(min(1, max(deadline - time.time(), 0)))
+            continue
+        results.update(data["results"])
+        pending = data["pending"]
+        if results and wait_for == "any":
+            break
+    if wait_for == "any":
+        return results
+    for correlation_id in pending:
+        results[correlation_id] = {"status": "timeout", "message": "Command timed out"}
+    return results
+
+# --- Concurrent multi-step orchestration ---
+STEP_TIMEOUT = 300 # Default per-step deadline, counted from when the step is submitted
+SUBMIT_CONCURRENCY = 16 # Steps queued on the API at the same time
+
+def step_succeeded(result):
+    return result.get("status") == "success" and result.get("return_code", 0) in (0, None)
+
+def _check_steps(steps):
+    names = [step["name"] for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError("step names must be unique")
+    for step in steps:
+        missing = set(step.get("depends_on", [])) - set(names)
+        if missing:
+            raise ValueError(f"step {step['name']} depends on unknown steps: {sorted(missing)}")
+    # Every step must be reachable in dependency order, otherwise there is a cycle
+    done = set()
+    while len(done) < len(steps):
+        ready = [s["name"] for s in steps if s["name"] not in done and set(s.get("depends_on", [])) <= done]
+        if not ready:
+            raise ValueError(f"dependency cycle between steps: {sorted(set(names) - done)}")
+        done.update(ready)
+
+def run_pipeline(steps, timeout=None):
+    """
+    Run many commands concurrently, respecting dependencies between them
+
+    Each step is {"name", "target_host", "target_type", "command"} plus optional
+    "depends_on" (step names that must succeed first), "timeout" (seconds, default
+    STEP_TIMEOUT) and "agent_id". Every step is submitted as soon as its dependencies have
+    succeeded, and all in-flight steps are awaited together, so independent hosts progress
+    in parallel. Steps whose dependencies failed are skipped. `timeout` bounds the whole run.
+
+    Returns:
+        {"status": "success" | "failed", "elapsed_seconds", "steps": {name: report}} where each
+        report has "status" (success, failed, timeout, skipped or error) and, once submitted,
+        "correlation_id", "elapsed_seconds" and "result"
+    """
+    _check_steps(steps)
+    started = time.time()
+    run_deadline = None if timeout is None else started + timeout
+    reports = {step["name"]: {"status": "waiting"} for step in steps}
+    in_flight = {} # correlation_id -> (step, submitted_at)
+
+    def submit(step):
+        return step, send_command_to_agent(step["target_host"], step["target_type"], step["command"],
+                                           agent_id=step.get("agent_id"))
+
+    with ThreadPoolExecutor(max_workers=SUBMIT_CONCURRENCY) as executor:
+        while True:
+            # Skip steps whose dependencies did not succeed, submit those whose dependencies did
+            ready = []
+            for step in steps:
+                report = reports[step["name"]]
+                if report["status"] != "waiting":
+                    continue
+                depends = [reports[name]["status"] for name in step.get("depends_on", [])]
+                if any(status not in ("waiting", "running", "success") for status in depends):
+                    report["status"] = "skipped"
+                elif all(status == "success" for status in depends):
+                    ready.append(step)
+            if ready and run_deadline is not None and time.time() >= run_deadline:
+                for step in ready:
+                    reports[step["name"]]["status"] = "skipped"
+                ready = []
+            for step, correlation_id in executor.map(submit, ready):
+                if correlation_id is None:
+                    reports[step["name"]].update(status="error", result={"message": "Could not queue command"})
+                    continue
+                reports[step["name"]].update(status="running", correlation_id=correlation_id)
+                in_flight[correlation_id] = (step, time.time())
+                logging.info(f"Step '{step['name']}' queued on {step['target_host']} ({correlation_id})")
+            if ready:
+                continue # A submission error may have unblocked skips, re-evaluate before waiting
+            if not in_flight:
+                break
+
+            # Wait for the first of the in-flight results, until the earliest deadline
+            deadlines = {cid: submitted + step.get("timeout", STEP_TIMEOUT)
+                         for cid, (step, submitted) in in_flight.items()}
+            if run_deadline is not None:
+                deadlines = {cid: min(deadline, run_deadline) for cid, deadline in deadlines.items()}
+            wait = max(min(deadlines.values()) - time.time(), 0)
+            results = get_many_command_results(list(in_flight), timeout=wait, wait_for="any") if wait else {}
+            now = time.time()
+            for correlation_id, result in results.items():
+                step, submitted = in_flight.pop(correlation_id)
+                reports[step["name"]].update(status="success" if step_succeeded(result) else "failed",
+                                             result=result, elapsed_seconds=round(now - submitted, 3))
+                logging.info(f"Step '{step['name']}' {reports[step['name']]['status']}")
+            for correlation_id, deadline in deadlines.items():
+                if correlation_id in in_flight and now >= deadline:
+                    step, submitted = in_flight.pop(correlation_id)
+                    reports[step["name"]].update(status="timeout", elapsed_seconds=round(now - submitted, 3))
+                    logging.warning(f"Step '{step['name']}' timed out")
+
+    return {
+        "status": "success" if all(r["status"] == "success" for r in reports.values()) else "failed",
+        "elapsed_seconds": round(time.time() - started, 3),
+        "steps": reports,
+    }
 
 # --- Example Usage ---
 if __name__ == "__main__":
+    # python pipeline.py steps.json  - run a list of steps (see run_pipeline) and print the report
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            report = run_pipeline(json.load(f))
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["status"] == "success" else 1)
+
     # --- Example 1: Run a shell script on a Linux server via the Windows agent ---
     linux_target_ip = "192.168.1.100" # Replace with actual
     shell_script_content = "uptime; hostname"
@@ -0,0 +1,204 @@
+"""
+Durable Result Spool
+Append-only on-disk queue for agent results that could not be delivered to the backend.
+
+Records are stored one JSON document per line. A small offset file tracks how far
+the backend has acknowledged, so replay resumes in order after a restart. The pending
+records' task_ids are indexed in memory, so counting them never reads the file.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+class ResultSpool:
+    """
+    Append-only spool for unsent results
+
+    - appends are fsync'ed in batches (every `fsync_every` records or `fsync_interval` seconds)
+    - the file never grows past `max_bytes`; acknowledged records are compacted away first,
+      then the oldest pending records are dropped
+    - `replay()` delivers pending records in append order and stops at the first failure
+    - `len()` and `pending_task_ids()` answer from the in-memory index, which is built
+      by one scan when the spool is opened
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024,
+                 fsync_every: int = 16, fsync_interval: float = 1.0):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+
+        self._lock = threading.RLock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        self._recover()
+        self._file = open(self.path, "ab")
+        self._end = os.path.getsize(self.path)
+        self._offset = self._read_offset()
+        self._index = collections.deque()  # (end_offset, task_id) of each pending record
+        self._rebuild_index()
+
+    # --- Public API ---
+
+    def append(self, record: Dict):
+        """Append a record to the spool"""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._size() + len(line) > self.max_bytes:
+                self._make_room(len(line))
+            self._file.write(line)
+            self._end += len(line)
+            self._index.append((self._end, record.get("task_id")))
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self.sync()
+            else:
+                self.sync_if_due()
+
+    def sync_if_due(self):
+        """Sync unsynced appends once `fsync_interval` has passed; call it periodically"""
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        """Flush buffered appends to stable storage"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def pending(self) -> List[Dict]:
+        """Return all records that have not been acknowledged yet, oldest first"""
+        with self._lock:
+            return [record for _, record in self._iter_pending()]
+
+    def pending_task_ids(self) -> set:
+        """Return the task_ids of all spooled results"""
+        with self._lock:
+            return {task_id for _, task_id in self._index if task_id is not None}
+
+    def replay(self, send: Callable[[Dict], bool]) -> int:
+        """
+        Deliver pending records in order
+
+        Args:
+            send: Callable returning True when the backend accepted the record
+        Returns:
+            Number of records delivered
+        """
+        delivered = 0
+        with self._lock:
+            for end_offset, record in self._iter_pending():
+                if not send(record):
+                    break
+                self._commit(end_offset)
+                while self._index and self._index[0][0] <= end_offset:
+                    self._index.popleft()
+                delivered += 1
+            if self._offset and self._offset >= self._size():
+                self._reset()
+        return delivered
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            self._file.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index)
+
+    # --- Internals ---
+
+    def _size(self) -> int:
+        return self._end
+
+    def _rebuild_index(self):
+        self._index = collections.deque((end_offset, record.get("task_id"))
+                                        for end_offset, record in self._iter_pending())
+
+    def _iter_pending(self) -> Iterator[Tuple[int, Dict]]:
+        self._file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            position = self._offset
+            for line in f:
+                position += len(line)
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"[SPOOL] Skipping corrupt record at offset {position - len(line)}")
+                    continue
+                yield position, record
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+        return min(offset, self._size())
+
+    def _commit(self, offset: int):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
+        self._offset = offset
+
+    def _reset(self):
+        """Everything was acknowledged: truncate the spool"""
+        self._file.truncate(0)
+        self.sync()
+        self._end = 0
+        self._commit(0)
+        self._index.clear()
+
+    def _recover(self):
+        """Cut off a torn trailing record left by a crash in the middle of a write"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                print(f"[SPOOL] Truncated partial record at end of {self.path}")
+
+    def _make_room(self, needed: int):
+        """Compact acknowledged records away, then drop the oldest pending ones"""
+        records = [(json.dumps(r, separators=(",", ":")) + "\n").encode("utf-8")
+                   for _, r in self._iter_pending()]
+        total = sum(len(r) for r in records)
+        while records and total + needed > self.max_bytes:
+            total -= len(records.pop(0))
+            self.dropped += 1
+            print(f"[SPOOL] Spool full ({self.max_bytes} bytes), dropped oldest result")
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._end = total
+        self._commit(0)
+        self._rebuild_index()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
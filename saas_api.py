@@ -8,10 +8,12 @@ from flask import Flask, send_from_directory, jsonify, request
 from flask_cors import CORS
 import json
 import threading
+import time
 import uuid
 from datetime import datetime
 from saas_ssh_tester import SaaSSSHConnectionTester
 from saas_deployment_service import SaaSDeploymentTester
+from task_pool import TaskPool
 import os
 
 # Store test results temporarily (use Redis/Database in production)
@@ -26,14 +28,125 @@ CORS(app)  # Enable CORS for frontend access
 agent_tasks = {}
 agent_results = {}
 
+# Latest load report from each agent, and which agents belong to which tenant's pool
+agent_load = {}
+tenant_agents = {}
+AGENT_LOAD_TTL = 60  # seconds after which an agent's report is too old to place work on it
+
+# Upcoming SSH targets announced ahead of their tasks, handed to the agent on its next poll
+# so it can open and authenticate sessions before the work arrives
+agent_hints = {}
+
+def add_target_hints(targets, agent_id=None, tenant_id=None):
+    """Queue target hints for one agent, or for every live agent of a tenant"""
+    if agent_id:
+        recipients = [agent_id]
+    else:
+        now = time.time()
+        recipients = [a for a in tenant_agents.get(tenant_id, ())
+                      if now - agent_load.get(a, {}).get('reported_at', 0) <= AGENT_LOAD_TTL]
+    for recipient in recipients:
+        agent_hints.setdefault(recipient, []).extend(targets)
+    return recipients
+
+# One task pool per tenant: any live agent of the tenant can lease the tenant's tasks
+task_pools = {}
+
+def get_task_pool(tenant_id):
+    if tenant_id not in task_pools:
+        task_pools[tenant_id] = TaskPool(tenant_id, heartbeat_timeout=AGENT_LOAD_TTL)
+    return task_pools[tenant_id]
+
+def record_agent_load(agent_id, load, tenant_id=None):
+    """Store a load report sent by an agent with a poll or a result"""
+    if isinstance(load, str):
+        try:
+            load = json.loads(load)
+        except ValueError:
+            return
+    if not isinstance(load, dict):
+        return
+    load['reported_at'] = time.time()
+    if tenant_id:
+        load['tenant_id'] = tenant_id
+        tenant_agents.setdefault(tenant_id, set()).add(agent_id)
+    elif agent_id in agent_load:
+        load['tenant_id'] = agent_load[agent_id].get('tenant_id')
+    agent_load[agent_id] = load
+
+def pending_task_count(agent_id):
+    """Tasks queued for an agent that it has not picked up or reported a result for yet"""
+    done = agent_results.get(agent_id, {})
+    direct = sum(1 for task in agent_tasks.get(agent_id, []) if task.get('task_id') not in done)
+    # Pool tasks placed on the agent but not leased yet are not in its load report either
+    pool = task_pools.get(agent_load.get(agent_id, {}).get('tenant_id'))
+    return direct + (len(pool.local.get(agent_id, ())) if pool else 0)
+
+def agent_load_score(agent_id):
+    """Lower is less loaded: outstanding work minus free slots, then CPU load per core, then agent_id"""
+    load = agent_load[agent_id]
+    backlog = load.get('running_tasks', 0) + load.get('queued_tasks', 0) + pending_task_count(agent_id)
+    cpu = (load.get('cpu_load') or 0) / (load.get('cpu_count') or 1)
+    return (backlog - load.get('free_slots', 0), cpu, agent_id)
+
+def pick_least_loaded_agent(tenant_id):
+    """Choose the agent of a tenant's pool that should take the next task"""
+    now = time.time()
+    candidates = [agent_id for agent_id in tenant_agents.get(tenant_id, ())
+                  if now - agent_load.get(agent_id, {}).get('reported_at', 0) <= AGENT_LOAD_TTL]
+    if not candidates:
+        return None
+    return min(candidates, key=agent_load_score)
+
 @app.route('/api/tasks', methods=['GET'])
 def get_agent_tasks():
     """Agent polls for tasks"""
     agent_id = request.args.get('agent_id')
     if not agent_id:
         return jsonify({'success': False, 'error': 'Missing agent_id'}), 400
-    tasks = agent_tasks.get(agent_id, [])
-    return jsonify({'success': True, 'tasks': tasks})
+    tenant_id = request.args.get('tenant_id')
+    if request.args.get('load'):
+        record_agent_load(agent_id, request.args['load'], tenant_id)
+    done = agent_results.get(agent_id, {})
+    tasks = [task for task in agent_tasks.get(agent_id, []) if task.get('task_id') not in done]
+    if tenant_id:
+        # free_slots is the agent's ssh-test capacity; its /deploy workers do not take pool tasks
+        free_slots = agent_load.get(agent_id, {}).get('free_slots', 1)
+        if free_slots > 0:
+            tasks += get_task_pool(tenant_id).lease(agent_id, max_tasks=free_slots)
+    hints = agent_hints.pop(agent_id, [])
+    return jsonify({'success': True, 'tasks': tasks, 'hints': hints})
+
+@app.route('/api/tasks/hints', methods=['POST'])
+def add_task_hints():
+    """
+    Announce upcoming SSH targets (e.g. the hosts of a scheduled deployment)
+
+    Expected JSON payload:
+    {
+        "agent_id": "..." or "tenant_id": "...",
+        "targets": [{"host": "10.0.0.5", "port": 22, "username": "admin", "password": "..."}]
+    }
+    """
+    data = request.get_json()
+    targets = data.get('targets') or []
+    if not targets or not (data.get('agent_id') or data.get('tenant_id')):
+        return jsonify({'success': False, 'error': 'Missing targets, agent_id or tenant_id'}), 400
+    recipients = add_target_hints(targets, data.get('agent_id'), data.get('tenant_id'))
+    return jsonify({'success': True, 'agents': recipients})
+
+@app.route('/api/agents/heartbeat', methods=['POST'])
+def agent_heartbeat():
+    """Agents report liveness and load between polls, keeping their pool leases alive"""
+    data = request.get_json()
+    agent_id = data.get('agent_id')
+    if not agent_id:
+        return jsonify({'success': False, 'error': 'Missing agent_id'}), 400
+    tenant_id = data.get('tenant_id')
+    record_agent_load(agent_id, data.get('load') or {}, tenant_id)
+    if tenant_id:
+        get_task_pool(tenant_id).heartbeat(agent_id)
+    return jsonify({'success': True})
 
 @app.route('/api/results', methods=['POST'])
 def receive_agent_results():
@@ -43,6 +156,11 @@ def receive_agent_results():
     task_id = data.get('task_id')
     if not agent_id or not task_id:
         return jsonify({'success': False, 'error': 'Missing agent_id or task_id'}), 400
+    if data.get('load'):
+        record_agent_load(agent_id, data['load'])
+    tenant_id = agent_load.get(agent_id, {}).get('tenant_id')
+    if tenant_id in task_pools:
+        task_pools[tenant_id].ack(task_id)
     agent_results.setdefault(agent_id, {})[task_id] = data
     print(f"[RESULT] Received from agent {agent_id} for task {task_id}: {data}")
     return jsonify({'success': True})
@@ -50,14 +168,42 @@ def receive_agent_results():
 # Example endpoint to add a task for an agent (for demo/testing)
 @app.route('/api/tasks/add', methods=['POST'])
 def add_agent_task():
-    """Add a new task for an agent"""
+    """
+    Add a new task for an agent
+
+    Either name the agent with `agent_id`, or pass `tenant_id` to queue the task
+    in the tenant's pool. Pool tasks are placed on the least-loaded live agent
+    first, but any agent of the tenant can lease or steal them.
+    """
     data = request.get_json()
     agent_id = data.get('agent_id')
+    tenant_id = data.get('tenant_id')
     task = data.get('task')
-    if not agent_id or not task:
+    if not task or not (agent_id or tenant_id):
         return jsonify({'success': False, 'error': 'Missing agent_id or task'}), 400
+    if data.get('hints'):
+        add_target_hints(data['hints'], agent_id, tenant_id)
+    if not agent_id:
+        preferred = pick_least_loaded_agent(tenant_id)
+        task_id = get_task_pool(tenant_id).submit(task, agent_id=preferred)
+        return jsonify({'success': True, 'message': 'Task added to pool', 'tenant_id': tenant_id,
+                        'task_id': task_id, 'agent_id': preferred})
     agent_tasks.setdefault(agent_id, []).append(task)
-    return jsonify({'success': True, 'message': 'Task added'})
+    return jsonify({'success': True, 'message': 'Task added', 'agent_id': agent_id})
+
+@app.route('/api/pools/<tenant_id>', methods=['GET'])
+def get_pool_stats(tenant_id):
+    """Queue, lease and membership state of a tenant's agent pool"""
+    if tenant_id not in task_pools:
+        return jsonify({'success': False, 'error': 'Pool not found'}), 404
+    return jsonify({'success': True, 'pool': task_pools[tenant_id].stats()})
+
+@app.route('/api/agents/load', methods=['GET'])
+def get_agents_load():
+    """Latest load report of every agent, optionally filtered by tenant"""
+    tenant_id = request.args.get('tenant_id')
+    agent_ids = tenant_agents.get(tenant_id, set()) if tenant_id else agent_load.keys()
+    return jsonify({'success': True, 'agents': {a: agent_load[a] for a in agent_ids if a in agent_load}})
 
 # Example endpoint to get results for an agent (for demo/testing)
 @app.route('/api/results/<agent_id>/<task_id>', methods=['GET'])
@@ -1,23 +1,121 @@
 from flask import Flask, request, jsonify
+import os
 import threading
 import time
-import subprocess
 import uuid
+from collections import OrderedDict, deque
+from task_pool import TaskPool
+from agent_registry import AgentRegistry
+from job_runner import JobRunner, job_cancel_response, job_status_response, job_stream_response, parse_timeout
+
+AGENT_TIMEOUT = 300  # seconds without a poll or result before an agent counts as offline
 
 app = Flask(__name__)
-agents = {}
-tasks = {}
+registry = AgentRegistry(timeout=AGENT_TIMEOUT)
+agents = registry.agents
+tasks = {}  # agent_id -> deque of tasks in arrival order; a task stays queued until its result arrives
+tasks_lock = threading.Lock()
 results = {}
+pools = {}  # pool_id -> TaskPool shared by every agent registered with that pool_id
+
+# Output that agents upload while a task runs, assembled per (agent_id, task_id)
+MAX_OUTPUT_CHUNK_BYTES = 256 * 1024  # larger chunks are rejected
+MAX_TASK_OUTPUT_BYTES = 10 * 1024 * 1024  # oldest chunks of a task are dropped beyond this
+MAX_TASK_OUTPUTS = 1000  # outputs of the oldest tasks are forgotten beyond this
+DEFAULT_TAIL_BYTES = 4096
+
+def utf8_len(text):
+    return len(text.encode('utf-8', 'surrogatepass'))
+
+class TaskOutput:
+    """
+    Output chunks of one task, kept in sequence order; duplicates and late arrivals are fine
+
+    Sizes are counted in UTF-8 bytes, the unit agents and MAX_TASK_OUTPUT_BYTES are measured in.
+    """
+
+    def __init__(self):
+        self.chunks = {}  # seq -> {"stream", "data"}
+        self.bytes = 0
+        self.dropped_bytes = 0
+        self.next_seq = 0  # everything below has arrived (or was dropped)
+        self.floor = 0  # chunks below this were dropped to stay within MAX_TASK_OUTPUT_BYTES
+        self.complete = False
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, seq, stream, data):
+        """Store one chunk, returns False for a duplicate or one already dropped"""
+        with self._lock:
+            if seq in self.chunks or seq < self.floor:
+                return False
+            self.chunks[seq] = {'stream': stream, 'data': data}
+            self.bytes += utf8_len(data)
+            self.updated_at = time.time()
+            while self.bytes > MAX_TASK_OUTPUT_BYTES and len(self.chunks) > 1:
+                oldest = min(self.chunks)
+                dropped = utf8_len(self.chunks.pop(oldest)['data'])
+                self.bytes -= dropped
+                self.dropped_bytes += dropped
+                self.floor = oldest + 1
+            self.next_seq = max(self.next_seq, self.floor)
+            while self.next_seq in self.chunks:
+                self.next_seq += 1
+            return True
+
+    def tail(self, max_bytes=DEFAULT_TAIL_BYTES, stream=None, after_seq=None):
+        """The last `max_bytes` of the output in sequence order (or everything after `after_seq`)"""
+        with self._lock:
+            seqs = sorted(seq for seq in self.chunks if after_seq is None or seq > after_seq)
+            pieces = [self.chunks[seq]['data'] for seq in seqs
+                      if stream is None or self.chunks[seq]['stream'] == stream]
+            last_seq = seqs[-1] if seqs else after_seq
+        output = ''.join(pieces)
+        if after_seq is None:
+            if max_bytes <= 0:
+                return '', last_seq
+            # Cut on bytes; a character split by the cut is left out rather than mangled
+            output = output.encode('utf-8', 'surrogatepass')[-max_bytes:].decode('utf-8', 'ignore')
+        return output, last_seq
+
+task_outputs = OrderedDict()  # (agent_id, task_id) -> TaskOutput
+task_outputs_lock = threading.Lock()
+
+def get_task_output(agent_id, task_id, create=False):
+    key = (agent_id, task_id)
+    with task_outputs_lock:
+        output = task_outputs.get(key)
+        if output is None and create:
+            output = task_outputs[key] = TaskOutput()
+            while len(task_outputs) > MAX_TASK_OUTPUTS:
+                task_outputs.popitem(last=False)
+        return output
+
+def get_pool(pool_id):
+    if pool_id not in pools:
+        pools[pool_id] = TaskPool(pool_id)
+    return pools[pool_id]
 
 @app.route('/api/register', methods=['POST'])
 def register_agent():
     agent_id = str(uuid.uuid4())
-    agents[agent_id] = {'status': 'active', 'last_seen': time.time()}
+    pool_id = (request.get_json(silent=True) or {}).get('pool_id')
+    registry.heartbeat(agent_id, pool_id=pool_id)
+    if pool_id:
+        get_pool(pool_id).heartbeat(agent_id)
     return jsonify({'agent_id': agent_id})
 
 @app.route('/api/tasks/<agent_id>', methods=['GET'])
 def get_task(agent_id):
-    task = tasks.get(agent_id)  # ✅ this keeps the task until agent confirms
+    """Oldest unfinished task of the agent; it is handed out again until its result is posted"""
+    registry.heartbeat(agent_id, pool_id=request.args.get('pool_id'))
+    with tasks_lock:
+        queue = tasks.get(agent_id)
+        task = queue[0] if queue else None
+    pool_id = request.args.get('pool_id') or agents.get(agent_id, {}).get('pool_id')
+    if not task and pool_id:
+        leased = get_pool(pool_id).lease(agent_id)
+        task = leased[0] if leased else None
     return jsonify({'task': task if task else None})
 
 @app.route('/api/results', methods=['POST'])
@@ -26,54 +124,143 @@ def receive_result():
     agent_id = data['agent_id']
     task_id = data['task_id']
     result = data['result']
+    registry.heartbeat(agent_id, pool_id=data.get('pool_id'))
     results[(agent_id, task_id)] = result
+    output = get_task_output(agent_id, task_id)
+    if output:
+        output.complete = True
+    with tasks_lock:
+        queue = tasks.get(agent_id)
+        if queue:
+            for task in queue:
+                if task.get('task_id') == task_id:
+                    queue.remove(task)
+                    break
+            if not queue:
+                del tasks[agent_id]
+    pool_id = data.get('pool_id') or agents.get(agent_id, {}).get('pool_id')
+    if pool_id in pools:
+        pools[pool_id].ack(task_id)
     print(f"[SERVER] Result received for agent {agent_id}, task {task_id}: {result}")
     return jsonify({'status': 'received'})
 
+@app.route('/api/results/chunks', methods=['POST'])
+def receive_output_chunks():
+    """
+    Output uploaded by an agent while a task runs
+
+    Expected JSON payload:
+    {"agent_id": "...", "task_id": "...", "chunks": [{"seq": 0, "stream": "stdout", "data": "..."}]}
+    """
+    data = request.get_json(silent=True) or {}
+    agent_id, task_id, chunks = data.get('agent_id'), data.get('task_id'), data.get('chunks')
+    if not agent_id or not task_id or not isinstance(chunks, list):
+        return jsonify({'error': 'agent_id, task_id and chunks are required'}), 400
+    for chunk in chunks:
+        if (not isinstance(chunk, dict) or not isinstance(chunk.get('seq'), int)
+                or not isinstance(chunk.get('data'), str) or not isinstance(chunk.get('stream', ''), str)):
+            return jsonify({'error': 'every chunk needs an integer seq and string data'}), 400
+        if utf8_len(chunk['data']) > MAX_OUTPUT_CHUNK_BYTES:
+            return jsonify({'error': f'chunks are limited to {MAX_OUTPUT_CHUNK_BYTES} bytes'}), 413
+    registry.heartbeat(agent_id)
+    output = get_task_output(agent_id, task_id, create=True)
+    accepted = sum(output.add(c['seq'], c.get('stream', 'stdout'), c['data']) for c in chunks)
+    return jsonify({'status': 'received', 'accepted': accepted, 'next_seq': output.next_seq})
+
+@app.route('/api/results/<agent_id>/<task_id>/tail', methods=['GET'])
+def get_output_tail(agent_id, task_id):
+    """
+    Latest output of a task: the last `bytes` bytes, or with `after_seq` every chunk after it
+    (pass back `last_seq` to follow a running task); `stream` limits it to stdout or stderr
+    """
+    output = get_task_output(agent_id, task_id)
+    if not output:
+        return jsonify({'error': 'No output for this task'}), 404
+    text, last_seq = output.tail(request.args.get('bytes', DEFAULT_TAIL_BYTES, type=int),
+                                 request.args.get('stream'), request.args.get('after_seq', type=int))
+    return jsonify({'output': text, 'last_seq': last_seq, 'next_seq': output.next_seq,
+                    'complete': output.complete, 'bytes': output.bytes, 'dropped_bytes': output.dropped_bytes})
+
 @app.route('/api/tasks/add', methods=['POST'])
 def add_task():
     data = request.json
-    agent_id = data['agent_id']
+    agent_id = data.get('agent_id')
     task = data['task']
     # Normalize task type field for compatibility
     if 'type' not in task and 'task_type' in task:
         task['type'] = task['task_type']
         del task['task_type']
-    tasks[agent_id] = task
-    print(f"[SERVER] Task added for agent {agent_id}: {task}")
-    return jsonify({'status': 'task added'})
+    if not agent_id and not data.get('pool_id'):
+        return jsonify({'error': 'agent_id or pool_id is required'}), 400
+    task.setdefault('task_id', str(uuid.uuid4()))
+    if data.get('pool_id'):
+        task_id = get_pool(data['pool_id']).submit(task, agent_id=agent_id)
+        print(f"[SERVER] Task {task_id} added to pool {data['pool_id']}: {task}")
+        return jsonify({'status': 'task added', 'task_id': task_id})
+    with tasks_lock:
+        queue = tasks.setdefault(agent_id, deque())
+        if any(queued.get('task_id') == task['task_id'] for queued in queue):
+            return jsonify({'status': 'already queued', 'task_id': task['task_id']})
+        queue.append(task)
+        position = len(queue)
+    print(f"[SERVER] Task added for agent {agent_id} (position {position}): {task}")
+    return jsonify({'status': 'task added', 'task_id': task['task_id'], 'position': position})
 
 
-# New endpoint to run ansible playbook directly on backend
+# Playbook runs on the backend are background jobs: the request returns a job ID at once.
+# deploy.sh is the only playbook and two runs of it must never overlap, so one worker runs them in order
+ANSIBLE_TIMEOUT = float(os.environ.get("ANSIBLE_TIMEOUT", 3600))
+ANSIBLE_PLAYBOOK = "deploy.sh"
+ansible_jobs = JobRunner(max_workers=1, name="ansible")
+
 @app.route('/api/ansible/run', methods=['POST'])
 def run_ansible_playbook():
-    """Run ansible-playbook locally on backend server"""
+    """Queue './deploy.sh' on the backend, returns the job to follow"""
+    data = request.get_json(silent=True) or {}
     try:
-        print("[SERVER] Running './deploy.sh' ...")
-        result = subprocess.run(["bash", "deploy.sh"], capture_output=True, text=True)
-        return jsonify({
-            'success': result.returncode == 0,
-            'stdout': result.stdout,
-            'stderr': result.stderr,
-            'returncode': result.returncode
-        })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
-
-def cleanup_inactive_agents():
-    while True:
-        now = time.time()
-        for agent_id in list(agents):
-            if now - agents[agent_id]['last_seen'] > 300:  # 5 minutes timeout
-                print(f"[SERVER] Agent {agent_id} removed due to inactivity")
-                del agents[agent_id]
-        time.sleep(60)
-
-# Start agent cleanup thread
-threading.Thread(target=cleanup_inactive_agents, daemon=True).start()
+        timeout = parse_timeout(data.get('timeout', ANSIBLE_TIMEOUT))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    print(f"[SERVER] Queueing './{ANSIBLE_PLAYBOOK}' ...")
+    job = ansible_jobs.submit(["bash", ANSIBLE_PLAYBOOK], shell=False, timeout=timeout)
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'status': job.status,
+        'status_url': f"/api/ansible/jobs/{job.job_id}",
+        'stream_url': f"/api/ansible/jobs/{job.job_id}/stream"
+    }), 202
+
+@app.route('/api/ansible/jobs', methods=['GET'])
+def list_ansible_jobs():
+    return jsonify({'jobs': ansible_jobs.list_jobs(), **ansible_jobs.stats()})
+
+@app.route('/api/ansible/jobs/<job_id>', methods=['GET'])
+def ansible_job_status(job_id):
+    return job_status_response(ansible_jobs, job_id)
+
+@app.route('/api/ansible/jobs/<job_id>/stream', methods=['GET'])
+def ansible_job_stream(job_id):
+    return job_stream_response(ansible_jobs, job_id)
+
+@app.route('/api/ansible/jobs/<job_id>', methods=['DELETE'])
+def ansible_job_cancel(job_id):
+    return job_cancel_response(ansible_jobs, job_id)
+
+@app.route('/api/agents/stats', methods=['GET'])
+def get_agent_stats():
+    """Online/offline agent counts, without walking the registry"""
+    return jsonify(registry.counts())
+
+@app.route('/api/agents/<agent_id>', methods=['GET'])
+def get_agent(agent_id):
+    agent = registry.get(agent_id)
+    if not agent:
+        return jsonify({'error': 'Agent not found'}), 404
+    return jsonify(dict(agent, agent_id=agent_id))
+
+# Agents go offline exactly when their heartbeat deadline passes
+registry.start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -1,7 +1,11 @@
 import requests
 import time
 import uuid
+import json
+import os
 import subprocess
+import threading
+from collections import OrderedDict, deque
 
 # Unique agent ID
 AGENT_ID = "80c70cf0-fd51-490e-bbc7-53d1c2d7477e"
@@ -9,11 +13,204 @@ AGENT_ID = "80c70cf0-fd51-490e-bbc7-53d1c2d7477e"
 # Server URLs
 BASE_URL = "http://13.58.212.239:5000"
 TASKS_API_URL = f"{BASE_URL}/api/tasks/{AGENT_ID}"
+POOL_ID = None  # Set to share tasks with other agents registered in the same pool
 RESULTS_API_URL = f"{BASE_URL}/api/results"
+OUTPUT_API_URL = f"{BASE_URL}/api/results/chunks"
+
+# Output of a running command is uploaded as it is produced instead of in one request at the end
+OUTPUT_FLUSH_INTERVAL = 2  # seconds between uploads while a command runs
+OUTPUT_CHUNK_BYTES = 64 * 1024  # upload early once this much is buffered; also the largest chunk sent
+OUTPUT_PENDING_LIMIT = 1024 * 1024  # unsent output kept while the server is unreachable, oldest dropped first
+OUTPUT_TAIL_BYTES = 4096  # last stdout/stderr included in the final result
+
+# task_ids this agent has already run, kept across restarts so a re-delivered task is never run twice
+COMPLETED_TASKS_FILE = os.environ.get("AGENT_COMPLETED_TASKS_FILE", "completed_tasks.json")
+COMPLETED_TASKS_LIMIT = 1000  # oldest ids are forgotten beyond this
+
+class CompletedTasks:
+    """Bounded, insertion-ordered set of task_ids persisted to a JSON file"""
+
+    def __init__(self, path, limit=COMPLETED_TASKS_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.task_ids = OrderedDict()
+        try:
+            with open(path) as f:
+                for task_id in json.load(f)[-limit:]:
+                    self.task_ids[task_id] = None
+        except (OSError, ValueError):
+            pass
+
+    def __contains__(self, task_id):
+        return task_id in self.task_ids
+
+    def __len__(self):
+        return len(self.task_ids)
+
+    def add(self, task_id):
+        self.task_ids[task_id] = None
+        while len(self.task_ids) > self.limit:
+            self.task_ids.popitem(last=False)
+        # Write-then-rename so a crash never leaves a truncated file behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self.task_ids), f)
+        os.replace(tmp_path, self.path)
+
+completed_tasks = CompletedTasks(COMPLETED_TASKS_FILE)
+unsent_results = deque()  # results whose POST failed, retried before the next poll
+
+def send_result(result_payload):
+    """POST a result after any still unsent ones, returns False if it is kept for a retry"""
+    unsent_results.append(result_payload)
+    return retry_unsent_results()
+
+def retry_unsent_results():
+    """Send kept results oldest first, stopping at the first failure so they arrive in order"""
+    while unsent_results:
+        if not _post_result(unsent_results[0]):
+            return False
+        unsent_results.popleft()
+    return True
+
+def _post_result(result_payload):
+    try:
+        resp = requests.post(RESULTS_API_URL, json=result_payload, timeout=10)
+        print(f"[AGENT] Sent command result for task {result_payload['task_id']}: {resp.status_code} {resp.text}")
+        return resp.status_code < 500
+    except Exception as e:
+        print(f"[AGENT][ERROR] Failed to send command result: {e}")
+        return False
+
+class OutputUploader:
+    """
+    Buffers a command's output and uploads it in numbered chunks
+
+    The server orders chunks by `seq` and ignores ones it already has, so a failed upload is
+    simply retried with the next one. Only the last OUTPUT_TAIL_BYTES of each stream stay in
+    memory once uploaded. All sizes are UTF-8 bytes, as the server counts them.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.seq = 0
+        self.buffered = []  # (stream, data) not yet cut into chunks
+        self.buffered_bytes = 0
+        self.pending = deque()  # chunks cut but not yet accepted by the server
+        self.pending_bytes = 0
+        self.dropped_bytes = 0
+        self.uploaded_chunks = 0
+        self.tails = {"stdout": "", "stderr": ""}
+        self.ready = threading.Event()  # set once OUTPUT_CHUNK_BYTES are buffered
+        self._lock = threading.Lock()
+
+    def write(self, stream, data):
+        with self._lock:
+            self.buffered.append((stream, data))
+            self.buffered_bytes += _utf8_len(data)
+            self.tails[stream] = _last_bytes(self.tails[stream] + data, OUTPUT_TAIL_BYTES)
+            if self.buffered_bytes >= OUTPUT_CHUNK_BYTES:
+                self.ready.set()
+
+    def flush(self):
+        """Cut buffered output into chunks and upload everything pending, returns True if all was accepted"""
+        with self._lock:
+            buffered, self.buffered, self.buffered_bytes = self.buffered, [], 0
+            self.ready.clear()
+        for stream, data in _merge_streams(buffered):
+            for piece in _split_utf8(data, OUTPUT_CHUNK_BYTES):
+                self.pending.append({"seq": self.seq, "stream": stream, "data": piece})
+                self.pending_bytes += _utf8_len(piece)
+                self.seq += 1
+        while self.pending_bytes > OUTPUT_PENDING_LIMIT:
+            dropped = _utf8_len(self.pending.popleft()["data"])
+            self.pending_bytes -= dropped
+            self.dropped_bytes += dropped
+        if not self.pending:
+            return True
+        chunks = list(self.pending)
+        try:
+            resp = requests.post(OUTPUT_API_URL, json={"agent_id": AGENT_ID, "task_id": self.task_id,
+                                                       "chunks": chunks}, timeout=10)
+            if resp.status_code >= 400:
+                print(f"[AGENT][ERROR] Output upload for task {self.task_id} rejected: {resp.status_code}")
+                return False
+        except Exception as e:
+            print(f"[AGENT][ERROR] Output upload for task {self.task_id} failed: {e}")
+            return False
+        self.uploaded_chunks += len(chunks)
+        for _ in chunks:
+            self.pending_bytes -= _utf8_len(self.pending.popleft()["data"])
+        return True
+
+def _utf8_len(text):
+    return len(text.encode("utf-8", "surrogatepass"))
+
+def _last_bytes(text, max_bytes):
+    """The end of `text` within `max_bytes` UTF-8 bytes, never splitting a character"""
+    if max_bytes <= 0:
+        return ""
+    return text.encode("utf-8", "surrogatepass")[-max_bytes:].decode("utf-8", "ignore")
+
+def _split_utf8(text, max_bytes):
+    """Cut `text` into pieces of at most `max_bytes` UTF-8 bytes, on character boundaries"""
+    data = text.encode("utf-8", "surrogatepass")
+    start = 0
+    while start < len(data):
+        end = min(start + max_bytes, len(data))
+        while end < len(data) and data[end] & 0xC0 == 0x80:  # continuation byte: back up to the character start
+            end -= 1
+        yield data[start:end].decode("utf-8", "surrogatepass")
+        start = end
+
+def _merge_streams(pieces):
+    """Join consecutive pieces of the same stream"""
+    merged = []
+    for stream, data in pieces:
+        if merged and merged[-1][0] == stream:
+            merged[-1][1].append(data)
+        else:
+            merged.append((stream, [data]))
+    return [(stream, "".join(data)) for stream, data in merged]
+
+def run_streaming(shell_command, task_id):
+    """Run a shell command, uploading its output while it runs, returns the result dict"""
+    uploader = OutputUploader(task_id)
+    # errors="replace": a stray non-UTF-8 byte must not kill a pump and leave the pipe undrained
+    process = subprocess.Popen(shell_command, shell=True, text=True, errors="replace", bufsize=1,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def pump(pipe, stream):
+        for line in iter(pipe.readline, ""):
+            uploader.write(stream, line)
+        pipe.close()
+
+    readers = [threading.Thread(target=pump, args=(process.stdout, "stdout"), daemon=True),
+               threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True)]
+    for reader in readers:
+        reader.start()
+    while process.poll() is None:
+        uploader.ready.wait(OUTPUT_FLUSH_INTERVAL)
+        uploader.flush()
+    for reader in readers:
+        reader.join()
+    uploader.flush()
+    return {
+        "success": process.returncode == 0,
+        "returncode": process.returncode,
+        "output": uploader.tails["stdout"],
+        "error": uploader.tails["stderr"],
+        "streamed": True,
+        "chunks": uploader.seq,
+        "dropped_bytes": uploader.dropped_bytes
+    }
 
 def get_and_execute_task():
+    """Fetch and run the agent's next task, returns True if one was handled"""
+    retry_unsent_results()
     try:
-        response = requests.get(TASKS_API_URL, timeout=10)
+        params = {"pool_id": POOL_ID} if POOL_ID else None
+        response = requests.get(TASKS_API_URL, params=params, timeout=10)
         if response.status_code != 200:
             print(f"[AGENT] Failed to fetch task: {response.status_code}")
             return
@@ -28,38 +225,64 @@ def get_and_execute_task():
         task_type = task.get("type")
         task_id = task.get("task_id")
 
+        if task_id in completed_tasks:
+            if any(r["task_id"] == task_id for r in unsent_results):
+                print(f"[AGENT] Task {task_id} already ran, its result is waiting to be resent")
+                return
+            # Already ran (e.g. before a restart) but the server never got the result: acknowledge it
+            # instead of running the command again
+            print(f"[AGENT] Task {task_id} already ran, not running it again")
+            send_result({
+                "agent_id": AGENT_ID,
+                "task_id": task_id,
+                "pool_id": POOL_ID,
+                "result": {
+                    "success": False,
+                    "duplicate": True,
+                    "error": "Task already ran on this agent; its result was not delivered"
+                }
+            })
+            return True
+
         if task_type == "command":
             shell_command = task.get("payload")
             print(f"[AGENT][COMMAND] Running shell command: {shell_command}")
             try:
-                result = subprocess.run(shell_command, shell=True, capture_output=True, text=True)
                 result_payload = {
                     "agent_id": AGENT_ID,
                     "task_id": task_id,
-                    "result": {
-                        "success": result.returncode == 0,
-                        "output": result.stdout,
-                        "error": result.stderr
-                    }
+                    "pool_id": POOL_ID,
+                    "result": run_streaming(shell_command, task_id)
                 }
             except Exception as e:
                 result_payload = {
                     "agent_id": AGENT_ID,
                     "task_id": task_id,
+                    "pool_id": POOL_ID,
                     "result": {
                         "success": False,
                         "error": str(e)
                     }
                 }
 
-            # Send result
-            try:
-                resp = requests.post(RESULTS_API_URL, json=result_payload, timeout=10)
-                print(f"[AGENT] Sent command result for task {task_id}: {resp.status_code} {resp.text}")
-            except Exception as e:
-                print(f"[AGENT][ERROR] Failed to send command result: {e}")
         else:
             print(f"[AGENT] Unknown task type: {task_type}")
+            # Still answer, otherwise the server keeps handing out the same task
+            result_payload = {
+                "agent_id": AGENT_ID,
+                "task_id": task_id,
+                "pool_id": POOL_ID,
+                "result": {
+                    "success": False,
+                    "error": f"Unknown task type: {task_type}"
+                }
+            }
+
+        if task_id:
+            completed_tasks.add(task_id)
+        # Send result
+        send_result(result_payload)
+        return True
 
     except Exception as e:
         print(f"[AGENT][ERROR] Exception while fetching/executing task: {e}")
@@ -67,5 +290,6 @@ def get_and_execute_task():
 if __name__ == "__main__":
     print(f"[AGENT] Starting agent with ID {AGENT_ID}")
     while True:
-        get_and_execute_task()
-        time.sleep(5)
+        # Go straight to the next queued task; only wait when the queue was empty
+        if not get_and_execute_task():
+            time.sleep(5)
@@ -0,0 +1,234 @@
+"""
+SSH Session Cache
+Keeps authenticated paramiko sessions open per (host, port, username, credentials) so
+repeated commands skip DNS, TCP, key exchange and authentication.
+
+Sessions can be opened ahead of time with `prewarm()` when the backend tells the
+agent which hosts its next tasks will target.
+"""
+
+import hashlib
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+import paramiko
+
+
+class SSHSessionCache:
+    """
+    Thread-safe cache of connected SSHClient objects
+
+    - one session per (host, port, username, credentials); a session is never handed
+      to a caller presenting different credentials than the ones it was opened with
+    - paramiko multiplexes concurrent channels over it, so callers on different
+      threads can share it
+    - sessions idle for `idle_timeout` seconds are closed; at most `max_sessions`
+      are kept, the least recently used one is closed first. A session with a channel
+      open through `channel()` is busy, not idle, and is never closed by either rule
+    - concurrent requests for the same target wait for a single connect
+    """
+
+    def __init__(self, idle_timeout: float = 300, max_sessions: int = 32, connect_timeout: float = 10):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.connect_timeout = connect_timeout
+        self.hits = 0
+        self.misses = 0
+        self.prewarmed = 0
+        self._sessions: Dict[Tuple, Dict] = {}
+        self._connecting: Dict[Tuple, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(host: str, port: int = 22, username: Optional[str] = None,
+            password: Optional[str] = None, key_filename: Optional[str] = None) -> Tuple:
+        secret = hashlib.sha256(f"{password}\0{key_filename}".encode()).hexdigest()
+        return (host, int(port or 22), username, secret)
+
+    def get(self, host: str, username: str, port: int = 22, password: Optional[str] = None,
+            key_filename: Optional[str] = None, sock=None) -> paramiko.SSHClient:
+        """Return a connected client for the target, connecting if needed"""
+        key = self.key(host, port, username, password, key_filename)
+        while True:
+            with self._lock:
+                self._expire_idle()
+                entry = self._sessions.get(key)
+                if entry and _is_alive(entry["client"]):
+                    entry["last_used"] = time.time()
+                    self.hits += 1
+                    return entry["client"]
+                if entry:
+                    self._drop(key)
+                pending = self._connecting.get(key)
+                if not pending:
+                    pending = self._connecting[key] = threading.Event()
+                    break
+            # Someone else (e.g. a prewarm thread) is connecting to this target: wait for it
+            pending.wait(self.connect_timeout + 5)
+
+        own_sock = client = None
+        try:
+            if sock is None:
+                # Channel-open and exec requests go out back to back; without TCP_NODELAY the
+                # second one waits for a delayed ACK (~40ms) on every command
+                sock = own_sock = socket.create_connection((host, int(port or 22)), timeout=self.connect_timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(hostname=host, port=int(port or 22), username=username, password=password,
+                           key_filename=key_filename, sock=sock, timeout=self.connect_timeout)
+            with self._lock:
+                self.misses += 1
+                self._sessions[key] = {"client": client, "last_used": time.time(), "busy": 0}
+                self._enforce_limit()
+            return client
+        except Exception:
+            if client:
+                client.close()
+            if own_sock:
+                own_sock.close()
+            raise
+        finally:
+            with self._lock:
+                self._connecting.pop(key).set()
+
+    @contextmanager
+    def channel(self, host: str, username: str, port: int = 22, password: Optional[str] = None,
+                key_filename: Optional[str] = None, timeout: Optional[float] = None):
+        """
+        Yield a new session channel on a cached session, closing it afterwards
+
+        Only opening the channel is retried (once, on a fresh connection) when the cached
+        session turns out to be dead; whatever the caller does with the channel is not,
+        since a command may already have run. The session counts as busy until the block exits.
+        """
+        key = self.key(host, port, username, password, key_filename)
+        for attempt in range(2):
+            client = self.get(host, username, port=port, password=password, key_filename=key_filename)
+            self._set_busy(key, client, 1)
+            try:
+                channel = client.get_transport().open_session(timeout=timeout)
+                break
+            except (paramiko.SSHException, EOFError, OSError):
+                self._set_busy(key, client, -1)
+                self.invalidate(host, port, username)
+                if attempt:
+                    raise
+        try:
+            yield channel
+        finally:
+            channel.close()
+            self._set_busy(key, client, -1)
+
+    def exec_command(self, host: str, username: str, command: str, port: int = 22,
+                     password: Optional[str] = None, key_filename: Optional[str] = None,
+                     timeout: Optional[float] = None) -> Dict:
+        """
+        Run a command over a cached session (see `channel()` for what is retried)
+
+        Returns:
+            {"stdout", "stderr", "return_code"}
+        """
+        with self.channel(host, username, port=port, password=password, key_filename=key_filename,
+                          timeout=timeout) as channel:
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command(command)
+                stdout, stderr = channel.makefile("rb"), channel.makefile_stderr("rb")
+                out = stdout.read().decode(errors="replace")
+                err = stderr.read().decode(errors="replace")
+                return {"stdout": out, "stderr": err, "return_code": channel.recv_exit_status()}
+            except (paramiko.SSHException, EOFError, OSError):
+                self.invalidate(host, port, username)
+                raise
+
+    def prewarm(self, targets: Iterable[Dict]) -> int:
+        """
+        Open sessions for upcoming targets in background threads
+
+        Args:
+            targets: Dicts with host, port, username and password or key_filename
+        Returns:
+            Number of connects started
+        """
+        started = 0
+        for target in targets:
+            if not target.get("host") or not target.get("username"):
+                continue
+            key = self.key(target["host"], target.get("port", 22), target["username"],
+                           target.get("password"), target.get("key_filename"))
+            with self._lock:
+                if key in self._sessions or key in self._connecting:
+                    continue
+            threading.Thread(target=self._prewarm_one, args=(target,), daemon=True).start()
+            started += 1
+        return started
+
+    def _prewarm_one(self, target: Dict):
+        try:
+            self.get(target["host"], target["username"], port=target.get("port", 22),
+                     password=target.get("password"), key_filename=target.get("key_filename"))
+            with self._lock:
+                self.prewarmed += 1
+        except Exception as e:
+            print(f"[SSH-CACHE] Prewarm of {target['host']} failed: {e}")
+
+    def invalidate(self, host: str, port: int = 22, username: Optional[str] = None):
+        """Close every cached session to host:port for username"""
+        target = (host, int(port or 22), username)
+        with self._lock:
+            for key in [k for k in self._sessions if k[:3] == target]:
+                self._drop(key)
+
+    def close_all(self):
+        with self._lock:
+            for key in list(self._sessions):
+                self._drop(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire_idle()
+            return {"sessions": len(self._sessions), "connecting": len(self._connecting),
+                    "hits": self.hits, "misses": self.misses, "prewarmed": self.prewarmed}
+
+    def __len__(self):
+        with self._lock:
+            self._expire_idle()
+            return len(self._sessions)
+
+    def _set_busy(self, key, client, delta):
+        """Count a channel opening or closing on the session; closing one counts as a use"""
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry and entry["client"] is client:
+                entry["busy"] += delta
+                entry["last_used"] = time.time()
+
+    def _drop(self, key):
+        entry = self._sessions.pop(key, None)
+        if entry:
+            try:
+                entry["client"].close()
+            except Exception:
+                pass
+
+    def _expire_idle(self):
+        now = time.time()
+        for key, entry in list(self._sessions.items()):
+            if not entry["busy"] and now - entry["last_used"] > self.idle_timeout:
+                self._drop(key)
+
+    def _enforce_limit(self):
+        while len(self._sessions) > self.max_sessions:
+            idle = [k for k, entry in self._sessions.items() if not entry["busy"]]
+            if not idle:
+                return  # every session is running something; shrink once they finish
+            self._drop(min(idle, key=lambda k: self._sessions[k]["last_used"]))
+
+
+def _is_alive(client: paramiko.SSHClient) -> bool:
+    transport = client.get_transport()
+    return bool(transport and transport.is_active())
@@ -3,14 +3,35 @@
 SSH Connection Tester - Command Line Version
 A command-line tool to test SSH connections through VPN tunnels
 For use on headless servers without GUI support
+
+Scan mode (--hosts-file / --cidr) tests many hosts in parallel, optionally all through
+one shared tunnel connection, and reports per-host phase timings as JSON or CSV.
 """
 
 import paramiko
 import sys
 import argparse
+import csv
 import getpass
+import ipaddress
+import json
+import logging
+import math
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+SCAN_CONCURRENCY = 50  # hosts tested at the same time in scan mode
+SCAN_TIMEOUT = 10  # seconds allowed for each phase of a host's test
+MAX_SCAN_HOSTS = 65536  # a /16; larger target lists are refused rather than expanded in memory
+PHASES = ("connect", "handshake", "auth", "channel", "exec")
+BENCHMARK_ITERATIONS = 20
+BENCHMARK_WARMUP = 2  # untimed runs first, so DNS, ARP and server-side caches are warm
+BENCHMARK_COMMAND = "true"
+REPORT_FIELDS = ("host", "port", "status", "error") + tuple(f"{phase}_ms" for phase in PHASES) + ("total_ms",)
+
 class SSHConnectionTesterCLI:
     def __init__(self):
         self.ssh_client = None
@@ -145,11 +166,309 @@ class SSHConnectionTesterCLI:
             if self.tunnel_client:
                 self.tunnel_client.close()
 
+def load_hosts(hosts_file=None, cidrs=(), default_port=22):
+    """
+    Targets as (host, port) pairs, in order and without duplicates
+
+    `hosts_file` holds one `host` or `host:port` per line (# comments allowed), or an
+    Ansible INI inventory: `[group]` headers are skipped and `ansible_host` /
+    `ansible_port` variables are honoured. Each CIDR expands to its usable addresses.
+    Raises ValueError past MAX_SCAN_HOSTS targets.
+    """
+    hosts = []
+    if hosts_file:
+        with open(hosts_file) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line or line.startswith("[") or line.startswith(";"):
+                    continue
+                name, *variables = line.split()
+                options = dict(v.split("=", 1) for v in variables if "=" in v)
+                host = options.get("ansible_host", name)
+                port = int(options.get("ansible_port", default_port))
+                if "ansible_host" not in options and host.count(":") == 1:  # host:port, not IPv6
+                    host, port = host.rsplit(":", 1)
+                    port = int(port)
+                hosts.append((host, port))
+                _check_scan_size(len(hosts))
+    for cidr in cidrs:
+        network = ipaddress.ip_network(cidr, strict=False)
+        _check_scan_size(len(hosts) + network.num_addresses - (2 if network.num_addresses > 2 else 0))
+        addresses = network.hosts() if network.num_addresses > 2 else network
+        hosts.extend((str(address), default_port) for address in addresses)
+    return list(dict.fromkeys(hosts))
+
+def _check_scan_size(count):
+    if count > MAX_SCAN_HOSTS:
+        raise ValueError(f"{count} targets is more than the {MAX_SCAN_HOSTS} a scan can hold; "
+                         f"split it into smaller networks or host files")
+
+def load_private_key(path, password=None):
+    """Load an RSA, ECDSA or Ed25519 private key"""
+    for key_class in (paramiko.RSAKey, paramiko.ECDSAKey, paramiko.Ed25519Key):
+        try:
+            return key_class.from_private_key_file(path, password=password)
+        except paramiko.PasswordRequiredException:
+            raise paramiko.PasswordRequiredException(f"{path} is protected by a passphrase") from None
+        except paramiko.SSHException:
+            continue
+    raise paramiko.SSHException(f"Unsupported or invalid private key: {path}")
+
+class HostScanner:
+    """
+    Tests many hosts concurrently
+
+    With a tunnel, one SSH connection to the tunnel host is shared: every target gets its
+    own direct-tcpip channel on it instead of its own tunnel login. Each host's test is
+    timed per phase: connect (TCP or tunnel channel), handshake (SSH key exchange), auth,
+    channel (opening the command sessions) and exec (running the commands).
+    """
+
+    def __init__(self, username, password=None, pkey=None, commands=(), timeout=SCAN_TIMEOUT,
+                 tunnel_host=None, tunnel_user=None, tunnel_pass=None, tunnel_port=22):
+        self.username = username
+        self.password = password
+        self.pkey = pkey
+        self.commands = [c for c in commands if c.strip()]
+        self.timeout = timeout
+        self.tunnel = (tunnel_host, tunnel_port, tunnel_user, tunnel_pass) if tunnel_host else None
+        self._tunnel_client = None
+        self._tunnel_lock = threading.Lock()
+
+    def tunnel_transport(self):
+        """The shared tunnel transport, reconnected if it dropped"""
+        with self._tunnel_lock:
+            if self._tunnel_client is None or not self._tunnel_client.get_transport().is_active():
+                host, port, user, password = self.tunnel
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                client.connect(hostname=host, port=port, username=user, password=password, timeout=self.timeout)
+                client.get_transport().set_keepalive(30)
+                client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._tunnel_client = client
+            return self._tunnel_client.get_transport()
+
+    def close(self):
+        with self._tunnel_lock:
+            if self._tunnel_client:
+                self._tunnel_client.close()
+                self._tunnel_client = None
+
+    def test_host(self, host, port=22):
+        """Test one host, returns its report row (timings in milliseconds)"""
+        report = {"host": host, "port": port, "status": "ok", "error": ""}
+        report.update({f"{phase}_ms": None for phase in PHASES})
+        started = time.perf_counter()
+        phase = "connect"
+        sock = transport = None
+        try:
+            mark = time.perf_counter()
+            if self.tunnel:
+                sock = self.tunnel_transport().open_channel(
+                    "direct-tcpip", (host, port), ("127.0.0.1", 0), timeout=self.timeout)
+                sock.settimeout(self.timeout)
+            else:
+                sock = socket.create_connection((host, port), timeout=self.timeout)
+                # SSH handshakes are many small writes; without this delayed ACKs add ~40ms steps
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            mark = self._timed(report, phase, mark)
+
+            phase = "handshake"
+            transport = paramiko.Transport(sock)
+            transport.banner_timeout = transport.handshake_timeout = self.timeout
+            transport.start_client(timeout=self.timeout)
+            mark = self._timed(report, phase, mark)
+
+            phase = "auth"
+            if self.pkey is not None:
+                transport.auth_publickey(self.username, self.pkey)
+            else:
+                transport.auth_password(self.username, self.password)
+            mark = self._timed(report, phase, mark)
+
+            outputs = []
+            channel_seconds = exec_seconds = 0
+            for command in self.commands:
+                phase = "channel"
+                channel = transport.open_session(timeout=self.timeout)
+                channel.settimeout(self.timeout)
+                opened = time.perf_counter()
+                channel_seconds += opened - mark
+                phase = "exec"
+                channel.exec_command(command)
+                outputs.append(channel.makefile("rb").read().decode("utf-8", "replace").strip())
+                channel.recv_exit_status()
+                channel.close()
+                mark = time.perf_counter()
+                exec_seconds += mark - opened
+            report["channel_ms"] = round(channel_seconds * 1000, 2)
+            report["exec_ms"] = round(exec_seconds * 1000, 2)
+            report["output"] = "\n".join(outputs)
+        except paramiko.AuthenticationException as e:
+            report.update(status="auth_failed", error=str(e) or type(e).__name__)
+        except (socket.timeout, TimeoutError) as e:
+            report.update(status="timeout", error=f"{phase}: {e or 'timed out'}")
+        except ConnectionRefusedError as e:
+            report.update(status="refused", error=str(e))
+        except paramiko.ChannelException as e:
+            # The tunnel host could not reach the target
+            report.update(status="unreachable", error=f"{phase}: {e}")
+        except Exception as e:
+            report.update(status="error", error=f"{phase}: {e or type(e).__name__}")
+        finally:
+            if transport is not None:
+                transport.close()
+            elif sock is not None:
+                sock.close()
+        report["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return report
+
+    def scan(self, hosts, concurrency=SCAN_CONCURRENCY, progress=None):
+        """Test every (host, port); `progress(done, total, report)` is called after each one"""
+        results = [None] * len(hosts)
+        done = [0]
+        lock = threading.Lock()
+
+        def run(index):
+            report = self.test_host(*hosts[index])
+            results[index] = report
+            if progress:
+                with lock:
+                    done[0] += 1
+                    progress(done[0], len(hosts), report)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(hosts) or 1))) as executor:
+            list(executor.map(run, range(len(hosts))))
+        return results
+
+    def benchmark(self, host, port=22, iterations=BENCHMARK_ITERATIONS, warmup=BENCHMARK_WARMUP):
+        """
+        Test one host `iterations` times in a row after `warmup` untimed runs
+
+        Returns:
+            Dict with min/p50/p95/p99/max per phase (ms) over the successful runs, failure
+            counts by status, and connections per second over the whole timed run
+        """
+        for _ in range(warmup):
+            self.test_host(host, port)
+        ok, failures = [], {}
+        started = time.perf_counter()
+        for _ in range(iterations):
+            report = self.test_host(host, port)
+            if report["status"] == "ok":
+                ok.append(report)
+            else:
+                failures[report["status"]] = failures.get(report["status"], 0) + 1
+                failures.setdefault("last_error", report["error"])
+        elapsed = time.perf_counter() - started
+        fields = [f"{phase}_ms" for phase in PHASES] + ["total_ms"]
+        return {
+            "path": "tunnel" if self.tunnel else "direct",
+            "host": host,
+            "port": port,
+            "iterations": iterations,
+            "ok": len(ok),
+            "failures": failures,
+            "elapsed_seconds": round(elapsed, 3),
+            "connections_per_second": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+            "phases": {field[:-3]: latency_stats([r[field] for r in ok]) for field in fields} if ok else {},
+        }
+
+    @staticmethod
+    def _timed(report, phase, mark):
+        now = time.perf_counter()
+        report[f"{phase}_ms"] = round((now - mark) * 1000, 2)
+        return now
+
+class ScanProgress:
+    """Single-line live counter on stderr, redrawn at most every `interval` seconds"""
+
+    def __init__(self, interval=0.2, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.started = time.monotonic()
+        self.last_draw = 0
+        self.counts = {}
+
+    def __call__(self, done, total, report):
+        self.counts[report["status"]] = self.counts.get(report["status"], 0) + 1
+        now = time.monotonic()
+        if done < total and now - self.last_draw < self.interval:
+            return
+        self.last_draw = now
+        rate = done / max(now - self.started, 1e-6)
+        statuses = ", ".join(f"{status} {count}" for status, count in sorted(self.counts.items()))
+        self.stream.write(f"\r[SCAN] {done}/{total} hosts ({statuses}) {rate:.1f} hosts/s ")
+        if done == total:
+            self.stream.write("\n")
+        self.stream.flush()
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def latency_stats(values):
+    return {"min": min(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99), "max": max(values)}
+
+def print_benchmark(reports):
+    """One latency table per path, then the paths side by side"""
+    for report in reports:
+        print(f"\n{report['path']} path to {report['host']}:{report['port']}: {report['ok']}/{report['iterations']} ok "
+              f"in {report['elapsed_seconds']:.1f}s, {report['connections_per_second'] or 0:.1f} connections/s")
+        if report["failures"]:
+            print(f"  failures: {report['failures']}")
+        if report["phases"]:
+            print(f"{'phase (ms)':<14}" + "".join(f"{stat:>10}" for stat in ("min", "p50", "p95", "p99", "max")))
+            for phase, stats in report["phases"].items():
+                print(f"{phase:<14}" + "".join(f"{value:>10.1f}" for value in stats.values()))
+    if len(reports) == 2 and all(r["phases"] for r in reports):
+        direct, tunnel = reports
+        print(f"\n{'p50 (ms)':<14}{'direct':>10}{'tunnel':>10}{'added':>10}")
+        for phase in direct["phases"]:
+            d, t = direct["phases"][phase]["p50"], tunnel["phases"][phase]["p50"]
+            print(f"{phase:<14}{d:>10.1f}{t:>10.1f}{t - d:>+10.1f}")
+
+def print_scan_summary(results, elapsed):
+    counts = {}
+    for report in results:
+        counts[report["status"]] = counts.get(report["status"], 0) + 1
+    print(f"\nScanned {len(results)} hosts in {elapsed:.1f}s ({len(results) / max(elapsed, 1e-6):.1f} hosts/s)")
+    print(f"{'status':<14}{'hosts':>8}")
+    for status, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"{status:<14}{count:>8}")
+    ok = [r for r in results if r["status"] == "ok"]
+    if ok:
+        print(f"\n{'phase (ms)':<14}{'min':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+        for field in [f"{phase}_ms" for phase in PHASES] + ["total_ms"]:
+            values = [r[field] for r in ok]
+            print(f"{field[:-3]:<14}{min(values):>10.1f}{percentile(values, 0.5):>10.1f}"
+                  f"{percentile(values, 0.95):>10.1f}{max(values):>10.1f}")
+    failed = [r for r in results if r["status"] != "ok"]
+    for report in failed[:10]:
+        print(f"  {report['host']}:{report['port']}  {report['status']}  {report['error']}")
+    if len(failed) > 10:
+        print(f"  ... and {len(failed) - 10} more failures")
+
+def write_scan_report(results, path, fmt=None):
+    """Write per-host results as JSON (with command output) or CSV, by `fmt` or the file extension"""
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "json")
+    with open(path, "w", newline="") as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, f, indent=2)
+
 def main():
     parser = argparse.ArgumentParser(description="SSH Connection Tester with Tunnel Support")
     
     # Target server arguments
-    parser.add_argument("--server", required=True, help="Target server IP address")
+    parser.add_argument("--server", help="Target server IP address")
+    parser.add_argument("--hosts-file", help="Scan mode: file of host[:port] lines or an Ansible INI inventory")
+    parser.add_argument("--cidr", nargs="+", default=[], help="Scan mode: networks to scan, e.g. 10.0.0.0/24")
     parser.add_argument("--username", required=True, help="Username for target server")
     parser.add_argument("--port", type=int, default=22, help="SSH port for target server (default: 22)")
     parser.add_argument("--password", help="Password for target server (will prompt if not provided)")
@@ -164,8 +483,36 @@ def main():
     # Command arguments
     parser.add_argument("--commands", nargs="*", default=["hostname", "uptime", "whoami", "df -h"],
                        help="Commands to execute on target server")
+
+    # Scan mode arguments
+    parser.add_argument("--concurrency", type=int, default=SCAN_CONCURRENCY,
+                       help=f"Scan mode: hosts tested in parallel (default: {SCAN_CONCURRENCY})")
+    parser.add_argument("--timeout", type=float, default=SCAN_TIMEOUT,
+                       help=f"Scan mode: seconds allowed per phase (default: {SCAN_TIMEOUT})")
+    parser.add_argument("--output", help="Scan mode: write per-host results to this file")
+    parser.add_argument("--format", choices=["json", "csv"], help="Format of --output (default: from its extension)")
+
+    # Benchmark mode arguments
+    parser.add_argument("--benchmark", action="store_true",
+                       help="Measure connect/handshake/auth/channel/exec latency to --server, directly "
+                            "and (with --tunnel-host) through the tunnel")
+    parser.add_argument("--iterations", type=int, default=BENCHMARK_ITERATIONS,
+                       help=f"Benchmark mode: timed connections per path (default: {BENCHMARK_ITERATIONS})")
+    parser.add_argument("--warmup", type=int, default=BENCHMARK_WARMUP,
+                       help=f"Benchmark mode: untimed connections first (default: {BENCHMARK_WARMUP})")
+    parser.add_argument("--bench-command", default=BENCHMARK_COMMAND,
+                       help=f"Benchmark mode: command run on each connection (default: {BENCHMARK_COMMAND})")
+    parser.add_argument("--paths", nargs="+", choices=["direct", "tunnel"],
+                       help="Benchmark mode: paths to measure (default: direct, plus tunnel with --tunnel-host)")
     
     args = parser.parse_args()
+    scan_mode = bool(args.hosts_file or args.cidr)
+    if not scan_mode and not args.server:
+        print("Error: one of --server, --hosts-file or --cidr is required")
+        sys.exit(1)
+    if args.benchmark and (scan_mode or not args.server):
+        print("Error: --benchmark measures a single --server")
+        sys.exit(1)
     
     # Validate arguments
     if not args.password and not args.keyfile:
@@ -185,6 +532,11 @@ def main():
     if args.tunnel_host and not tunnel_password:
         tunnel_password = getpass.getpass("Enter password for laptop: ")
     
+    if scan_mode:
+        sys.exit(run_scan(args, target_password, tunnel_password))
+    if args.benchmark:
+        sys.exit(run_benchmark(args, target_password, tunnel_password))
+
     # Run the test
     tester = SSHConnectionTesterCLI()
     success = tester.test_connection(
@@ -202,5 +554,81 @@ def main():
     
     sys.exit(0 if success else 1)
 
+def run_scan(args, target_password, tunnel_password):
+    """Scan every host from --hosts-file / --cidr, returns the exit code"""
+    # Failures are reported per host; keep paramiko's thread tracebacks off the terminal
+    logging.getLogger("paramiko").addHandler(logging.NullHandler())
+    try:
+        hosts = load_hosts(args.hosts_file, args.cidr, args.port)
+        pkey = load_private_key(args.keyfile) if args.keyfile and not target_password else None
+    except (OSError, ValueError, paramiko.SSHException) as e:
+        print(f"Error: {e}")
+        return 1
+    if not hosts:
+        print("Error: no hosts to scan")
+        return 1
+    scanner = HostScanner(args.username, password=target_password, pkey=pkey,
+                          commands=args.commands, timeout=args.timeout,
+                          tunnel_host=args.tunnel_host, tunnel_user=args.tunnel_user,
+                          tunnel_pass=tunnel_password, tunnel_port=args.tunnel_port)
+    via = f" through {args.tunnel_user}@{args.tunnel_host}:{args.tunnel_port}" if args.tunnel_host else ""
+    print(f"Scanning {len(hosts)} hosts{via}, {args.concurrency} at a time")
+    started = time.monotonic()
+    try:
+        if scanner.tunnel:
+            scanner.tunnel_transport()  # fail fast if the tunnel itself is down
+        results = scanner.scan(hosts, args.concurrency, progress=ScanProgress())
+    except (paramiko.SSHException, OSError) as e:
+        print(f"Error: cannot establish the tunnel: {e}")
+        return 1
+    finally:
+        scanner.close()
+    print_scan_summary(results, time.monotonic() - started)
+    if args.output:
+        write_scan_report(results, args.output, args.format)
+        print(f"\nWrote {len(results)} results to {args.output}")
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+def run_benchmark(args, target_password, tunnel_password):
+    """Benchmark --server over each requested path, returns the exit code"""
+    logging.getLogger("paramiko").addHandler(logging.NullHandler())
+    paths = args.paths or (["direct", "tunnel"] if args.tunnel_host else ["direct"])
+    if "tunnel" in paths and not args.tunnel_host:
+        print("Error: the tunnel path needs --tunnel-host")
+        return 1
+    try:
+        pkey = load_private_key(args.keyfile) if args.keyfile and not target_password else None
+    except (OSError, paramiko.SSHException) as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Benchmarking {args.username}@{args.server}:{args.port}: {args.warmup} warmup + "
+          f"{args.iterations} timed connections per path, running '{args.bench_command}'")
+    reports = []
+    for path in paths:
+        tunnel = {}
+        if path == "tunnel":
+            tunnel = dict(tunnel_host=args.tunnel_host, tunnel_user=args.tunnel_user,
+                          tunnel_pass=tunnel_password, tunnel_port=args.tunnel_port)
+        scanner = HostScanner(args.username, password=target_password, pkey=pkey, commands=[args.bench_command],
+                              timeout=args.timeout, **tunnel)
+        try:
+            if scanner.tunnel:
+                started = time.perf_counter()
+                scanner.tunnel_transport()  # one shared tunnel, as in scan mode; its setup is not per connection
+                print(f"Tunnel to {args.tunnel_host}:{args.tunnel_port} established in "
+                      f"{(time.perf_counter() - started) * 1000:.1f} ms")
+            reports.append(scanner.benchmark(args.server, args.port, args.iterations, args.warmup))
+        except (paramiko.SSHException, OSError) as e:
+            print(f"Error: cannot establish the tunnel: {e}")
+            return 1
+        finally:
+            scanner.close()
+    print_benchmark(reports)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nWrote benchmark results to {args.output}")
+    return 0 if all(r["ok"] for r in reports) else 1
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+"""
+Agent Pool Task Leasing
+Lets several agents of the same customer share one task queue.
+
+Tasks are submitted to a pool (optionally with a preferred member). Any live
+member can lease them; an idle member steals queued work from an overloaded
+one, and the tasks of a member that stops heartbeating go back to the pool.
+"""
+
+import collections
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+
+class TaskPool:
+    """
+    Shared, lease-based task queue for a pool of agents
+
+    - `submit()` queues a task, on a preferred member's local queue or the shared queue
+    - `lease()` hands out up to `max_tasks` tasks: own queue first, then the shared
+      queue, then tasks stolen from the member with the longest local backlog
+    - `ack()` completes a leased task, or a requeued copy still waiting in a queue
+    - members silent for `heartbeat_timeout` seconds are evicted and their queued and
+      leased tasks are requeued; every heartbeat extends the member's leases by
+      `lease_seconds`, so only a lease whose holder stops heartbeating can expire
+    """
+
+    def __init__(self, pool_id: str, id_key: str = "task_id", heartbeat_timeout: float = 60,
+                 lease_seconds: float = 600, steal_threshold: int = 2):
+        self.pool_id = pool_id
+        self.id_key = id_key
+        self.heartbeat_timeout = heartbeat_timeout
+        self.lease_seconds = lease_seconds
+        self.steal_threshold = steal_threshold
+
+        self.shared = collections.deque()
+        self.local: Dict[str, collections.deque] = {}
+        self.leases: Dict[str, Dict] = {}
+        self.members: Dict[str, float] = {}
+        self.completed = 0
+        self.requeued = 0
+        self.stolen = 0
+        self._lock = threading.Lock()
+
+    def submit(self, task: Dict, agent_id: Optional[str] = None) -> str:
+        """Queue a task, returns its id"""
+        task.setdefault(self.id_key, str(uuid.uuid4()))
+        with self._lock:
+            if agent_id and agent_id in self.members:
+                self.local.setdefault(agent_id, collections.deque()).append(task)
+            else:
+                self.shared.append(task)
+        return task[self.id_key]
+
+    def heartbeat(self, agent_id: str):
+        with self._lock:
+            self._touch(agent_id, time.time())
+
+    def lease(self, agent_id: str, max_tasks: int = 1) -> List[Dict]:
+        """Hand out up to `max_tasks` tasks to a member (counts as a heartbeat)"""
+        now = time.time()
+        with self._lock:
+            self._touch(agent_id, now)
+            self._reap(now)
+            leased = []
+            own = self.local.get(agent_id)
+            while len(leased) < max_tasks and own:
+                leased.append(own.popleft())
+            while len(leased) < max_tasks and self.shared:
+                leased.append(self.shared.popleft())
+            while len(leased) < max_tasks:
+                victim = self._most_backlogged(exclude=agent_id)
+                if not victim:
+                    break
+                leased.append(self.local[victim].pop())
+                self.stolen += 1
+            for task in leased:
+                self.leases[task[self.id_key]] = {"task": task, "agent_id": agent_id,
+                                                  "expires": now + self.lease_seconds}
+            return leased
+
+    def ack(self, task_id: str) -> bool:
+        """Mark a leased task as done, returns False if it was neither leased nor queued"""
+        with self._lock:
+            if self.leases.pop(task_id, None) is None and not self._unqueue(task_id):
+                return False
+            self.completed += 1
+            return True
+
+    def reap(self):
+        with self._lock:
+            self._reap(time.time())
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._reap(time.time())
+            return {
+                "pool_id": self.pool_id,
+                "members": sorted(self.members),
+                "shared_queued": len(self.shared),
+                "member_queued": {a: len(q) for a, q in self.local.items() if q},
+                "leased": len(self.leases),
+                "completed": self.completed,
+                "requeued": self.requeued,
+                "stolen": self.stolen,
+            }
+
+    def _touch(self, agent_id: str, now: float):
+        self.members[agent_id] = now
+        for lease in self.leases.values():
+            if lease["agent_id"] == agent_id:
+                lease["expires"] = now + self.lease_seconds
+
+    def _unqueue(self, task_id: str) -> bool:
+        """Drop a requeued task whose original holder reported it done after all"""
+        for queue in [self.shared, *self.local.values()]:
+            for task in queue:
+                if task[self.id_key] == task_id:
+                    queue.remove(task)
+                    return True
+        return False
+
+    def _most_backlogged(self, exclude: str) -> Optional[str]:
+        backlog = {a: len(q) for a, q in self.local.items() if a != exclude}
+        if not backlog:
+            return None
+        victim = max(backlog, key=backlog.get)
+        return victim if backlog[victim] >= self.steal_threshold else None
+
+    def _reap(self, now: float):
+        """Requeue work of dead members and expired leases at the front of the shared queue"""
+        dead = {a for a, seen in self.members.items() if now - seen > self.heartbeat_timeout}
+        requeue = []
+        for agent_id in dead:
+            del self.members[agent_id]
+            requeue.extend(self.local.pop(agent_id, ()))
+        for task_id, lease in list(self.leases.items()):
+            if lease["agent_id"] in dead or lease["expires"] <= now:
+                del self.leases[task_id]
+                requeue.append(lease["task"])
+        if requeue:
+            self.requeued += len(requeue)
+            self.shared.extendleft(reversed(requeue))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for agent.py: result delivery through the spool, the polling loop skipping tasks
+whose results are still spooled, load reports and the /deploy job routes
+"""
+
+import time
+
+import pytest
+
+import agent
+from result_spool import ResultSpool
+
+
+class StopPolling(Exception):
+    pass
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.text = str(body)
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    spool = ResultSpool(str(tmp_path / "results.spool"))
+    monkeypatch.setattr(agent, "result_spool", spool)
+    return spool
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Results the fake backend accepted, in order; set backend.up = False to make it unreachable"""
+    class Backend:
+        up = True
+        received = []
+
+    def post_result(payload):
+        if Backend.up:
+            Backend.received.append(payload["task_id"])
+        return Backend.up
+
+    monkeypatch.setattr(agent, "post_result", post_result)
+    return Backend
+
+
+def test_importing_the_agent_creates_no_spool_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "result_spool", None)
+    monkeypatch.setattr(agent, "SPOOL_PATH", str(tmp_path / "lazy.spool"))
+    assert not (tmp_path / "lazy.spool").exists()
+
+    assert agent.get_result_spool() is agent.get_result_spool()
+    assert (tmp_path / "lazy.spool").exists()
+
+
+def test_a_new_result_is_delivered_behind_the_spooled_backlog(spool, backend):
+    backend.up = False
+    agent.deliver_result({"task_id": "t1"})
+    agent.deliver_result({"task_id": "t2"})
+    assert backend.received == [] and len(spool) == 2
+
+    backend.up = True
+    agent.deliver_result({"task_id": "t3"})
+
+    assert backend.received == ["t1", "t2", "t3"] and len(spool) == 0
+
+
+def test_tasks_whose_results_are_still_spooled_are_not_run_again(spool, backend, monkeypatch):
+    backend.up = False
+    spool.append({"task_id": "t1", "success": True})
+    tasks = [{"task_id": task_id, "type": "ssh-test", "data": {"host": f"{task_id}.example"}}
+             for task_id in ("t1", "t2")]
+    ran = []
+    monkeypatch.setattr(agent.requests, "get", lambda url, **kwargs: FakeResponse({"tasks": tasks}))
+    monkeypatch.setattr(agent, "run_ssh_commands", lambda ssh_data: ran.append(ssh_data) or [])
+    monkeypatch.setattr(agent.ssh_sessions, "prewarm", lambda targets: 0)
+    monkeypatch.setattr(agent.time, "sleep", lambda seconds: (_ for _ in ()).throw(StopPolling()))
+
+    with pytest.raises(StopPolling):
+        agent.poll_for_tasks()
+
+    assert ran == [{"host": "t2.example"}] and spool.pending_task_ids() == {"t1", "t2"}
+    assert agent.task_counts == {"running": 0, "queued": 0}
+
+
+def test_load_report_keeps_deploy_capacity_apart_from_ssh_task_slots():
+    report = agent.load_report()
+
+    assert report["free_slots"] == agent.TASK_SLOTS and report["running_tasks"] == 0
+    assert report["deploy"]["free_slots"] == agent.DEPLOY_WORKERS
+
+
+def test_deploy_jobs_can_be_followed_streamed_and_cancelled():
+    client = agent.app.test_client()
+
+    started = time.monotonic()
+    queued = client.post("/deploy", json={"type": "shell", "script": "echo built; sleep 0.2; echo shipped"})
+    body = queued.get_json()
+    assert queued.status_code == 202 and time.monotonic() - started < 0.2
+    assert body["status_url"] == f"/deploy/{body['job_id']}"
+
+    status = client.get(body["status_url"], query_string={"wait": 5}).get_json()
+    assert status["output"][0] == {"stream": "stdout", "data": "built\n"}
+    streamed = client.get(body["stream_url"]).get_data(as_text=True)
+    assert "built\nshipped\n" in streamed and streamed.endswith("[job succeeded, returncode=0]\n")
+
+    slow = client.post("/deploy", json={"type": "shell", "script": "sleep 30"}).get_json()
+    assert client.delete(slow["status_url"]).get_json()["success"]
+    deadline = time.monotonic() + 5
+    while client.get(slow["status_url"]).get_json()["status"] != "cancelled" and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get(slow["status_url"]).get_json()["status"] == "cancelled"
+
+    waited = client.post("/deploy", json={"type": "shell", "script": "echo sync", "wait": True}).get_json()
+    assert waited["success"] and waited["output"] == "sync\n"
+
+
+def test_bad_deploy_requests_are_rejected():
+    client = agent.app.test_client()
+
+    for timeout in ("soon", None, 0, float("inf")):
+        response = client.post("/deploy", json={"type": "shell", "script": "true", "timeout": timeout})
+        assert response.status_code == 400 and not response.get_json()["success"]
+    assert client.get("/deploy/unknown").status_code == 404
+    job = client.post("/deploy", json={"type": "shell", "script": "true"}).get_json()
+    assert client.get(job["status_url"], query_string={"wait": "nan"}).status_code == 400
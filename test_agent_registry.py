@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for heartbeat-driven agent liveness tracking
+"""
+
+import time
+
+import agent_registry
+import server
+from agent_registry import AgentRegistry
+
+
+def test_agents_go_offline_come_back_and_are_forgotten(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(agent_registry.time, "time", lambda: clock[0])
+    registry = AgentRegistry(timeout=10, forget_after=100)
+    registry.heartbeat("a", pool_id="p1")
+    registry.heartbeat("b")
+
+    clock[0] = 1005
+    assert registry.expire() == 1010
+    registry.heartbeat("b")  # b stays alive past a's deadline
+    clock[0] = 1010
+    assert registry.expire() == 1015
+    assert registry.counts() == {"online": 1, "offline": 1, "registered": 2, "expired": 1}
+    assert not registry.is_online("a") and registry.is_online("b")
+
+    registry.heartbeat("a")
+    assert registry.is_online("a") and registry.get("a")["pool_id"] == "p1"
+    clock[0] = 2000
+    registry.expire()
+    assert registry.counts() == {"online": 0, "offline": 0, "registered": 0, "expired": 3}
+
+
+def test_expiry_thread_fires_at_the_deadline_and_heap_stays_compact():
+    registry = AgentRegistry(timeout=0.3)
+    registry.start()
+    for _ in range(3000):
+        registry.heartbeat("busy")
+    registry.heartbeat("quiet")
+    assert len(registry._heap) <= 2 * len(registry.agents) + 1024
+
+    time.sleep(0.2)
+    registry.heartbeat("busy")
+    time.sleep(0.2)
+    assert registry.counts()["online"] == 1 and registry.is_online("busy")
+    time.sleep(0.3)
+    assert registry.counts()["offline"] == 2
+
+
+def test_polls_and_results_keep_server_agents_online():
+    client = server.app.test_client()
+    agent_id = client.post("/api/register", json={}).get_json()["agent_id"]
+    registered = server.registry.get(agent_id)["last_seen"]
+    time.sleep(0.01)
+    client.get(f"/api/tasks/{agent_id}")
+    polled = server.registry.get(agent_id)["last_seen"]
+    time.sleep(0.01)
+    client.post("/api/results", json={"agent_id": agent_id, "task_id": "t", "result": {}})
+
+    assert registered < polled < server.registry.get(agent_id)["last_seen"]
+    assert client.get(f"/api/agents/{agent_id}").get_json()["status"] == "active"
+    assert client.get("/api/agents/stats").get_json()["online"] >= 1
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tests for the agent_tcp_proxy selector engine and its route config, run against a local echo server
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import agent_tcp_proxy
+
+
+@pytest.fixture
+def echo_server():
+    """Echoes everything, then half-closes after the client's EOF"""
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def echo(conn):
+        with conn:
+            while data := conn.recv(65536):
+                conn.sendall(data)
+            conn.shutdown(socket.SHUT_WR)
+
+    def accept_loop():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=echo, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    yield server.getsockname()[1]
+    server.close()
+
+
+@pytest.fixture(params=[True, False], ids=["splice", "buffers"])
+def engine(request):
+    if request.param and not agent_tcp_proxy.SPLICE_SUPPORTED:
+        pytest.skip("os.splice not available")
+    engine = agent_tcp_proxy.ProxyEngine(buffer_size=64 * 1024, use_splice=request.param)
+    yield engine
+    engine.stop()
+
+
+def read_all(sock):
+    chunks = []
+    while data := sock.recv(65536):
+        chunks.append(data)
+    return b"".join(chunks)
+
+
+def read_exactly(sock, size):
+    data = b""
+    while len(data) < size and (chunk := sock.recv(size - len(data))):
+        data += chunk
+    return data
+
+
+def test_payload_round_trips_and_half_close_is_forwarded(engine, echo_server):
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server)
+    engine.start()
+    payload = os.urandom(3 * 1024 * 1024)
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        received = []
+        reader = threading.Thread(target=lambda: received.append(read_all(client)))
+        reader.start()
+        client.sendall(payload)
+        client.shutdown(socket.SHUT_WR)  # the echo server only answers EOF once it sees ours
+        reader.join(10)
+
+    assert received == [payload]
+
+
+def test_many_concurrent_connections_share_one_thread(engine, echo_server):
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server)
+    engine.start()
+    clients = [socket.create_connection(("127.0.0.1", port)) for _ in range(50)]
+    for i, client in enumerate(clients):
+        client.sendall(b"ping %d" % i)
+    replies = [client.recv(64) for client in clients]
+    proxy_threads = [t for t in threading.enumerate() if t.name == "proxy-engine"]
+    for client in clients:
+        client.close()
+
+    assert replies == [b"ping %d" % i for i in range(50)]
+    assert len(proxy_threads) == 1
+
+
+def test_refused_upstream_closes_the_client(engine):
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        closed_port = unused.getsockname()[1]
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", closed_port)
+    engine.start()
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.settimeout(5)
+        assert client.recv(16) == b""
+
+
+def test_route_limits_refuse_extra_connections(engine, echo_server):
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server, max_connections=2)
+    engine.start()
+    kept = [socket.create_connection(("127.0.0.1", port)) for _ in range(2)]
+    for client in kept:
+        client.sendall(b"hi")
+        assert client.recv(16) == b"hi"
+    with socket.create_connection(("127.0.0.1", port)) as refused:
+        refused.settimeout(5)
+        assert refused.recv(16) == b""
+    kept.pop().close()
+    time.sleep(0.2)
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(b"again")
+        assert client.recv(16) == b"again"
+    kept[0].close()
+
+
+def test_idle_connections_are_closed(engine, echo_server, monkeypatch):
+    monkeypatch.setattr(agent_tcp_proxy, "SWEEP_INTERVAL", 0.1)
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server, idle_timeout=0.3)
+    engine.start()
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.settimeout(5)
+        client.sendall(b"hi")
+        assert client.recv(16) == b"hi"
+        assert client.recv(16) == b""
+    time.sleep(0.1)
+    assert not engine.connections
+
+
+def test_drain_stops_accepting_and_lets_open_connections_finish(engine, echo_server):
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server)
+    thread = engine.start()
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(b"hi")
+        assert client.recv(16) == b"hi"  # accepted and connected before the drain starts
+        engine.drain(timeout=10)
+        time.sleep(0.2)
+        with pytest.raises(ConnectionRefusedError):
+            socket.create_connection(("127.0.0.1", port))
+        client.sendall(b"still here")
+        assert client.recv(16) == b"still here"
+        assert thread.is_alive()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_load_routes_expands_subnets(tmp_path):
+    config = tmp_path / "routes.json"
+    config.write_text(json.dumps({
+        "defaults": {"idle_timeout": 600},
+        "drain_timeout": 5,
+        "routes": [
+            {"name": "db", "listen": "0.0.0.0:2222", "forward": "10.0.0.5:22", "max_connections": 8},
+            {"name": "app", "listen": "127.0.0.1:2300", "forward_subnet": "10.0.1.0/30", "forward_port": 2022},
+        ],
+    }))
+
+    routes, settings = agent_tcp_proxy.load_routes(str(config))
+
+    assert settings == {"drain_timeout": 5, "stats_port": None, "stats_interval": 0}
+    assert [(r.name, r.listen_host, r.listen_port, r.forward_host, r.forward_port) for r in routes] == [
+        ("db", "0.0.0.0", 2222, "10.0.0.5", 22),
+        ("app/10.0.1.1", "127.0.0.1", 2300, "10.0.1.1", 2022),
+        ("app/10.0.1.2", "127.0.0.1", 2301, "10.0.1.2", 2022),
+    ]
+    assert routes[0].max_connections == 8 and routes[0].idle_timeout == 600
+    assert routes[1].max_connections == agent_tcp_proxy.MAX_CONNECTIONS
+
+
+def test_stats_count_bytes_connections_and_refusals(engine, echo_server):
+    port = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server, name="echo", max_connections=1)
+    engine.start()
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(b"x" * 1000)
+        assert len(read_exactly(client, 1000)) == 1000
+        open_connections = engine.stats()["connections"]
+        with socket.create_connection(("127.0.0.1", port)) as refused:
+            refused.settimeout(5)
+            assert refused.recv(16) == b""
+    time.sleep(0.2)
+
+    route = engine.stats()["routes"][0]
+    assert [(c["route"], c["bytes_in"], c["bytes_out"]) for c in open_connections] == [("echo", 1000, 1000)]
+    assert route["bytes_in"] == route["bytes_out"] == 1000
+    assert (route["connections_total"], route["connected"], route["closed"], route["refused"]) == (1, 1, 1, 1)
+    assert route["connect_ms_avg"] is not None and route["active"] == 0
+
+
+def test_stats_count_connect_errors_and_idle_closes(engine, echo_server, monkeypatch):
+    monkeypatch.setattr(agent_tcp_proxy, "SWEEP_INTERVAL", 0.1)
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        closed_port = unused.getsockname()[1]
+    dead = engine.add_route("127.0.0.1", 0, "127.0.0.1", closed_port, name="dead")
+    idle = engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server, name="idle", idle_timeout=0.3)
+    engine.start()
+    for port in (dead, idle):
+        with socket.create_connection(("127.0.0.1", port)) as client:
+            client.settimeout(5)
+            client.sendall(b"hi")
+            try:
+                while client.recv(16):
+                    pass
+            except ConnectionResetError:  # closed with "hi" unread when the upstream refuses
+                pass
+    time.sleep(0.1)
+
+    routes = {r["name"]: r for r in engine.stats(connections=False)["routes"]}
+    assert routes["dead"]["connect_errors"] == 1 and routes["dead"]["connected"] == 0
+    assert routes["idle"]["idle_closed"] == 1 and routes["idle"]["io_errors"] == 0
+
+
+def test_stats_endpoint_serves_json(engine, echo_server):
+    engine.add_route("127.0.0.1", 0, "127.0.0.1", echo_server, name="echo")
+    engine.start()
+    server = agent_tcp_proxy.serve_stats(engine, 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/stats?connections=0"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            report = json.load(response)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [r["name"] for r in report["routes"]] == ["echo"]
+    assert "connections" not in report
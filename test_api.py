@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests for the command API: per-agent queues, batching and long-polling
+"""
+
+import threading
+import time
+
+import pytest
+
+import api
+
+
+@pytest.fixture
+def client():
+    for registry in (api.command_queue, api.command_results, api.command_pools, api.leased_commands):
+        registry.clear()
+    return api.app.test_client()
+
+
+def queue(client, command, **fields):
+    payload = {"agent_id": "agent-1", "target_host": "10.0.0.5", "target_type": "linux", "command": command}
+    payload.update(fields)
+    return client.post("/api/queue_command", json=payload).get_json()["correlation_id"]
+
+
+def poll(client, **params):
+    return client.get("/api/commands", query_string=dict({"agent_id": "agent-1"}, **params)).get_json()
+
+
+def test_poll_drains_in_order_and_respects_max_commands(client):
+    for i in range(5):
+        queue(client, f"echo {i}")
+
+    first = poll(client, max_commands=3)
+    rest = poll(client)
+
+    assert [c["command"] for c in first] == ["echo 0", "echo 1", "echo 2"]
+    assert [c["command"] for c in rest] == ["echo 3", "echo 4"]
+    assert poll(client) == []
+
+
+def test_long_poll_returns_as_soon_as_a_command_is_queued(client):
+    received = []
+    poller = threading.Thread(target=lambda: received.append((poll(client, wait=10), time.monotonic())))
+    poller.start()
+    time.sleep(0.3)
+    queued_at = time.monotonic()
+    queue(client, "uptime")
+    poller.join(5)
+
+    commands, returned_at = received[0]
+    assert [c["command"] for c in commands] == ["uptime"]
+    assert returned_at - queued_at < 1
+
+
+def test_long_poll_times_out_empty_and_pool_work_wakes_members(client):
+    started = time.monotonic()
+    assert poll(client, wait=0.3) == []
+    assert time.monotonic() - started >= 0.3
+
+    poll(client, pool_id="pool-1")  # join the pool
+    received = []
+    poller = threading.Thread(target=lambda: received.append(poll(client, pool_id="pool-1", wait=10)))
+    poller.start()
+    time.sleep(0.3)
+    queue(client, "hostname", agent_id=None, pool_id="pool-1")
+    poller.join(5)
+
+    assert [c["command"] for c in received[0]] == ["hostname"]
+
+
+def test_concurrent_polls_never_duplicate_or_lose_commands(client):
+    received = []
+    pollers = [threading.Thread(target=lambda: received.extend(poll(client, wait=2, max_commands=5)))
+               for _ in range(8)]
+    for poller in pollers:
+        poller.start()
+    ids = [queue(client, f"echo {i}") for i in range(40)]
+    for poller in pollers:
+        poller.join(5)
+    received.extend(poll(client))
+
+    assert sorted(c["correlation_id"] for c in received) == sorted(ids)
+
+
+def report(client, correlation_id, output):
+    client.post("/api/commands/results", json={"correlation_id": correlation_id, "output": output})
+
+
+def test_result_fetch_blocks_until_the_agent_reports(client):
+    correlation_id = queue(client, "uptime")
+    pending = client.get(f"/api/commands/results/{correlation_id}")
+    assert pending.status_code == 202
+
+    threading.Timer(0.3, report, args=(client, correlation_id, "up 3 days")).start()
+    started = time.monotonic()
+    response = client.get(f"/api/commands/results/{correlation_id}", query_string={"wait": 10})
+
+    assert response.status_code == 200 and response.get_json()["output"] == "up 3 days"
+    assert time.monotonic() - started < 2
+
+
+def test_batch_results_wait_for_all_or_any(client):
+    ids = [queue(client, f"echo {i}") for i in range(3)]
+    report(client, ids[0], "0")
+
+    partial = client.post("/api/commands/results/batch", json={"correlation_ids": ids, "wait": 0.2}).get_json()
+    assert list(partial["results"]) == [ids[0]] and partial["pending"] == ids[1:]
+
+    threading.Timer(0.2, report, args=(client, ids[2], "2")).start()
+    threading.Timer(0.6, report, args=(client, ids[1], "1")).start()
+    first = client.post("/api/commands/results/batch",
+                        json={"correlation_ids": ids[1:], "wait": 10, "wait_for": "any"}).get_json()
+    assert list(first["results"]) == [ids[2]] and first["pending"] == [ids[1]]
+    every = client.post("/api/commands/results/batch", json={"correlation_ids": ids, "wait": 10}).get_json()
+    assert [every["results"][cid]["output"] for cid in ids] == ["0", "1", "2"] and every["pending"] == []
+
+
+def test_max_concurrency_must_be_a_positive_integer(client):
+    fields = {"agent_id": "agent-1", "target_hosts": ["10.0.0.5", "10.0.0.6"], "target_type": "linux",
+              "command": "uptime"}
+    for bad in (0, -1, "4", None, 2.5, True):
+        response = client.post("/api/queue_command", json=dict(fields, max_concurrency=bad))
+        assert response.status_code == 400
+
+    client.post("/api/queue_command", json=dict(fields, max_concurrency=4))
+    assert poll(client)[0]["max_concurrency"] == 4
+
+
+def test_batch_results_reject_a_bad_wait(client):
+    correlation_id = queue(client, "uptime")
+    for wait in ("soon", None, [1], True):
+        response = client.post("/api/commands/results/batch", json={"correlation_ids": [correlation_id], "wait": wait})
+        assert response.status_code == 400
+
+
+def test_poll_rejects_a_wait_that_is_not_finite(client):
+    for wait in ("nan", "inf", "soon"):
+        assert client.get("/api/commands", query_string={"agent_id": "agent-1", "wait": wait}).status_code == 400
+
+
+def test_result_fetches_reject_a_wait_that_is_not_finite(client):
+    correlation_id = queue(client, "uptime")
+    for wait in ("nan", "-inf"):
+        response = client.get(f"/api/commands/results/{correlation_id}", query_string={"wait": wait})
+        assert response.status_code == 400
+    batch = client.post("/api/commands/results/batch", json={"correlation_ids": [correlation_id], "wait": "nan"})
+    assert batch.status_code == 400
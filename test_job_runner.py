@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the background job runner used by the agent /deploy endpoint
+"""
+
+import time
+
+import pytest
+
+from job_runner import JobRunner, SUCCEEDED, FAILED, TIMEOUT, CANCELLED, parse_timeout, parse_wait
+
+
+def test_output_is_read_incrementally():
+    runner = JobRunner(max_workers=1)
+    job = runner.submit("echo one; sleep 0.2; echo two >&2; exit 3")
+
+    chunks, offset = job.read_output(0, wait=2)
+    assert chunks[0] == {"stream": "stdout", "data": "one\n"}
+
+    assert job.wait(5)
+    chunks, _ = job.read_output(offset)
+    assert chunks == [{"stream": "stderr", "data": "two\n"}]
+    assert job.status == FAILED and job.returncode == 3
+
+
+def test_timeout_and_cancel():
+    runner = JobRunner(max_workers=1)
+    slow = runner.submit("sleep 30", timeout=0.3)
+    queued = runner.submit("echo never")
+    assert runner.stats()["queued"] >= 1
+
+    assert runner.cancel(queued.job_id)
+    assert slow.wait(5) and slow.status == TIMEOUT
+    assert queued.status == CANCELLED
+
+    running = runner.submit("sleep 30")
+    time.sleep(0.2)
+    assert runner.cancel(running.job_id)
+    assert running.wait(5) and running.status == CANCELLED
+
+    done = runner.submit("true")
+    assert done.wait(5) and done.status == SUCCEEDED
+
+
+def test_jobs_with_the_same_key_never_overlap(tmp_path):
+    runner = JobRunner(max_workers=3)
+    log = tmp_path / "log"
+    script = f"echo start $0 >> {log}; sleep 0.3; echo end $0 >> {log}"
+    first = runner.submit(["bash", "-c", script, "a1"], shell=False, key="site.yml")
+    second = runner.submit(["bash", "-c", script, "a2"], shell=False, key="site.yml")
+    other = runner.submit(["bash", "-c", script, "b1"], shell=False, key="db.yml")
+    time.sleep(0.1)
+    assert runner.stats()["running"] == 2 and second.status == "queued"
+
+    assert all(job.wait(5) for job in (first, second, other))
+    lines = [line for line in log.read_text().splitlines() if line.endswith(("a1", "a2"))]
+    assert lines == ["start a1", "end a1", "start a2", "end a2"]
+
+
+def test_a_failing_job_does_not_kill_its_worker():
+    runner = JobRunner(max_workers=1)
+    broken = runner.submit("sleep 5", timeout="600")  # endpoints reject this with parse_timeout
+
+    assert broken.wait(5) and broken.status == FAILED and "TypeError" in broken.error
+    later = runner.submit("true")
+    assert later.wait(5) and later.status == SUCCEEDED
+
+
+def test_a_job_cancelled_as_it_is_dequeued_never_starts():
+    runner = JobRunner(max_workers=0)
+    job = runner.submit("echo never")
+    assert runner.cancel(job.job_id)
+
+    runner._run(job)  # the worker picked it up just before the cancel landed
+    assert job.status == CANCELLED and job._process is None
+
+
+def test_parse_timeout():
+    assert parse_timeout("600") == 600.0 and parse_timeout(1.5) == 1.5
+    for bad in (None, "soon", 0, -1, True, float("inf"), [5]):
+        with pytest.raises(ValueError):
+            parse_timeout(bad)
+
+
+def test_parse_wait_clamps_and_rejects_non_finite_values():
+    assert parse_wait("5", 30) == 5.0 and parse_wait(-3, 30) == 0 and parse_wait(600, 30) == 30
+    for bad in (None, "soon", True, float("nan"), "nan", "inf", [5]):
+        with pytest.raises(ValueError):
+            parse_wait(bad, 30)
+
+
+def test_output_that_is_not_utf8_is_replaced():
+    runner = JobRunner(max_workers=1)
+    job = runner.submit("printf '\\377\\376'; head -c 300000 /dev/zero | tr '\\0' a; echo", timeout=10)
+
+    assert job.wait(5) and job.status == SUCCEEDED
+    output = job.collected("stdout")
+    assert output.startswith("��") and output.count("a") == 300000
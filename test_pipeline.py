@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for concurrent multi-step orchestration against the command API and a fake agent
+"""
+
+import threading
+import time
+
+import pytest
+import requests
+from werkzeug.serving import make_server
+
+import api
+import pipeline
+
+
+@pytest.fixture
+def api_url(monkeypatch):
+    for registry in (api.command_queue, api.command_results, api.command_pools, api.leased_commands):
+        registry.clear()
+    server = make_server("127.0.0.1", 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(pipeline, "CLOUD_SERVER_API_URL", url)
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture
+def agent(api_url):
+    """Runs "sleep N", "fail" and "hang" commands, each on its own thread like a fan-out agent"""
+    ran = []
+    stopping = threading.Event()
+
+    def execute(command):
+        ran.append((command["target_host"], command["command"], time.monotonic()))
+        words = command["command"].split()
+        if words[0] == "hang":
+            return
+        if words[0] == "sleep":
+            time.sleep(float(words[1]))
+        result = {"correlation_id": command["correlation_id"], "status": "success",
+                  "return_code": 1 if words[0] == "fail" else 0}
+        requests.post(f"{api_url}/api/commands/results", json=result)
+
+    def poll_loop():
+        while not stopping.is_set():
+            commands = requests.get(f"{api_url}/api/commands",
+                                    params={"agent_id": pipeline.AGENT_ID, "wait": 0.2}).json()
+            for command in commands:
+                threading.Thread(target=execute, args=(command,), daemon=True).start()
+
+    thread = threading.Thread(target=poll_loop, daemon=True)
+    thread.start()
+    yield ran
+    stopping.set()
+    thread.join(5)
+
+
+def step(name, host, command, **extra):
+    return dict({"name": name, "target_host": host, "target_type": "linux", "command": command}, **extra)
+
+
+def test_independent_steps_run_in_parallel(agent):
+    steps = [step(f"uptime-{i}", f"10.0.0.{i}", "sleep 0.5") for i in range(6)]
+
+    report = pipeline.run_pipeline(steps)
+
+    assert report["status"] == "success"
+    assert all(r["status"] == "success" for r in report["steps"].values())
+    assert report["elapsed_seconds"] < 1.5  # not 6 x 0.5s
+
+
+def test_dependencies_run_in_order_and_failures_skip_dependents(agent):
+    steps = [
+        step("build", "10.0.0.1", "sleep 0.3"),
+        step("deploy-a", "10.0.0.2", "sleep 0.1", depends_on=["build"]),
+        step("deploy-b", "10.0.0.3", "fail", depends_on=["build"]),
+        step("smoke-a", "10.0.0.2", "sleep 0", depends_on=["deploy-a"]),
+        step("smoke-b", "10.0.0.3", "sleep 0", depends_on=["deploy-b"]),
+    ]
+
+    report = pipeline.run_pipeline(steps)
+
+    statuses = {name: r["status"] for name, r in report["steps"].items()}
+    assert statuses == {"build": "success", "deploy-a": "success", "deploy-b": "failed",
+                        "smoke-a": "success", "smoke-b": "skipped"}
+    assert report["status"] == "failed"
+    started = {(host, command): at for host, command, at in agent}
+    assert ("10.0.0.3", "sleep 0") not in started  # smoke-b never reached the agent
+    assert started[("10.0.0.2", "sleep 0.1")] - started[("10.0.0.1", "sleep 0.3")] >= 0.3
+
+
+def test_step_deadline_times_out_only_that_step(agent):
+    steps = [step("stuck", "10.0.0.1", "hang", timeout=0.5), step("fine", "10.0.0.2", "sleep 0.1"),
+             step("after-stuck", "10.0.0.1", "sleep 0", depends_on=["stuck"])]
+
+    started = time.monotonic()
+    report = pipeline.run_pipeline(steps)
+
+    assert {name: r["status"] for name, r in report["steps"].items()} == {
+        "stuck": "timeout", "fine": "success", "after-stuck": "skipped"}
+    assert time.monotonic() - started < 2
+
+
+def test_invalid_dependencies_are_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        pipeline.run_pipeline([step("a", "h", "x", depends_on=["missing"])])
+    with pytest.raises(ValueError, match="cycle"):
+        pipeline.run_pipeline([step("a", "h", "x", depends_on=["b"]), step("b", "h", "x", depends_on=["a"])])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the agent's on-disk result spool
+"""
+
+import os
+
+from result_spool import ResultSpool
+
+
+def test_replay_in_order_and_truncate(tmp_path):
+    spool = ResultSpool(str(tmp_path / "results.spool"))
+    for i in range(5):
+        spool.append({"task_id": str(i)})
+
+    sent = []
+    def send(record):
+        if len(sent) == 3:
+            return False
+        sent.append(record["task_id"])
+        return True
+
+    assert spool.replay(send) == 3
+    assert [r["task_id"] for r in spool.pending()] == ["3", "4"]
+
+    assert spool.replay(lambda r: sent.append(r["task_id"]) or True) == 2
+    assert sent == ["0", "1", "2", "3", "4"]
+    assert len(spool) == 0
+    assert os.path.getsize(spool.path) == 0
+
+
+def test_survives_restart_and_torn_write(tmp_path):
+    path = str(tmp_path / "results.spool")
+    spool = ResultSpool(path)
+    spool.append({"task_id": "a"})
+    spool.append({"task_id": "b"})
+    spool.replay(lambda r: r["task_id"] == "a")
+    spool.close()
+
+    with open(path, "ab") as f:
+        f.write(b'{"task_id": "c"')  # crash in the middle of a write
+
+    reopened = ResultSpool(path)
+    assert reopened.pending_task_ids() == {"b"}
+    reopened.append({"task_id": "d"})
+    assert [r["task_id"] for r in reopened.pending()] == ["b", "d"]
+
+
+def test_size_cap_drops_oldest(tmp_path):
+    spool = ResultSpool(str(tmp_path / "results.spool"), max_bytes=100)
+    for i in range(10):
+        spool.append({"task_id": str(i), "pad": "x" * 10})
+
+    assert os.path.getsize(spool.path) <= 100
+    assert spool.dropped > 0
+    assert spool.pending()[-1]["task_id"] == "9"
+    assert len(spool) == len(spool.pending())
+
+
+def test_counts_come_from_memory_and_appends_sync_in_batches(tmp_path, monkeypatch):
+    spool = ResultSpool(str(tmp_path / "results.spool"), fsync_every=4, fsync_interval=3600)
+    syncs = []
+    monkeypatch.setattr(os, "fsync", lambda fd: syncs.append(fd))
+    for i in range(6):
+        spool.append({"task_id": str(i)})
+    assert len(syncs) == 1  # one batch of four, the other two wait for the next batch or the timer
+
+    def unreadable(*args, **kwargs):
+        raise AssertionError("the spool file was read")
+    monkeypatch.setattr(spool, "_iter_pending", unreadable)
+    assert len(spool) == 6 and spool.pending_task_ids() == {str(i) for i in range(6)}
+    monkeypatch.undo()
+
+    spool.replay(lambda r: r["task_id"] in ("0", "1"))
+    assert len(spool) == 4 and spool.pending_task_ids() == {"2", "3", "4", "5"}
+    assert len(ResultSpool(spool.path)) == 4
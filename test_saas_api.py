@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for the saas_api agent endpoints: target hints and placement on the least-loaded agent
+"""
+
+import json
+
+import pytest
+
+import saas_api
+
+
+@pytest.fixture
+def client():
+    for registry in (saas_api.agent_tasks, saas_api.agent_results, saas_api.agent_load,
+                     saas_api.tenant_agents, saas_api.agent_hints, saas_api.task_pools):
+        registry.clear()
+    return saas_api.app.test_client()
+
+
+def poll(client, agent_id, tenant_id=None, **load):
+    params = {"agent_id": agent_id, "load": json.dumps(load)}
+    if tenant_id:
+        params["tenant_id"] = tenant_id
+    return client.get("/api/tasks", query_string=params).get_json()
+
+
+TARGET = {"host": "10.0.0.5", "port": 22, "username": "admin", "password": "pw"}
+
+
+def test_hints_are_handed_out_once_with_the_next_poll(client):
+    response = client.post("/api/tasks/hints", json={"agent_id": "agent-1", "targets": [TARGET]})
+
+    assert response.get_json() == {"success": True, "agents": ["agent-1"]}
+    assert poll(client, "agent-1")["hints"] == [TARGET]
+    assert poll(client, "agent-1")["hints"] == []
+
+
+def test_tenant_hints_go_to_every_live_agent_of_the_tenant(client, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(saas_api.time, "time", lambda: clock[0])
+    poll(client, "stale", "acme")
+    clock[0] += saas_api.AGENT_LOAD_TTL + 1
+    poll(client, "agent-1", "acme")
+    poll(client, "agent-2", "acme")
+    poll(client, "other", "globex")
+
+    response = client.post("/api/tasks/hints", json={"tenant_id": "acme", "targets": [TARGET]})
+
+    assert sorted(response.get_json()["agents"]) == ["agent-1", "agent-2"]
+    assert [bool(poll(client, a)["hints"]) for a in ("agent-1", "agent-2", "stale", "other")] == \
+        [True, True, False, False]
+    assert client.post("/api/tasks/hints", json={"agent_id": "agent-1"}).status_code == 400
+    assert client.post("/api/tasks/hints", json={"targets": [TARGET]}).status_code == 400
+
+
+def place(client, tenant_id="acme"):
+    response = client.post("/api/tasks/add", json={"tenant_id": tenant_id, "task": {"type": "ssh-test"}})
+    return response.get_json()["agent_id"]
+
+
+def heartbeat(client, agent_id, tenant_id="acme", **load):
+    return client.post("/api/agents/heartbeat", json={"agent_id": agent_id, "tenant_id": tenant_id, "load": load})
+
+
+def test_tasks_go_to_the_least_loaded_agent(client):
+    heartbeat(client, "busy", running_tasks=1, queued_tasks=3, free_slots=0)
+    heartbeat(client, "idle", running_tasks=0, free_slots=1)
+    heartbeat(client, "hot", running_tasks=0, free_slots=1, cpu_load=7.5, cpu_count=2)
+
+    assert place(client) == "idle"
+    assert saas_api.agent_load["idle"]["tenant_id"] == "acme"
+    assert heartbeat(client, None).status_code == 400
+
+
+def test_ties_are_broken_by_work_already_placed(client):
+    for agent_id in ("agent-b", "agent-a"):
+        heartbeat(client, agent_id, running_tasks=0, free_slots=1)
+
+    placed = [place(client) for _ in range(4)]
+
+    assert placed == ["agent-a", "agent-b", "agent-a", "agent-b"]
+
+
+def test_stale_load_reports_are_ignored(client, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(saas_api.time, "time", lambda: clock[0])
+    heartbeat(client, "gone", running_tasks=0, free_slots=4)
+    clock[0] += saas_api.AGENT_LOAD_TTL + 1
+    heartbeat(client, "loaded", running_tasks=3, free_slots=0)
+
+    assert place(client) == "loaded"
+
+
+def test_a_tenant_without_agents_queues_to_the_shared_pool(client):
+    heartbeat(client, "agent-1", tenant_id="globex", free_slots=1)
+
+    assert saas_api.pick_least_loaded_agent("acme") is None
+    assert place(client) is None
+    assert saas_api.task_pools["acme"].stats()["shared_queued"] == 1
+
+
+def test_pool_leases_are_sized_by_ssh_task_capacity(client):
+    for _ in range(3):
+        client.post("/api/tasks/add", json={"tenant_id": "acme", "task": {"type": "ssh-test"}})
+    deploy = {"max_workers": 2, "running": 0, "queued": 0, "free_slots": 2}
+
+    assert poll(client, "agent-1", "acme", running_tasks=1, free_slots=0, deploy=deploy)["tasks"] == []
+    assert len(poll(client, "agent-1", "acme", running_tasks=0, free_slots=1, deploy=deploy)["tasks"]) == 1
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Tests for backend playbook runs in server.py: queued as jobs, never overlapping, output streamed
+"""
+
+import time
+
+import server
+
+
+def test_playbook_runs_are_jobs_that_never_overlap(tmp_path, monkeypatch):
+    playbook = tmp_path / "deploy.sh"
+    playbook.write_text(f"echo start $$ >> {tmp_path}/log; sleep 0.3; echo done; sleep 0.05; echo warn >&2\n")
+    monkeypatch.setattr(server, "ANSIBLE_PLAYBOOK", str(playbook))
+    client = server.app.test_client()
+
+    started = time.monotonic()
+    first = client.post("/api/ansible/run").get_json()
+    second = client.post("/api/ansible/run", json={"timeout": 10}).get_json()
+    assert time.monotonic() - started < 0.3  # the requests do not wait for the runs
+    assert first["status_url"] == f"/api/ansible/jobs/{first['job_id']}"
+
+    status = client.get(first["status_url"], query_string={"wait": 5}).get_json()
+    assert status["output"][0] == {"stream": "stdout", "data": "done\n"}
+    assert client.get(second["status_url"]).get_json()["status"] in ("queued", "running")
+    streamed = client.get(second["stream_url"]).get_data(as_text=True)
+
+    assert "done\nwarn\n" in streamed and streamed.endswith("[job succeeded, returncode=0]\n")
+    assert client.get(first["status_url"]).get_json()["status"] == "succeeded"
+    assert len((tmp_path / "log").read_text().splitlines()) == 2
+    assert time.monotonic() - started >= 0.6  # one after the other, not side by side
+    assert client.get("/api/ansible/jobs/unknown").status_code == 404
+    assert client.get(first["status_url"], query_string={"wait": "nan"}).status_code == 400
+
+
+def test_bad_timeouts_are_rejected():
+    client = server.app.test_client()
+    for timeout in ("600x", None, -5):
+        response = client.post("/api/ansible/run", json={"timeout": timeout})
+        assert response.status_code == 400 and not response.get_json()["success"]
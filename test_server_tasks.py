@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-agent task FIFO in server.py, shellahgent's duplicate-execution guard and
+incremental output upload
+"""
+
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+import server
+import shellahgent
+
+
+@pytest.fixture
+def client():
+    server.tasks.clear()
+    server.results.clear()
+    server.task_outputs.clear()
+    return server.app.test_client()
+
+
+def add(client, command, **task):
+    task = dict({"type": "command", "payload": command}, **task)
+    return client.post("/api/tasks/add", json={"agent_id": "agent-1", "task": task}).get_json()
+
+
+def test_tasks_queue_in_order_and_leave_on_result(client):
+    first, second = add(client, "hostname"), add(client, "uptime")
+    assert (first["position"], second["position"]) == (1, 2)
+    assert add(client, "hostname", task_id=first["task_id"])["status"] == "already queued"
+
+    # The head is handed out again until its result arrives
+    assert client.get("/api/tasks/agent-1").get_json()["task"]["task_id"] == first["task_id"]
+    assert client.get("/api/tasks/agent-1").get_json()["task"]["task_id"] == first["task_id"]
+    client.post("/api/results", json={"agent_id": "agent-1", "task_id": first["task_id"], "result": {}})
+    assert client.get("/api/tasks/agent-1").get_json()["task"]["payload"] == "uptime"
+    client.post("/api/results", json={"agent_id": "agent-1", "task_id": second["task_id"], "result": {}})
+
+    assert client.get("/api/tasks/agent-1").get_json()["task"] is None
+    assert "agent-1" not in server.tasks
+
+
+@pytest.fixture
+def agent(client, tmp_path, monkeypatch):
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{http.server_port}"
+    monkeypatch.setattr(shellahgent, "AGENT_ID", "agent-1")
+    monkeypatch.setattr(shellahgent, "TASKS_API_URL", f"{base_url}/api/tasks/agent-1")
+    monkeypatch.setattr(shellahgent, "RESULTS_API_URL", f"{base_url}/api/results")
+    monkeypatch.setattr(shellahgent, "OUTPUT_API_URL", f"{base_url}/api/results/chunks")
+    monkeypatch.setattr(shellahgent, "completed_tasks", shellahgent.CompletedTasks(str(tmp_path / "done.json")))
+    monkeypatch.setattr(shellahgent, "unsent_results", shellahgent.deque())
+    yield shellahgent
+    http.shutdown()
+
+
+def test_agent_runs_each_task_once_across_restarts(client, agent, tmp_path):
+    marker = tmp_path / "runs"
+    task_id = add(client, f"echo run >> {marker}")["task_id"]
+
+    # The result is lost, so the server keeps handing out the task
+    agent.RESULTS_API_URL, results_url = "http://127.0.0.1:9/api/results", agent.RESULTS_API_URL
+    assert agent.get_and_execute_task()
+    assert not agent.get_and_execute_task()  # result still waiting to be resent, nothing re-run
+
+    # After a restart the unsent result is gone but the completed set survives
+    agent.RESULTS_API_URL = results_url
+    agent.unsent_results.clear()
+    agent.completed_tasks = agent.CompletedTasks(agent.completed_tasks.path)
+    assert agent.get_and_execute_task()
+
+    assert marker.read_text() == "run\n"
+    assert server.results[("agent-1", task_id)]["duplicate"] is True
+    assert not agent.get_and_execute_task()
+
+
+def test_completed_set_is_bounded(tmp_path):
+    completed = shellahgent.CompletedTasks(str(tmp_path / "done.json"), limit=3)
+    for i in range(5):
+        completed.add(f"t{i}")
+
+    reloaded = shellahgent.CompletedTasks(completed.path, limit=3)
+    assert list(reloaded.task_ids) == ["t2", "t3", "t4"]
+    assert "t0" not in reloaded and "t4" in reloaded
+
+
+def test_output_is_uploaded_while_the_command_runs(client, agent, monkeypatch):
+    monkeypatch.setattr(shellahgent, "OUTPUT_FLUSH_INTERVAL", 0.1)
+    task_id = add(client, "echo first; echo oops >&2; sleep 0.6; seq 1 20000")["task_id"]
+    worker = threading.Thread(target=agent.get_and_execute_task)
+    worker.start()
+    time.sleep(0.4)
+    running = client.get(f"/api/results/agent-1/{task_id}/tail").get_json()
+    worker.join(10)
+    done = client.get(f"/api/results/agent-1/{task_id}/tail", query_string={"bytes": 12}).get_json()
+    everything = client.get(f"/api/results/agent-1/{task_id}/tail",
+                            query_string={"after_seq": -1, "stream": "stdout"}).get_json()
+
+    assert sorted(running["output"].splitlines()) == ["first", "oops"] and not running["complete"]
+    assert done["output"] == "19999\n20000\n" and done["complete"]
+    assert everything["output"] == "first\n" + "".join(f"{i}\n" for i in range(1, 20001))
+    result = server.results[("agent-1", task_id)]
+    assert result["success"] and result["error"] == "oops\n" and result["chunks"] > 2
+    assert len(result["output"]) == shellahgent.OUTPUT_TAIL_BYTES
+
+
+def test_chunks_are_ordered_deduplicated_and_bounded(client, monkeypatch):
+    monkeypatch.setattr(server, "MAX_TASK_OUTPUT_BYTES", 10)
+
+    def upload(*chunks):
+        return client.post("/api/results/chunks", json={"agent_id": "agent-1", "task_id": "t1", "chunks": [
+            {"seq": seq, "stream": "stdout", "data": data} for seq, data in chunks]})
+
+    assert upload((1, "bbb"), (0, "aaa")).get_json() == {"status": "received", "accepted": 2, "next_seq": 2}
+    assert upload((1, "bbb"), (2, "ccc")).get_json()["accepted"] == 1
+    assert upload((3, "ddd")).get_json()["next_seq"] == 4  # over 10 bytes: "aaa" is dropped
+    assert upload((0, "aaa")).get_json()["accepted"] == 0
+
+    tail = client.get("/api/results/agent-1/t1/tail").get_json()
+    assert tail["output"] == "bbbcccddd" and tail["dropped_bytes"] == 3 and tail["last_seq"] == 3
+    assert upload((4, "x" * (server.MAX_OUTPUT_CHUNK_BYTES + 1))).status_code == 413
+    assert client.get("/api/results/agent-1/nope/tail").status_code == 404
+
+
+def test_tails_and_chunk_limits_count_utf8_bytes(client):
+    def upload(*chunks):
+        return client.post("/api/results/chunks", json={"agent_id": "agent-1", "task_id": "t1", "chunks": list(chunks)})
+
+    upload({"seq": 0, "stream": "stdout", "data": "héllo"})
+
+    def tail(size):
+        return client.get("/api/results/agent-1/t1/tail", query_string={"bytes": size}).get_json()
+    assert tail(0)["output"] == "" and tail(4)["output"] == "llo" and tail(5)["output"] == "éllo"
+    assert tail(100)["bytes"] == 6
+    assert upload({"seq": 1, "data": "é" * (server.MAX_OUTPUT_CHUNK_BYTES // 2 + 1)}).status_code == 413
+    assert upload("not a chunk").status_code == 400
+
+
+def test_unsent_results_are_retried_in_order(monkeypatch):
+    posted, reachable = [], [False]
+    monkeypatch.setattr(shellahgent, "unsent_results", shellahgent.deque())
+    monkeypatch.setattr(shellahgent, "_post_result",
+                        lambda payload: reachable[0] and not posted.append(payload["task_id"]))
+
+    assert not shellahgent.send_result({"task_id": "a"})
+    assert not shellahgent.send_result({"task_id": "b"})
+    reachable[0] = True
+    assert shellahgent.send_result({"task_id": "c"})
+
+    assert posted == ["a", "b", "c"] and not shellahgent.unsent_results
+
+
+def test_uploaded_chunks_never_split_a_character():
+    pieces = list(shellahgent._split_utf8("aé€😀" * 3, 4))
+    assert "".join(pieces) == "aé€😀" * 3
+    assert all(0 < len(piece.encode()) <= 4 for piece in pieces)
+    assert shellahgent._last_bytes("aé€", 4) == "€" and shellahgent._last_bytes("abc", 0) == ""
+
+
+def test_output_that_is_not_utf8_is_replaced_not_fatal(client, agent):
+    result = agent.run_streaming("printf '\\377\\376'; head -c 300000 /dev/zero | tr '\\0' a; echo", "t-bytes")
+
+    assert result["success"] and result["output"].endswith("a" * 100 + "\n")
+    everything = client.get("/api/results/agent-1/t-bytes/tail", query_string={"after_seq": -1}).get_json()
+    assert everything["output"].startswith("��") and everything["output"].count("a") == 300000
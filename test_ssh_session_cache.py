@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the agent SSH session cache, run against an in-process SSH server
+"""
+
+import socket
+import threading
+import time
+
+import paramiko
+import pytest
+
+import ssh_session_cache
+from local_ssh_server import LocalSSHServer
+from ssh_session_cache import SSHSessionCache
+
+
+@pytest.fixture
+def server():
+    server = LocalSSHServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def cache():
+    cache = SSHSessionCache(connect_timeout=5)
+    yield cache
+    cache.close_all()
+
+
+def test_sessions_are_reused_only_with_the_same_credentials(server, cache):
+    first = cache.exec_command("127.0.0.1", "agent", "echo one", port=server.port, password="secret")
+    second = cache.exec_command("127.0.0.1", "agent", "echo two >&2; exit 4", port=server.port, password="secret")
+
+    assert first == {"stdout": "one\n", "stderr": "", "return_code": 0}
+    assert second == {"stdout": "", "stderr": "two\n", "return_code": 4}
+    assert server.connections == 1 and cache.stats()["hits"] == 1
+    with pytest.raises(paramiko.AuthenticationException):
+        cache.exec_command("127.0.0.1", "agent", "echo three", port=server.port, password="wrong")
+
+
+def test_a_dead_session_is_replaced_before_the_command_is_sent(server, cache, monkeypatch):
+    cache.exec_command("127.0.0.1", "agent", "true", port=server.port, password="secret")
+    cache.get("127.0.0.1", "agent", port=server.port, password="secret").get_transport().close()
+    monkeypatch.setattr(ssh_session_cache, "_is_alive", lambda client: True)  # not noticed yet
+
+    result = cache.exec_command("127.0.0.1", "agent", "echo again", port=server.port, password="secret")
+
+    assert result["stdout"] == "again\n" and server.connections == 2
+
+
+def test_a_command_that_started_is_never_retried(server, cache, tmp_path):
+    log = tmp_path / "log"
+    with pytest.raises(socket.timeout):
+        cache.exec_command("127.0.0.1", "agent", f"echo ran >> {log}; sleep 2", port=server.port,
+                           password="secret", timeout=0.5)
+    time.sleep(0.2)
+
+    assert log.read_text() == "ran\n"
+
+
+def test_prewarm_opens_each_target_once_in_the_background(server, cache):
+    target = {"host": "127.0.0.1", "port": server.port, "username": "agent", "password": "secret"}
+
+    assert cache.prewarm([target, dict(target, username=None)]) == 1
+    deadline = time.monotonic() + 5
+    while cache.stats()["prewarmed"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert cache.prewarm([target]) == 0
+
+    cache.exec_command("127.0.0.1", "agent", "true", port=server.port, password="secret")
+    assert server.connections == 1 and cache.stats()["hits"] == 1
+
+
+def test_a_busy_session_is_never_expired(server):
+    cache = SSHSessionCache(idle_timeout=0.5, connect_timeout=5)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(
+        cache.exec_command("127.0.0.1", "agent", "sleep 1.5; echo done", port=server.port, password="secret")))
+    worker.start()
+    while worker.is_alive():
+        len(cache)  # what the agent's load report does every few seconds
+        time.sleep(0.1)
+
+    assert results == [{"stdout": "done\n", "stderr": "", "return_code": 0}]
+    time.sleep(0.6)
+    assert len(cache) == 0  # idle once the command finished
+    cache.close_all()
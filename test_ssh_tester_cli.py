@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for ssh_tester_cli scan mode, run against in-process SSH servers
+"""
+
+import argparse
+import csv
+import json
+import socket
+
+import paramiko
+import pytest
+
+import ssh_tester_cli
+from local_ssh_server import LocalSSHServer
+
+
+@pytest.fixture
+def servers():
+    started = [LocalSSHServer().start() for _ in range(3)]
+    yield started
+    for server in started:
+        server.stop()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_load_hosts_reads_lists_inventories_and_cidrs(tmp_path):
+    hosts_file = tmp_path / "hosts"
+    hosts_file.write_text("# lab\n10.0.0.5\n10.0.0.6:2222  # jump\n[web]\n"
+                          "web1 ansible_host=10.0.1.10 ansible_port=2200\nweb2.example.com\n10.0.0.5\n")
+
+    hosts = ssh_tester_cli.load_hosts(str(hosts_file), ["192.168.5.0/30", "10.0.0.6/32"], default_port=22)
+
+    assert hosts == [("10.0.0.5", 22), ("10.0.0.6", 2222), ("10.0.1.10", 2200), ("web2.example.com", 22),
+                     ("192.168.5.1", 22), ("192.168.5.2", 22), ("10.0.0.6", 22)]
+
+
+def test_load_hosts_refuses_oversized_scans(monkeypatch):
+    with pytest.raises(ValueError, match="16777214 targets"):
+        ssh_tester_cli.load_hosts(cidrs=["10.0.0.0/8"])
+    monkeypatch.setattr(ssh_tester_cli, "MAX_SCAN_HOSTS", 3)
+    assert len(ssh_tester_cli.load_hosts(cidrs=["10.0.0.0/30", "10.0.1.1/32"])) == 3
+    with pytest.raises(ValueError):
+        ssh_tester_cli.load_hosts(cidrs=["10.0.0.0/30", "10.0.1.0/31"])
+
+
+def test_scan_reports_an_encrypted_key_instead_of_crashing(tmp_path, capsys):
+    key_path = str(tmp_path / "id_rsa")
+    paramiko.RSAKey.generate(1024).write_private_key_file(key_path, password="hunter2")
+    args = argparse.Namespace(hosts_file=None, cidr=["127.0.0.1/32"], port=22, keyfile=key_path)
+
+    assert ssh_tester_cli.run_scan(args, None, None) == 1
+    assert "protected by a passphrase" in capsys.readouterr().out
+
+
+def test_scan_reports_phases_and_failures(servers, tmp_path):
+    hosts = [("127.0.0.1", server.port) for server in servers] + [("127.0.0.1", closed_port())]
+    scanner = ssh_tester_cli.HostScanner("agent", password="secret", commands=["echo hi"], timeout=5)
+    progress = []
+
+    results = scanner.scan(hosts, concurrency=4, progress=lambda done, total, report: progress.append(done))
+
+    assert [r["status"] for r in results] == ["ok", "ok", "ok", "refused"]
+    assert all(r[f"{phase}_ms"] > 0 for r in results[:3] for phase in ssh_tester_cli.PHASES)
+    assert results[0]["output"] == "hi" and sorted(progress) == [1, 2, 3, 4]
+    wrong = ssh_tester_cli.HostScanner("agent", password="nope", timeout=5).test_host("127.0.0.1", servers[0].port)
+    assert wrong["status"] == "auth_failed" and wrong["exec_ms"] is None
+
+    ssh_tester_cli.write_scan_report(results, str(tmp_path / "scan.csv"))
+    ssh_tester_cli.write_scan_report(results, str(tmp_path / "scan.json"))
+    rows = list(csv.DictReader((tmp_path / "scan.csv").open()))
+    assert [row["status"] for row in rows] == ["ok", "ok", "ok", "refused"]
+    assert list(rows[0]) == list(ssh_tester_cli.REPORT_FIELDS)
+    assert json.loads((tmp_path / "scan.json").read_text())[0]["output"] == "hi"
+
+
+def test_scan_through_one_shared_tunnel(servers, tmp_path):
+    jump = LocalSSHServer().start()
+    key_path = servers[0].write_client_key(str(tmp_path / "id_rsa"))
+    for server in servers:
+        server.client_key = servers[0].client_key
+    hosts = [("127.0.0.1", server.port) for server in servers] + [("127.0.0.1", closed_port())]
+    scanner = ssh_tester_cli.HostScanner("agent", pkey=ssh_tester_cli.load_private_key(key_path),
+                                         commands=["hostname"], timeout=5, tunnel_host="127.0.0.1",
+                                         tunnel_user="agent", tunnel_pass="secret", tunnel_port=jump.port)
+    try:
+        results = scanner.scan(hosts, concurrency=4)
+    finally:
+        scanner.close()
+        jump.stop()
+
+    assert [r["status"] for r in results] == ["ok", "ok", "ok", "unreachable"]
+    assert jump.connections == 1
+
+
+def test_benchmark_reports_percentiles_per_phase(servers):
+    scanner = ssh_tester_cli.HostScanner("agent", password="secret", commands=["true"], timeout=5)
+
+    report = scanner.benchmark("127.0.0.1", servers[0].port, iterations=6, warmup=1)
+    refused = scanner.benchmark("127.0.0.1", closed_port(), iterations=2, warmup=0)
+
+    assert (report["path"], report["ok"], report["failures"]) == ("direct", 6, {})
+    assert list(report["phases"]) == list(ssh_tester_cli.PHASES) + ["total"]
+    for stats in report["phases"].values():
+        assert stats["min"] <= stats["p50"] <= stats["p95"] <= stats["p99"] <= stats["max"]
+    assert report["connections_per_second"] > 0
+    assert servers[0].connections == 7  # warmup included
+    assert refused["ok"] == 0 and refused["failures"]["refused"] == 2 and refused["phases"] == {}
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for lease-based task distribution across an agent pool
+"""
+
+import time
+
+from task_pool import TaskPool
+
+
+def test_members_share_and_steal_work():
+    pool = TaskPool("tenant-1", steal_threshold=2)
+    pool.heartbeat("a")
+    pool.heartbeat("b")
+    for i in range(4):
+        pool.submit({"task_id": f"a{i}"}, agent_id="a")
+    pool.submit({"task_id": "shared"})
+
+    assert [t["task_id"] for t in pool.lease("a")] == ["a0"]
+    # b has nothing of its own: shared queue first, then steal from a's backlog
+    assert [t["task_id"] for t in pool.lease("b", max_tasks=2)] == ["shared", "a3"]
+    assert pool.stats()["stolen"] == 1
+
+    assert pool.ack("a0") and not pool.ack("a0")
+
+
+def test_dead_member_work_is_requeued():
+    pool = TaskPool("tenant-1", heartbeat_timeout=0.2)
+    pool.heartbeat("a")
+    pool.submit({"task_id": "queued"}, agent_id="a")
+    pool.submit({"task_id": "running"})
+    pool.lease("a")  # takes "queued", "running" stays shared
+    assert [t["task_id"] for t in pool.lease("a")] == ["running"]
+
+    time.sleep(0.3)
+    leased = pool.lease("b", max_tasks=5)
+    assert sorted(t["task_id"] for t in leased) == ["queued", "running"]
+    assert pool.stats()["members"] == ["b"]
+    assert pool.stats()["requeued"] == 2
+
+
+def test_leases_of_a_heartbeating_member_never_expire():
+    pool = TaskPool("tenant-1", heartbeat_timeout=5, lease_seconds=0.2)
+    pool.submit({"task_id": "long"})
+    pool.lease("a")
+    for _ in range(4):
+        time.sleep(0.1)
+        pool.heartbeat("a")
+
+    assert pool.lease("b") == [] and pool.stats()["requeued"] == 0
+    assert pool.ack("long")
+
+
+def test_a_late_ack_removes_the_requeued_copy():
+    pool = TaskPool("tenant-1", lease_seconds=0.1)
+    pool.submit({"task_id": "slow"})
+    pool.lease("a")
+    time.sleep(0.2)  # "a" stalled without heartbeating
+    pool.reap()
+    assert pool.stats()["shared_queued"] == 1
+
+    assert pool.ack("slow")
+    assert pool.lease("b") == [] and pool.stats()["completed"] == 1
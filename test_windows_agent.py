@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for the windows_agent Linux execution backends, run against an in-process SSH server
+"""
+
+import importlib
+import shutil
+
+import pytest
+
+from local_ssh_server import LocalSSHServer
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # windows_agent logs to agent_log.txt in the working directory
+    windows_agent = importlib.import_module("windows_agent")
+    server = LocalSSHServer().start()
+    key_path = server.write_client_key(str(tmp_path / "id_rsa"))
+    creds = {"username": server.username, "ssh_key_path": key_path, "port": server.port}
+    monkeypatch.setattr(windows_agent, "get_credentials", lambda target_type, target_host: creds)
+    monkeypatch.setattr(windows_agent, "SSH_EXECUTABLE", "ssh")
+    monkeypatch.setattr(windows_agent, "SSH_EXTRA_ARGS", [
+        "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+        "-o", "BatchMode=yes", "-o", "LogLevel=ERROR"])
+    yield windows_agent, server
+    windows_agent.ssh_sessions.close_all()
+    server.stop()
+
+
+def payload(command):
+    return {"target_host": "127.0.0.1", "target_type": "linux", "command": command, "correlation_id": "c-1"}
+
+
+def test_paramiko_backend_reuses_one_connection(agent, monkeypatch):
+    windows_agent, server = agent
+    monkeypatch.setattr(windows_agent, "LINUX_SSH_BACKEND", "paramiko")
+
+    for _ in range(3):
+        result = windows_agent.execute_command_on_private_server(payload("echo out; echo err >&2"))
+        assert result == {"status": "success", "stdout": "out\n", "stderr": "err\n",
+                          "return_code": 0, "correlation_id": "c-1"}
+    assert server.connections == 1
+
+    failed = windows_agent.execute_command_on_private_server(payload("echo partial; exit 3"))
+    assert failed["status"] == "failed"
+    assert failed["return_code"] == 3 and failed["stdout"] == "partial\n"
+
+
+@pytest.mark.skipif(not shutil.which("ssh"), reason="OpenSSH client not installed")
+def test_backends_return_the_same_result(agent, monkeypatch):
+    windows_agent, _ = agent
+    results = {}
+    for backend in ("paramiko", "subprocess"):
+        monkeypatch.setattr(windows_agent, "LINUX_SSH_BACKEND", backend)
+        results[backend] = [windows_agent.execute_command_on_private_server(payload(cmd))
+                            for cmd in ("echo hello", "echo bad >&2; exit 2")]
+    assert results["paramiko"] == results["subprocess"]
+
+
+def test_fan_out_returns_one_document_keyed_by_host(agent, monkeypatch):
+    windows_agent, server = agent
+    monkeypatch.setattr(windows_agent, "LINUX_SSH_BACKEND", "paramiko")
+
+    result = windows_agent.handle_command({
+        "correlation_id": "c-2", "target_type": "linux", "command": "echo fan-out",
+        "target_hosts": ["127.0.0.1", "localhost", "127.0.0.1"]})
+
+    assert result["status"] == "success" and result["correlation_id"] == "c-2"
+    assert set(result["hosts"]) == {"127.0.0.1", "localhost"}
+    for host_result in result["hosts"].values():
+        assert host_result["stdout"] == "fan-out\n"
+        assert host_result["duration_ms"] >= 0
+    assert result["summary"] == {"total": 2, "succeeded": 2, "failed": 0, "concurrency": 2}
+
+
+@pytest.mark.parametrize("requested, expected", [(1, 1), (0, 1), (-3, 1), ("lots", 2), ("1", 1), (None, 2)])
+def test_fan_out_concurrency_is_clamped(agent, monkeypatch, requested, expected):
+    windows_agent, _ = agent
+    monkeypatch.setattr(windows_agent, "LINUX_SSH_BACKEND", "paramiko")
+
+    result = windows_agent.handle_command({
+        "correlation_id": "c-3", "target_type": "linux", "command": "true",
+        "target_hosts": ["127.0.0.1", "localhost"], "max_concurrency": requested})
+
+    assert result["status"] == "success" and result["summary"]["concurrency"] == expected
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tests for ws_cloud_server's run_local commands, disconnect grace timers and
+agent commands (timeouts, several in flight at once, broadcast)
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+import websockets
+
+import ws_cloud_server
+
+
+def test_run_local_drains_lines_longer_than_the_stream_limit(capsys):
+    started = time.monotonic()
+    returncode = asyncio.run(ws_cloud_server.run_local_command(
+        "python3 -c \"print('x' * 200000); print('done')\"", timeout=10))
+
+    printed = capsys.readouterr().out.splitlines()
+    prefix = "[SERVER] Local stdout: "
+    assert returncode == 0 and time.monotonic() - started < 5
+    assert sum(len(line) - len(prefix) for line in printed if line.startswith(prefix + "x")) == 200000
+    assert prefix + "done" in printed
+
+
+def test_only_the_latest_disconnect_expires_in_flight_commands(monkeypatch):
+    monkeypatch.setattr(ws_cloud_server, "RESUME_GRACE", 0.4)
+    monkeypatch.setattr(ws_cloud_server, "connected_agents", {})
+    monkeypatch.setattr(ws_cloud_server, "agent_last_seen", {})
+    monkeypatch.setattr(ws_cloud_server, "agent_generation", {})
+    monkeypatch.setattr(ws_cloud_server, "pending_commands", {})
+
+    async def connect(url):
+        websocket = await websockets.connect(url)
+        await websocket.send("agent-1")
+        while "agent-1" not in ws_cloud_server.connected_agents:
+            await asyncio.sleep(0.01)
+        return websocket
+
+    async def disconnect(websocket):
+        await websocket.close()
+        while "agent-1" in ws_cloud_server.connected_agents:
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        async with websockets.serve(ws_cloud_server.handler, "127.0.0.1", 0) as server:
+            url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+            first = await connect(url)
+            future = await ws_cloud_server.send_command("agent-1", {"cmd": "sleep 60"})
+            await disconnect(first)
+            await asyncio.sleep(0.2)
+            await disconnect(await connect(url))  # back quickly, then gone again
+
+            await asyncio.sleep(0.3)  # the first grace period is over
+            assert not future.done()
+            await asyncio.sleep(0.3)
+            assert isinstance(future.exception(), ConnectionError)
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def fresh_registries(monkeypatch):
+    for name in ("connected_agents", "agent_last_seen", "agent_generation", "pending_commands"):
+        monkeypatch.setattr(ws_cloud_server, name, {})
+
+
+async def fake_agent(url, agent_id):
+    """
+    Connect as `agent_id` and answer each command {"cmd": "echo <text> after <seconds>"}
+    with one output frame and an exit frame once <seconds> have passed; "hang" never answers
+    """
+    websocket = await websockets.connect(url)
+    await websocket.send(agent_id)
+
+    async def answer(command):
+        if command["cmd"] == "hang":
+            return
+        _, text, _, delay = command["cmd"].split()
+        await asyncio.sleep(float(delay))
+        frame = {"correlation_id": command["correlation_id"]}
+        await websocket.send(json.dumps(dict(frame, type="output", seq=0, stream="stdout", data=text)))
+        await websocket.send(json.dumps(dict(frame, type="exit", seq=1, returncode=0)))
+
+    async def serve():
+        answers = set()
+        async for message in websocket:
+            task = asyncio.create_task(answer(json.loads(message)))
+            answers.add(task)
+            task.add_done_callback(answers.discard)
+
+    serving = asyncio.create_task(serve())
+    while agent_id not in ws_cloud_server.connected_agents:
+        await asyncio.sleep(0.01)
+    return websocket, serving
+
+
+def with_agents(*agent_ids):
+    """Run `scenario()` against a live server with fake agents connected as `agent_ids`"""
+    def run(scenario):
+        async def main():
+            async with websockets.serve(ws_cloud_server.handler, "127.0.0.1", 0) as server:
+                url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+                agents = [await fake_agent(url, agent_id) for agent_id in agent_ids]
+                try:
+                    return await scenario()
+                finally:
+                    for websocket, serving in agents:
+                        serving.cancel()
+                        await websocket.close()
+        return asyncio.run(main())
+    return run
+
+
+def test_commands_in_flight_for_one_agent_finish_independently(fresh_registries):
+    async def scenario():
+        streamed = []
+        started = time.monotonic()
+        results = await asyncio.gather(
+            ws_cloud_server.run_command("agent-1", {"cmd": "echo slow after 0.4"}, timeout=5),
+            ws_cloud_server.run_command("agent-1", {"cmd": "echo fast after 0.1"}, timeout=5),
+            ws_cloud_server.run_command("agent-1", {"cmd": "echo live after 0.2"}, timeout=5,
+                                        on_output=lambda stream, data: streamed.append((stream, data))))
+        return results, streamed, time.monotonic() - started
+
+    results, streamed, elapsed = with_agents("agent-1")(scenario)
+
+    assert [result.get("stdout") for result in results] == ["slow", "fast", None]
+    assert all(result["returncode"] == 0 for result in results) and streamed == [("stdout", "live")]
+    assert elapsed < 0.65  # side by side, not one after another
+    assert ws_cloud_server.pending_commands == {}
+
+
+def test_a_timed_out_command_does_not_affect_the_others(fresh_registries):
+    async def scenario():
+        slow = asyncio.create_task(ws_cloud_server.run_command("agent-1", {"cmd": "echo ok after 0.3"}, timeout=5))
+        with pytest.raises(asyncio.TimeoutError):
+            await ws_cloud_server.run_command("agent-1", {"cmd": "echo late after 0.5"}, timeout=0.1)
+        assert len(ws_cloud_server.pending_commands) == 1  # only the one still running
+        result = await slow
+        await asyncio.sleep(0.3)  # the late reply arrives and is dropped
+        return result
+
+    result = with_agents("agent-1")(scenario)
+
+    assert result["stdout"] == "ok" and ws_cloud_server.pending_commands == {}
+
+
+def test_broadcast_reports_missing_and_timed_out_agents(fresh_registries):
+    async def scenario():
+        command = {"cmd": "echo hi after 0.1", "correlation_id": "shared"}
+        first = await ws_cloud_server.broadcast(["agent-1", "agent-2", "agent-3"], command, timeout=1)
+        hung = await ws_cloud_server.broadcast(["agent-1", "agent-2"], {"cmd": "hang"}, timeout=0.2)
+        return first, hung
+
+    first, hung = with_agents("agent-1", "agent-2")(scenario)
+
+    assert first["agent-1"]["stdout"] == first["agent-2"]["stdout"] == "hi"
+    assert first["agent-3"] == {"error": "Agent agent-3 not connected"}
+    assert hung == {"agent-1": {"error": "TimeoutError"}, "agent-2": {"error": "TimeoutError"}}
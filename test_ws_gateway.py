@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for the ws_gateway broker: agent registry and routing of commands to the owning worker
+"""
+
+import asyncio
+
+import pytest
+
+from ws_gateway import BrokerClient, LocalBroker
+
+
+async def start_broker():
+    return await LocalBroker(port=0).start()
+
+
+def worker(broker, worker_id, ran):
+    async def on_command(agent_id, command, timeout):
+        ran.append((worker_id, agent_id))
+        if command.get("fail"):
+            raise ConnectionError(f"Agent {agent_id} not connected")
+        return {"stdout": command["cmd"], "returncode": 0}
+    return BrokerClient(worker_id, port=broker.port, on_command=on_command).connect()
+
+
+def test_command_is_routed_to_the_worker_holding_the_agent():
+    async def scenario():
+        broker = await start_broker()
+        ran = []
+        worker_a, worker_b = await worker(broker, "worker-a", ran), await worker(broker, "worker-b", ran)
+        worker_a.register("agent-1")
+        worker_b.register("agent-2")
+        await asyncio.sleep(0.05)
+
+        result = await worker_a.request("agent-2", {"cmd": "uptime"}, timeout=5)
+        with pytest.raises(ConnectionError, match="agent-3 not connected"):
+            await worker_a.request("agent-3", {"cmd": "uptime"}, timeout=5)
+        with pytest.raises(ConnectionError, match="agent-1 not connected"):
+            await worker_b.request("agent-1", {"cmd": "uptime", "fail": True}, timeout=5)
+
+        assert result == {"stdout": "uptime", "returncode": 0}
+        assert ran == [("worker-b", "agent-2"), ("worker-a", "agent-1")]
+        assert await worker_b.stats() == {"agents": 2, "workers": {"worker-a": 1, "worker-b": 1}}
+        worker_a.close()
+        worker_b.close()
+        await broker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_registry_follows_reconnects_and_dead_workers():
+    async def scenario():
+        broker = await start_broker()
+        ran = []
+        worker_a, worker_b = await worker(broker, "worker-a", ran), await worker(broker, "worker-b", ran)
+        worker_a.register("agent-1")
+        await asyncio.sleep(0.05)
+        worker_b.register("agent-1")  # the agent reconnected through another worker
+        await asyncio.sleep(0.05)
+        worker_a.register("agent-1", connected=False)  # late unregister from the old socket
+        worker_a.register("agent-2")
+        await asyncio.sleep(0.05)
+        assert await worker_b.lookup("agent-1") == "worker-b"
+
+        worker_a.close()
+        await asyncio.sleep(0.05)
+        assert await worker_b.lookup("agent-2") is None
+        worker_b.close()
+        await broker.stop()
+
+    asyncio.run(scenario())
+
+
+def test_large_results_and_bad_lines_do_not_drop_the_worker():
+    async def scenario():
+        broker = await start_broker()
+        ran = []
+        worker_a, worker_b = await worker(broker, "worker-a", ran), await worker(broker, "worker-b", ran)
+        worker_a.register("agent-1")
+        worker_a._writer.write(b"not json\n")
+        worker_a._writer.write(b'{"op": "command"}\n')  # missing fields
+        await asyncio.sleep(0.05)
+
+        result = await worker_b.request("agent-1", {"cmd": "x" * 100_000}, timeout=5)
+
+        assert len(result["stdout"]) == 100_000
+        assert await worker_b.stats() == {"agents": 1, "workers": {"worker-a": 1, "worker-b": 0}}
+        worker_a.close()
+        worker_b.close()
+        await broker.stop()
+
+    asyncio.run(scenario())
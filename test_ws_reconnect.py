@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for ws_agent / ws_cloud_server reconnects: in-flight commands survive a dropped
+connection, commands the agent no longer knows about are failed, and a dead SSH session
+is replaced without running the command twice; slow commands run side by side while
+heartbeats keep flowing
+"""
+
+import asyncio
+import time
+
+import pytest
+import websockets
+
+import ssh_session_cache
+import ws_agent
+import ws_cloud_server
+from local_ssh_server import LocalSSHServer
+
+
+@pytest.fixture
+def ssh_server():
+    server = LocalSSHServer().start()
+    yield server
+    ws_agent.ssh_sessions.close_all()
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def fast_reconnects(monkeypatch):
+    monkeypatch.setattr(ws_agent, "RECONNECT_BASE_DELAY", 0.1)
+    monkeypatch.setattr(ws_agent, "HEARTBEAT_INTERVAL", 0.2)
+    monkeypatch.setattr(ws_agent, "commands", {})
+    monkeypatch.setattr(ws_cloud_server, "connected_agents", {})
+    monkeypatch.setattr(ws_cloud_server, "agent_last_seen", {})
+    monkeypatch.setattr(ws_cloud_server, "pending_commands", {})
+
+
+async def run_with_agent(scenario):
+    async with websockets.serve(ws_cloud_server.handler, "127.0.0.1", 0) as server:
+        ws_agent.WEBSOCKET_SERVER = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        agent = asyncio.create_task(ws_agent.agent())
+        try:
+            await wait_connected()
+            return await scenario()
+        finally:
+            agent.cancel()
+
+
+async def wait_connected():
+    while ws_agent.AGENT_ID not in ws_cloud_server.connected_agents:
+        await asyncio.sleep(0.02)
+    await asyncio.sleep(0.1)  # let the resume handshake finish
+
+
+def command(server, cmd):
+    return {"host": "127.0.0.1", "port": server.port, "username": server.username,
+            "password": server.password, "cmd": cmd}
+
+
+def test_stream_resumes_after_dropped_connection(ssh_server):
+    async def scenario():
+        reply = asyncio.create_task(ws_cloud_server.run_command(
+            ws_agent.AGENT_ID, command(ssh_server, "for i in 1 2 3 4 5 6; do echo line$i; sleep 0.1; done"),
+            timeout=20))
+        await asyncio.sleep(0.25)
+        ws_cloud_server.connected_agents[ws_agent.AGENT_ID].transport.abort()
+        return await reply
+
+    result = asyncio.run(run_with_agent(scenario))
+
+    assert result["returncode"] == 0
+    assert result["stdout"].split() == [f"line{i}" for i in range(1, 7)]
+
+
+def test_unknown_command_fails_on_reconnect(ssh_server):
+    async def scenario():
+        reply = asyncio.create_task(ws_cloud_server.run_command(
+            ws_agent.AGENT_ID, command(ssh_server, "sleep 1"), timeout=20))
+        await asyncio.sleep(0.1)
+        ws_agent.commands.clear()  # as if the agent had restarted
+        ws_cloud_server.connected_agents[ws_agent.AGENT_ID].transport.abort()
+        with pytest.raises(ConnectionError, match="reconnected without command"):
+            await reply
+
+    asyncio.run(run_with_agent(scenario))
+
+
+def test_reconnect_delay_is_jittered_and_capped():
+    delays = [ws_agent.reconnect_delay(attempt) for attempt in range(20) for _ in range(20)]
+    assert all(0 <= delay <= ws_agent.RECONNECT_MAX_DELAY for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_streamed_command_on_a_dead_session_runs_once_on_a_new_one(ssh_server, tmp_path, monkeypatch):
+    sessions = ws_agent.ssh_sessions
+    sessions.get("127.0.0.1", ssh_server.username, port=ssh_server.port, password=ssh_server.password) \
+        .get_transport().close()
+    monkeypatch.setattr(ssh_session_cache, "_is_alive", lambda client: True)  # not noticed yet
+    log = tmp_path / "log"
+    output = []
+
+    returncode = ws_agent._stream_ssh_command_blocking(command(ssh_server, f"echo ran >> {log}; echo done"),
+                                                       output.append)
+
+    assert returncode == 0 and output == [("stdout", b"done\n")]
+    assert log.read_text() == "ran\n" and ssh_server.connections == 2
+
+
+def test_slow_commands_overlap_while_heartbeats_get_through(ssh_server, monkeypatch):
+    monkeypatch.setattr(ws_agent, "HEARTBEAT_TIMEOUT", 0.6)  # a stalled loop would miss its acks and reconnect
+
+    async def scenario():
+        generation = ws_cloud_server.agent_generation[ws_agent.AGENT_ID]
+        seen = [ws_cloud_server.agent_last_seen[ws_agent.AGENT_ID]]
+
+        async def watch_heartbeats():
+            while True:
+                await asyncio.sleep(0.05)
+                last_seen = ws_cloud_server.agent_last_seen.get(ws_agent.AGENT_ID)
+                if last_seen != seen[-1]:
+                    seen.append(last_seen)
+
+        watcher = asyncio.create_task(watch_heartbeats())
+        started = time.monotonic()
+        streamed, buffered = await asyncio.gather(
+            ws_cloud_server.run_command(ws_agent.AGENT_ID, command(ssh_server, "sleep 1; echo one"), timeout=10),
+            ws_cloud_server.run_command(ws_agent.AGENT_ID, dict(command(ssh_server, "sleep 1; echo two"),
+                                                                 stream=False), timeout=10))
+        elapsed = time.monotonic() - started
+        watcher.cancel()
+        return streamed, buffered, elapsed, len(seen), ws_cloud_server.agent_generation[ws_agent.AGENT_ID] - generation
+
+    streamed, buffered, elapsed, heartbeats_seen, reconnects = asyncio.run(run_with_agent(scenario))
+
+    assert streamed["stdout"] == "one\n" and buffered["stdout"] == "two\n"
+    assert elapsed < 1.8  # side by side, not one after the other
+    assert heartbeats_seen >= 3 and reconnects == 0
@@ -7,13 +7,27 @@ import sys
 import requests # pip install requests
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ssh_session_cache import SSHSessionCache
 
 # --- Agent Configuration ---
 # Cloud server API endpoint for receiving commands
 CLOUD_SERVER_API_URL = "http://your.cloud.server.ip.or.hostname:5000/api/commands" # Replace with your cloud server's actual URL
 AGENT_ID = "onprem-windows-bridge-001" # Unique ID for this agent
-POLLING_INTERVAL_SECONDS = 5 # How often the agent checks for new commands
+POOL_ID = os.environ.get("AGENT_POOL_ID") # Optional: share a command pool with other agents of the same customer
+POLLING_INTERVAL_SECONDS = 5 # Pause before polling again after an error
+LONG_POLL_SECONDS = 25 # The server holds an empty poll open this long, so new commands arrive at once
+MAX_COMMANDS_PER_POLL = 20 # Commands fetched per round trip when work is queued up
 LOG_FILE = "agent_log.txt"
+# Backend for "linux" targets: "paramiko" runs SSH in-process over cached per-host sessions,
+# "subprocess" starts ssh.exe for every command
+LINUX_SSH_BACKEND = os.environ.get("AGENT_SSH_BACKEND", "paramiko")
+SSH_EXECUTABLE = "ssh.exe" # Use "ssh" when running the subprocess backend on Linux
+SSH_EXTRA_ARGS = [] # e.g. ["-o", "BatchMode=yes"]
+SSH_SESSION_IDLE_TIMEOUT = 300 # Seconds a cached session may stay unused before it is closed
+FANOUT_MAX_CONCURRENCY = 16 # Upper bound on hosts a multi-target command runs on at the same time
+HOST_GROUPS_FILE = "host_groups.json" # {"group-name": {"target_type": "linux", "hosts": ["10.0.0.5", ...]}}
 
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -36,6 +50,38 @@ def get_credentials(target_type, target_host):
         }
     return None
 
+ssh_sessions = SSHSessionCache(idle_timeout=SSH_SESSION_IDLE_TIMEOUT)
+
+# --- Linux execution backends; both return (stdout, stderr, return_code) ---
+def run_linux_command_subprocess(target_host, creds, command_to_execute):
+    # Using ssh.exe which should be available on Windows (e.g., via WSL or built-in OpenSSH)
+    # You might need to adjust the path or use 'plink.exe' if PuTTY is preferred.
+    ssh_cmd = [SSH_EXECUTABLE, "-i", creds["ssh_key_path"]] + SSH_EXTRA_ARGS
+    if creds.get("port", 22) != 22:
+        ssh_cmd += ["-p", str(creds["port"])]
+    ssh_cmd += [f"{creds['username']}@{target_host}", command_to_execute]
+    process = subprocess.run(ssh_cmd, capture_output=True, text=True, check=True)
+    return process.stdout, process.stderr, process.returncode
+
+def run_linux_command_paramiko(target_host, creds, command_to_execute):
+    # Reuses an authenticated session per host, so only the first command pays for the handshake
+    output = ssh_sessions.exec_command(
+        target_host, creds["username"], command_to_execute,
+        port=creds.get("port", 22),
+        password=creds.get("password"),
+        key_filename=creds.get("ssh_key_path")
+    )
+    if output["return_code"] != 0:
+        # Same contract as the ssh.exe path, which runs with check=True
+        raise subprocess.CalledProcessError(output["return_code"], command_to_execute,
+                                            output=output["stdout"], stderr=output["stderr"])
+    return output["stdout"], output["stderr"], output["return_code"]
+
+LINUX_BACKENDS = {
+    "paramiko": run_linux_command_paramiko,
+    "subprocess": run_linux_command_subprocess,
+}
+
 # --- Function to execute commands ---
 def execute_command_on_private_server(command_payload):
     target_host = command_payload.get("target_host")
@@ -56,13 +102,9 @@ def execute_command_on_private_server(command_payload):
 
     try:
         if target_type == "linux":
-            # Using ssh.exe which should be available on Windows (e.g., via WSL or built-in OpenSSH)
-            # You might need to adjust the path or use 'plink.exe' if PuTTY is preferred.
-            ssh_cmd = ["ssh.exe", "-i", creds["ssh_key_path"], f"{creds['username']}@{target_host}", command_to_execute]
-            process = subprocess.run(ssh_cmd, capture_output=True, text=True, check=True)
-            result["stdout"] = process.stdout
-            result["stderr"] = process.stderr
-            result["return_code"] = process.returncode
+            run_linux_command = LINUX_BACKENDS[LINUX_SSH_BACKEND]
+            result["stdout"], result["stderr"], result["return_code"] = run_linux_command(
+                target_host, creds, command_to_execute)
         elif target_type == "windows":
             # Using PowerShell to execute via WinRM
             # This assumes WinRM is configured on the target Windows server.
@@ -101,25 +143,102 @@ def execute_command_on_private_server(command_payload):
         result["message"] = str(e)
     return result
 
+# --- Multi-target commands ---
+def load_host_groups():
+    if not os.path.exists(HOST_GROUPS_FILE):
+        return {}
+    with open(HOST_GROUPS_FILE) as f:
+        return json.load(f)
+
+def resolve_targets(command_payload):
+    """Return (hosts, target_type) for a payload naming target_hosts or a host_group, else None"""
+    if command_payload.get("target_hosts"):
+        return list(command_payload["target_hosts"]), command_payload.get("target_type")
+    group_name = command_payload.get("host_group")
+    if group_name:
+        group = load_host_groups().get(group_name)
+        if group is None:
+            raise ValueError(f"Unknown host group: {group_name}")
+        return list(group["hosts"]), command_payload.get("target_type") or group.get("target_type")
+    return None
+
+def execute_command_on_many_servers(command_payload, hosts, target_type):
+    """Run one command on many hosts concurrently; returns one result document keyed by host"""
+    correlation_id = command_payload.get("correlation_id", "N/A")
+    hosts = list(dict.fromkeys(hosts)) # drop duplicates, keep order
+    requested = command_payload.get("max_concurrency")
+    try:
+        requested = FANOUT_MAX_CONCURRENCY if requested is None else int(requested)
+    except (TypeError, ValueError):
+        logging.warning(f"[{correlation_id}] Ignoring invalid max_concurrency "
+                        f"{command_payload.get('max_concurrency')!r}")
+        requested = FANOUT_MAX_CONCURRENCY
+    concurrency = max(min(requested, FANOUT_MAX_CONCURRENCY, len(hosts)), 1)
+    started = time.time()
+
+    def run_on_host(host):
+        host_started = time.time()
+        host_result = execute_command_on_private_server(dict(
+            command_payload, target_host=host, target_type=target_type, correlation_id=correlation_id))
+        host_result.pop("correlation_id", None)
+        host_result["started_at"] = datetime.fromtimestamp(host_started).isoformat()
+        host_result["duration_ms"] = round((time.time() - host_started) * 1000, 1)
+        return host, host_result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        host_results = dict(pool.map(run_on_host, hosts))
+
+    succeeded = sum(1 for r in host_results.values() if r["status"] == "success")
+    logging.info(f"[{correlation_id}] Command finished on {succeeded}/{len(host_results)} hosts "
+                 f"(concurrency {concurrency})")
+    return {
+        "status": "success" if succeeded == len(host_results) else ("partial" if succeeded else "failed"),
+        "correlation_id": correlation_id,
+        "hosts": host_results,
+        "summary": {"total": len(host_results), "succeeded": succeeded,
+                    "failed": len(host_results) - succeeded, "concurrency": concurrency},
+        "duration_ms": round((time.time() - started) * 1000, 1)
+    }
+
+def handle_command(command_payload):
+    """Dispatch a command payload to one host or fan it out to a host list / group"""
+    correlation_id = command_payload.get("correlation_id", "N/A")
+    try:
+        targets = resolve_targets(command_payload)
+    except (ValueError, KeyError, OSError) as e:
+        logging.error(f"[{correlation_id}] Cannot resolve targets: {e}")
+        return {"status": "error", "message": str(e), "correlation_id": correlation_id}
+    if targets is None:
+        return execute_command_on_private_server(command_payload)
+    hosts, target_type = targets
+    if not hosts or not target_type or not command_payload.get("command"):
+        logging.error(f"[{correlation_id}] Invalid command payload: {command_payload}")
+        return {"status": "error", "message": "Invalid command payload", "correlation_id": correlation_id}
+    return execute_command_on_many_servers(command_payload, hosts, target_type)
+
 # --- Agent's main loop to poll for commands ---
 def start_agent():
     logging.info(f"Windows Agent '{AGENT_ID}' started. Polling for commands from {CLOUD_SERVER_API_URL}")
     while True:
         try:
             # Poll the cloud server for new commands
-            response = requests.get(CLOUD_SERVER_API_URL, params={"agent_id": AGENT_ID}, timeout=10)
+            params = {"agent_id": AGENT_ID, "wait": LONG_POLL_SECONDS, "max_commands": MAX_COMMANDS_PER_POLL}
+            if POOL_ID:
+                params["pool_id"] = POOL_ID
+            response = requests.get(CLOUD_SERVER_API_URL, params=params, timeout=LONG_POLL_SECONDS + 10)
             response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
 
             commands = response.json()
             if commands and isinstance(commands, list):
                 for command_payload in commands:
                     logging.info(f"Received command: {command_payload.get('correlation_id', 'N/A')}")
-                    execution_result = execute_command_on_private_server(command_payload)
+                    execution_result = handle_command(command_payload)
 
                     # Send results back to the cloud server (could be a different API endpoint)
                     requests.post(f"{CLOUD_SERVER_API_URL}/results", json=execution_result)
             else:
                 logging.debug("No commands received.")
+            continue # Poll again at once: the server already waited for work
 
         except requests.exceptions.Timeout:
             logging.warning("Cloud server API request timed out.")
@@ -1,56 +1,268 @@
 import asyncio
+import codecs
+import random
+import select
+import threading
 import websockets
-import paramiko
 import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ssh_session_cache import SSHSessionCache
 
 AGENT_ID = "agent-001"
 WEBSOCKET_SERVER = "ws://13.58.212.239:8765"
+MAX_CONCURRENT_COMMANDS = 32  # commands running at once per websocket
+STREAM_CHUNK_SIZE = 32 * 1024  # max bytes read from the SSH channel per output frame
+STREAM_QUEUE_SIZE = 16  # frames buffered per command before the SSH reader waits for the websocket
+HEARTBEAT_INTERVAL = 15  # seconds between heartbeats to the cloud server
+HEARTBEAT_TIMEOUT = 45  # nothing from the server for this long means the connection is dead
+RECONNECT_BASE_DELAY = 1  # first reconnect waits up to this many seconds, doubling per failed attempt
+RECONNECT_MAX_DELAY = 60
+RESUME_TIMEOUT = 120  # how long in-flight commands wait for a reconnect before giving up
+RESUME_BUFFER_FRAMES = 64  # frames kept per command to re-send after a reconnect
 
-async def run_ssh_command(host, username, password, cmd):
-    try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(hostname=host, username=username, password=password, timeout=10)
-
-        stdin, stdout, stderr = client.exec_command(cmd)
-        out = stdout.read().decode()
-        err = stderr.read().decode()
-        returncode = stdout.channel.recv_exit_status()
+# paramiko is blocking: SSH work runs on these threads so the event loop (and websocket pings) never stall
+ssh_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_COMMANDS, thread_name_prefix="ssh")
+ssh_sessions = SSHSessionCache()
+# correlation_id -> {"sent": deque of recent frames, "finished_at"}; kept RESUME_TIMEOUT after
+# the command ends so a reply lost in a disconnect can still be re-sent
+commands = {}
 
-        client.close()
-        return {"stdout": out, "stderr": err, "returncode": returncode}
+def _run_ssh_command_blocking(host, username, password, cmd, port=22):
+    try:
+        output = ssh_sessions.exec_command(host, username, cmd, port=port, password=password)
+        return {"stdout": output["stdout"], "stderr": output["stderr"], "returncode": output["return_code"]}
     except Exception as e:
         return {"stdout": "", "stderr": str(e), "returncode": -1}
 
+async def run_ssh_command(host, username, password, cmd, port=22):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ssh_executor, _run_ssh_command_blocking, host, username, password, cmd, port)
+
+def _stream_ssh_command_blocking(data, emit):
+    """Run a command, passing output to emit((stream, bytes)) as it arrives; returns the exit status"""
+    with ssh_sessions.channel(data["host"], data["username"], port=data.get("port", 22),
+                              password=data["password"]) as channel:
+        channel.exec_command(data["cmd"])
+        while True:
+            if channel.recv_ready():
+                emit(("stdout", channel.recv(STREAM_CHUNK_SIZE)))
+            elif channel.recv_stderr_ready():
+                emit(("stderr", channel.recv_stderr(STREAM_CHUNK_SIZE)))
+            elif channel.exit_status_ready():
+                return channel.recv_exit_status()
+            else:
+                select.select([channel], [], [], 0.05)
+
+async def stream_command(link, data):
+    """
+    Stream a command's output as sequenced frames while it runs:
+      {"type": "output", "correlation_id", "seq", "stream": "stdout"|"stderr", "data"}
+      {"type": "exit", "correlation_id", "seq", "returncode", "error"}  (always the last frame)
+    At most STREAM_QUEUE_SIZE chunks are held in memory per command.
+    """
+    loop = asyncio.get_running_loop()
+    frames = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+    aborted = threading.Event()
+
+    def emit(item):
+        if aborted.is_set():
+            raise ConnectionError("output stream aborted")
+        asyncio.run_coroutine_threadsafe(frames.put(item), loop).result()
+
+    def produce():
+        try:
+            item = ("exit", _stream_ssh_command_blocking(data, emit), None)
+        except Exception as e:
+            item = ("exit", -1, str(e))
+        try:
+            emit(item)
+        except ConnectionError:
+            pass
+
+    correlation_id = data.get("correlation_id")
+    decoders = {name: codecs.getincrementaldecoder("utf-8")(errors="replace") for name in ("stdout", "stderr")}
+    seq = 0
+    loop.run_in_executor(ssh_executor, produce)
+    try:
+        while True:
+            item = await frames.get()
+            if item[0] == "exit":
+                for name, decoder in decoders.items():
+                    tail = decoder.decode(b"", final=True)
+                    if tail:
+                        await link.send({"type": "output", "correlation_id": correlation_id,
+                                         "seq": seq, "stream": name, "data": tail})
+                        seq += 1
+                await link.send({"type": "exit", "correlation_id": correlation_id, "seq": seq,
+                                 "returncode": item[1], "error": item[2]})
+                return item[1]
+            text = decoders[item[0]].decode(item[1])
+            if text:
+                await link.send({"type": "output", "correlation_id": correlation_id,
+                                 "seq": seq, "stream": item[0], "data": text})
+                seq += 1
+    finally:
+        # Unblock the reader thread if the cloud server stayed unreachable
+        aborted.set()
+        while not frames.empty():
+            frames.get_nowait()
+
+class AgentLink:
+    """
+    The agent's current websocket, shared by running commands across reconnects
+
+    Frames sent while disconnected wait for the next connection (up to RESUME_TIMEOUT)
+    instead of failing, so commands keep running through a reconnect. The link only
+    reopens once the server has told us which frames it already has.
+    """
+
+    def __init__(self):
+        self.ws = None
+        self.ready = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+    async def send_raw(self, ws, frame):
+        async with self.lock:
+            await ws.send(json.dumps(frame))
+
+    async def send(self, frame):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RESUME_TIMEOUT
+        while True:
+            try:
+                await asyncio.wait_for(self.ready.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                raise ConnectionError(f"no connection to the cloud server for {RESUME_TIMEOUT}s") from None
+            ws = self.ws
+            if ws is None:
+                continue
+            try:
+                await self.send_raw(ws, frame)
+            except websockets.exceptions.ConnectionClosed:
+                self.detach(ws)
+                continue
+            command = commands.get(frame.get("correlation_id"))
+            if command is not None:
+                command["sent"].append(frame)
+            return
+
+    async def resume(self, ws, next_seq):
+        """Re-send frames the server did not get before the disconnect, then reopen the link"""
+        for correlation_id, expected in next_seq.items():
+            command = commands.get(correlation_id)
+            if command is None:
+                continue
+            if command["sent"] and command["sent"][0].get("seq", 0) > expected:
+                print(f"[AGENT] Frames {expected}..{command['sent'][0]['seq'] - 1} of {correlation_id} "
+                      f"are no longer buffered")
+            for frame in command["sent"]:
+                if frame.get("seq", 0) >= expected:
+                    await self.send_raw(ws, frame)
+        self.ws = ws
+        self.ready.set()
+
+    def detach(self, ws):
+        if self.ws is ws:
+            self.ws = None
+            self.ready.clear()
+
+async def handle_command(link, slots, data):
+    """Run one command and send its result tagged with the request's correlation ID"""
+    correlation_id = data.get("correlation_id")
+    try:
+        if data.get("stream"):
+            async with slots:
+                print(f"[AGENT] Streaming command {correlation_id} on {data['host']}")
+                returncode = await stream_command(link, data)
+            print(f"[AGENT] Finished stream for {correlation_id}: returncode={returncode}")
+            return
+        async with slots:
+            print(f"[AGENT] Running command {correlation_id} on {data['host']}")
+            result = await run_ssh_command(
+                data["host"],
+                data["username"],
+                data["password"],
+                data["cmd"],
+                data.get("port", 22)
+            )
+        await link.send({
+            "agent_id": AGENT_ID,
+            "correlation_id": correlation_id,
+            "result": result
+        })
+        print(f"[AGENT] Sent result for {correlation_id}: returncode={result['returncode']}")
+    except ConnectionError as e:
+        print(f"[AGENT] Dropping result for {correlation_id}: {e}")
+    finally:
+        if correlation_id in commands:
+            commands[correlation_id]["finished_at"] = time.monotonic()
+
+def forget_finished_commands():
+    now = time.monotonic()
+    for correlation_id, command in list(commands.items()):
+        if command["finished_at"] is not None and now - command["finished_at"] > RESUME_TIMEOUT:
+            del commands[correlation_id]
+
+def reconnect_delay(attempt):
+    """Exponential backoff with full jitter, so a fleet does not reconnect in lockstep after a server restart"""
+    return random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+
+async def send_heartbeats(link, ws):
+    # Random first delay spreads the fleet's heartbeats over the interval
+    await asyncio.sleep(random.uniform(0, HEARTBEAT_INTERVAL))
+    while True:
+        forget_finished_commands()
+        await link.send_raw(ws, {"type": "heartbeat", "agent_id": AGENT_ID,
+                                 "in_flight": [cid for cid, c in commands.items() if c["finished_at"] is None]})
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
 async def agent():
+    link = AgentLink()
+    slots = asyncio.Semaphore(MAX_CONCURRENT_COMMANDS)
+    running = set()
+    attempt = 0
     while True:
         try:
-            async with websockets.connect(WEBSOCKET_SERVER) as ws:
+            # permessage-deflate keeps large text output small on the wire
+            async with websockets.connect(WEBSOCKET_SERVER, compression="deflate") as ws:
                 await ws.send(AGENT_ID)  # Initial registration
+                # Tell the server which commands we still have, so it resumes those and fails the rest
+                await ws.send(json.dumps({"type": "resume", "agent_id": AGENT_ID, "in_flight": list(commands)}))
                 print(f"[AGENT] Connected to cloud as {AGENT_ID}")
 
-                async for message in ws:
-                    data = json.loads(message)
-
-                    # Expecting a command dict
-                    if all(k in data for k in ("host", "username", "password", "cmd")):
-                        print("[AGENT] Received command:", data)
-
-                        result = await run_ssh_command(
-                            data["host"],
-                            data["username"],
-                            data["password"],
-                            data["cmd"]
-                        )
-
-                        await ws.send(json.dumps({
-                            "agent_id": AGENT_ID,
-                            "result": result
-                        }))
-                        print("[AGENT] Sent result:", result)
+                heartbeat = asyncio.create_task(send_heartbeats(link, ws))
+                try:
+                    while True:
+                        # Heartbeats are acknowledged, so silence this long means a dead connection
+                        message = await asyncio.wait_for(ws.recv(), HEARTBEAT_TIMEOUT)
+                        data = json.loads(message)
+
+                        if data.get("type") == "resume_ack":
+                            await link.resume(ws, data.get("next_seq", {}))
+                            attempt = 0
+                        # Expecting a command dict
+                        elif all(k in data for k in ("host", "username", "password", "cmd")):
+                            print("[AGENT] Received command:", {k: v for k, v in data.items() if k != "password"})
+                            correlation_id = data.get("correlation_id")
+                            if correlation_id is not None:
+                                if correlation_id in commands:
+                                    continue  # already running or answered
+                                commands[correlation_id] = {"sent": deque(maxlen=RESUME_BUFFER_FRAMES),
+                                                            "finished_at": None}
+                            # Each command runs as its own task so the next message is read right away
+                            task = asyncio.create_task(handle_command(link, slots, data))
+                            running.add(task)
+                            task.add_done_callback(running.discard)
+                finally:
+                    heartbeat.cancel()
+                    link.detach(ws)
         except Exception as e:
-            print(f"[AGENT] Error or disconnected: {e}. Retrying in 5 seconds...")
-            await asyncio.sleep(5)
+            delay = reconnect_delay(attempt)
+            attempt += 1
+            print(f"[AGENT] Error or disconnected: {e!r}. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
 
 if __name__ == "__main__":
     asyncio.run(agent())
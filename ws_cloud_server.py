@@ -2,60 +2,328 @@
 import asyncio
 import websockets
 import json
+import os
+import signal
+import time
+import uuid
 
 connected_agents = {}
+agent_last_seen = {}  # agent_id -> time.monotonic() of its last message
+agent_generation = {}  # agent_id -> connection count, so a grace timer only expires the connection it was set for
+pending_commands = {}  # correlation_id -> {"agent_id", "future", "on_output", "stdout", "stderr", "next_seq"}
+COMMAND_TIMEOUT = 60  # default seconds to wait for an agent's reply
+LOCAL_COMMAND_CONCURRENCY = 2  # run_local commands (e.g. deploy.sh) running at the same time
+LOCAL_COMMAND_TIMEOUT = 1800  # seconds before a run_local command is killed
+LOCAL_OUTPUT_CHUNK = 64 * 1024  # run_local output is read in chunks of this size; longer lines are printed in pieces
+local_command_slots = asyncio.Semaphore(LOCAL_COMMAND_CONCURRENCY)
+local_commands = set()  # running run_local tasks
+HEARTBEAT_INTERVAL = 15  # seconds between eviction sweeps (agents send heartbeats at the same rate)
+HEARTBEAT_TIMEOUT = 45  # agents silent for this long are evicted
+RESUME_GRACE = 60  # seconds a disconnected agent has to reconnect before its in-flight commands fail
+# fn(agent_id, connected) called when an agent registers or leaves this process; the
+# multi-worker gateway (ws_gateway.py) uses it to keep the shared agent registry current
+presence_hooks = []
 
 async def handler(websocket):
+    agent_id = None
     try:
         agent_id = await websocket.recv()
         print(f"[SERVER] Agent connected: {agent_id}")
+        stale = connected_agents.get(agent_id)
+        if stale is not None and stale is not websocket:
+            # The agent reconnected before its old socket was noticed as dead
+            asyncio.create_task(stale.close(1001, "replaced by a new connection"))
         connected_agents[agent_id] = websocket
+        agent_last_seen[agent_id] = time.monotonic()
+        agent_generation[agent_id] = agent_generation.get(agent_id, 0) + 1
+        notify_presence(agent_id, True)
 
         async for message in websocket:
-            print(f"[SERVER] Message from {agent_id}: {message}")
             try:
+                if connected_agents.get(agent_id) is websocket:
+                    agent_last_seen[agent_id] = time.monotonic()
                 data = json.loads(message)
-                # If the message contains a 'run_local' command, execute it on the cloud server
+                if data.get("type") == "heartbeat":
+                    await websocket.send(json.dumps({"type": "heartbeat_ack"}))
+                    continue
+                if data.get("type") == "resume":
+                    next_seq = resume_pending(agent_id, data.get("in_flight", []))
+                    await websocket.send(json.dumps({"type": "resume_ack", "next_seq": next_seq}))
+                    continue
+                if data.get("type") != "output":
+                    print(f"[SERVER] Message from {agent_id}: {message}")
+                # Replies carry the correlation_id of the command they answer
+                pending = pending_commands.get(data.get("correlation_id"))
+                if pending and not pending["future"].done():
+                    handle_reply(pending, data)
+                    continue
+                # If the message contains a 'run_local' command, execute it on the cloud server.
+                # It runs as a background task so this agent's messages keep flowing meanwhile.
                 if data.get("run_local"):
-                    import subprocess
-                    cmd = data["run_local"]
-                    print(f"[SERVER] Running local command: {cmd}")
-                    # If the command is 'deploy.sh', run it from the current directory
-                    if cmd == "deploy.sh":
-                        proc = subprocess.run(["bash", "deploy.sh"], shell=False, capture_output=True, text=True)
-                    else:
-                        proc = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-                    print(f"[SERVER] Local stdout: {proc.stdout}")
-                    print(f"[SERVER] Local stderr: {proc.stderr}")
+                    task = asyncio.create_task(run_local_command(data["run_local"], agent_id, websocket))
+                    local_commands.add(task)
+                    task.add_done_callback(local_commands.discard)
             except Exception as e:
                 print(f"[SERVER] Error handling message: {e}")
     except websockets.exceptions.ConnectionClosed:
-        print(f"[SERVER] Agent disconnected: {agent_id}")
-        connected_agents.pop(agent_id, None)
+        pass
+    finally:
+        if agent_id is not None:
+            print(f"[SERVER] Agent disconnected: {agent_id}")
+            if connected_agents.get(agent_id) is websocket:
+                connected_agents.pop(agent_id, None)
+                agent_last_seen.pop(agent_id, None)
+                notify_presence(agent_id, False)
+                # In-flight commands survive a quick reconnect: the agent resumes them
+                schedule_expiry(agent_id)
 
-async def send_command(agent_id, command_dict):
+def notify_presence(agent_id, connected):
+    for hook in presence_hooks:
+        try:
+            hook(agent_id, connected)
+        except Exception as e:
+            print(f"[SERVER] Presence hook failed for {agent_id}: {e}")
+
+def handle_reply(pending, data):
+    """
+    Apply one reply frame to its pending command
+
+    Streamed commands send sequenced "output" frames and end with an "exit" frame;
+    agents that do not stream answer with a single {"result": ...} message.
+    """
+    frame_type = data.get("type")
+    if frame_type == "output":
+        if data.get("seq", 0) < pending["next_seq"]:
+            return  # already received; the agent re-sends unconfirmed frames after a reconnect
+        if data.get("seq") != pending["next_seq"]:
+            print(f"[SERVER] Output frame {data.get('seq')} out of order for {data['correlation_id']} "
+                  f"(expected {pending['next_seq']})")
+        pending["next_seq"] = data.get("seq", pending["next_seq"]) + 1
+        if pending["on_output"]:
+            pending["on_output"](data["stream"], data["data"])
+        else:
+            pending[data["stream"]].append(data["data"])
+    elif frame_type == "exit":
+        result = {"returncode": data.get("returncode"), "frames": pending["next_seq"]}
+        if data.get("error"):
+            result["error"] = data["error"]
+        if not pending["on_output"]:
+            result["stdout"] = "".join(pending["stdout"])
+            result["stderr"] = "".join(pending["stderr"] + ([data["error"]] if data.get("error") else []))
+        pending["future"].set_result(result)
+    else:
+        pending["future"].set_result(data.get("result", data))
+
+async def run_local_command(cmd, agent_id=None, websocket=None, timeout=LOCAL_COMMAND_TIMEOUT):
+    """
+    Run a command on the cloud server as an asyncio subprocess
+
+    Output is printed line by line while it runs. At most LOCAL_COMMAND_CONCURRENCY
+    commands run at once; a command running longer than `timeout` is killed with its
+    whole process group. The requesting agent gets a run_local_result message at the end.
+    """
+    async with local_command_slots:
+        print(f"[SERVER] Running local command: {cmd}")
+        # If the command is 'deploy.sh', run it from the current directory
+        if cmd == "deploy.sh":
+            proc = await asyncio.create_subprocess_exec(
+                "bash", "deploy.sh", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                start_new_session=True)
+        else:
+            proc = await asyncio.create_subprocess_shell(
+                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True)
+
+        async def pump(stream, name):
+            # Fixed-size reads: a line iterator raises on lines over its 64 KiB limit and
+            # stops draining the pipe, which blocks the child until it is killed
+            partial = b""
+            while chunk := await stream.read(LOCAL_OUTPUT_CHUNK):
+                *lines, partial = (partial + chunk).split(b"\n")
+                if len(partial) >= LOCAL_OUTPUT_CHUNK:
+                    lines.append(partial)
+                    partial = b""
+                for line in lines:
+                    print(f"[SERVER] Local {name}: {line.decode(errors='replace').rstrip()}")
+            if partial:
+                print(f"[SERVER] Local {name}: {partial.decode(errors='replace').rstrip()}")
+
+        pumps = [asyncio.create_task(pump(proc.stdout, "stdout")), asyncio.create_task(pump(proc.stderr, "stderr"))]
+        timed_out = False
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            print(f"[SERVER] Local command timed out after {timeout}s, killing it: {cmd}")
+        finally:
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+            # Killing the process group closes the pipes, so the pumps drain and finish
+            await asyncio.gather(*pumps, return_exceptions=True)
+        print(f"[SERVER] Local command finished with return code {proc.returncode}: {cmd}")
+
+    if websocket is not None:
+        try:
+            await websocket.send(json.dumps({"type": "run_local_result", "run_local": cmd,
+                                             "returncode": proc.returncode, "timed_out": timed_out}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    return proc.returncode
+
+def resume_pending(agent_id, in_flight):
+    """
+    Reconcile a reconnected agent's in-flight commands with ours
+
+    Commands the agent no longer knows about (e.g. it restarted) are failed; the others
+    keep waiting.
+
+    Returns:
+        {correlation_id: next expected output seq} so the agent can re-send lost frames
+    """
+    in_flight = set(in_flight)
+    next_seq = {}
+    for correlation_id, pending in list(pending_commands.items()):
+        if pending["agent_id"] != agent_id or pending["future"].done():
+            continue
+        if correlation_id in in_flight:
+            next_seq[correlation_id] = pending["next_seq"]
+        else:
+            pending["future"].set_exception(
+                ConnectionError(f"Agent {agent_id} reconnected without command {correlation_id}"))
+    print(f"[SERVER] Agent {agent_id} resumed {len(next_seq)} in-flight command(s)")
+    return next_seq
+
+def schedule_expiry(agent_id):
+    """Give the agent's current connection RESUME_GRACE seconds to come back"""
+    asyncio.get_running_loop().call_later(RESUME_GRACE, expire_disconnected, agent_id,
+                                          agent_generation.get(agent_id))
+
+def expire_disconnected(agent_id, generation):
+    """
+    Fail an agent's in-flight commands if it has not come back within RESUME_GRACE
+
+    A timer set for an earlier connection is ignored: after a quick reconnect and a new
+    disconnect, only the latest timer may expire the agent.
+    """
+    if agent_id not in connected_agents and agent_generation.get(agent_id) == generation:
+        agent_generation.pop(agent_id, None)
+        fail_pending(agent_id, ConnectionError(f"Agent {agent_id} disconnected"))
+
+def start_eviction():
+    """Run evict_silent_agents as a task the caller keeps and cancels on shutdown"""
+    task = asyncio.create_task(evict_silent_agents())
+    task.add_done_callback(_report_eviction_exit)
+    return task
+
+def _report_eviction_exit(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[SERVER] Silent-agent eviction stopped: {task.exception()!r}")
+
+async def evict_silent_agents(interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT):
+    """Close agents that sent nothing (not even a heartbeat) for `timeout` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        for agent_id, last_seen in list(agent_last_seen.items()):
+            if now - last_seen > timeout:
+                websocket = connected_agents.pop(agent_id, None)
+                agent_last_seen.pop(agent_id, None)
+                notify_presence(agent_id, False)
+                print(f"[SERVER] Evicting silent agent {agent_id} ({now - last_seen:.0f}s without a message)")
+                if websocket is not None:
+                    asyncio.create_task(websocket.close(1011, "heartbeat timeout"))
+                schedule_expiry(agent_id)
+
+def fail_pending(agent_id, error):
+    """Fail every in-flight command of an agent"""
+    for correlation_id, pending in list(pending_commands.items()):
+        if pending["agent_id"] == agent_id and not pending["future"].done():
+            pending["future"].set_exception(error)
+
+async def send_command(agent_id, command_dict, on_output=None):
+    """
+    Send a command without waiting for it
+
+    The agent streams the output back while the command runs. With `on_output`,
+    every chunk is passed to on_output(stream, text) as it arrives and is not kept;
+    otherwise it is collected into the result's stdout/stderr.
+
+    Returns:
+        Future resolved with the agent's result, or None if the agent is not connected
+    """
     if agent_id in connected_agents:
         ws = connected_agents[agent_id]
-        await ws.send(json.dumps(command_dict))
-        print(f"[SERVER] Sent command to {agent_id}")
+        correlation_id = command_dict.setdefault("correlation_id", str(uuid.uuid4()))
+        command_dict.setdefault("stream", True)
+        future = asyncio.get_running_loop().create_future()
+        pending_commands[correlation_id] = {"agent_id": agent_id, "future": future, "on_output": on_output,
+                                            "stdout": [], "stderr": [], "next_seq": 0}
+        future.add_done_callback(lambda _: pending_commands.pop(correlation_id, None))
+        try:
+            await ws.send(json.dumps(command_dict))
+        except Exception as e:
+            future.set_exception(ConnectionError(f"Send to {agent_id} failed: {e}"))
+            return future
+        print(f"[SERVER] Sent command {correlation_id} to {agent_id}")
+        return future
     else:
         print(f"[SERVER] Agent {agent_id} not connected")
+        return None
+
+async def run_command(agent_id, command_dict, timeout=COMMAND_TIMEOUT, on_output=None):
+    """Send a command and wait for its result; raises ConnectionError or asyncio.TimeoutError"""
+    future = await send_command(agent_id, command_dict, on_output)
+    if future is None:
+        raise ConnectionError(f"Agent {agent_id} not connected")
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        print(f"[SERVER] Command {command_dict['correlation_id']} to {agent_id} timed out after {timeout}s")
+        raise
+
+async def broadcast(agent_ids, command_dict, timeout=COMMAND_TIMEOUT):
+    """
+    Run the same command on many agents concurrently
+
+    Returns:
+        {agent_id: result} where failed agents map to {"error": "..."}
+    """
+    agent_ids = list(agent_ids)
+    command_dict = {k: v for k, v in command_dict.items() if k != "correlation_id"}
+    results = await asyncio.gather(
+        *(run_command(agent_id, dict(command_dict), timeout) for agent_id in agent_ids),
+        return_exceptions=True)
+    return {agent_id: ({"error": str(result) or type(result).__name__}
+                       if isinstance(result, Exception) else result)
+            for agent_id, result in zip(agent_ids, results)}
 
 async def test_command():
     await asyncio.sleep(5)
     # Copy automation directory from cloud to private server and run deploy.sh
-    await send_command("agent-001", {
-        "host": "192.168.32.243",
-        "username": "ubuntu",
-        "password": "Cvbnmjkl@30263",
-        "cmd": "mkdir /tmp/auto"
-    })
+    try:
+        result = await run_command("agent-001", {
+            "host": "192.168.32.243",
+            "username": "ubuntu",
+            "password": "Cvbnmjkl@30263",
+            "cmd": "mkdir /tmp/auto"
+        })
+        print(f"[SERVER] Result from agent-001: {result}")
+    except (ConnectionError, asyncio.TimeoutError) as e:
+        print(f"[SERVER] Test command failed: {e!r}")
 
 async def main():
     print("[SERVER] Starting WebSocket server on port 8765...")
-    async with websockets.serve(handler, "0.0.0.0", 8765):
-        await test_command()
-        await asyncio.Future()
+    # permessage-deflate is negotiated with agents that support it
+    async with websockets.serve(handler, "0.0.0.0", 8765, compression="deflate"):
+        eviction = start_eviction()
+        try:
+            await test_command()
+            await asyncio.Future()
+        finally:
+            eviction.cancel()
 
 if __name__ == "__main__":
     asyncio.run(main())
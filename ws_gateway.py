@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Multi-worker WebSocket Gateway
+Runs several ws_cloud_server worker processes on the same port (SO_REUSEPORT lets the
+kernel spread incoming agent connections across them) so agent connections are no
+longer capped by one process and one core.
+
+Workers share an agent-location registry through a broker: each worker registers the
+agents whose sockets it holds, and a command for an agent is routed to that worker.
+LocalBroker is a small in-repo stand-in for a shared bus such as Redis, speaking
+newline-delimited JSON over TCP.
+
+Usage:
+    python ws_gateway.py --workers 4 [--port 8765] [--broker-port 8766]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+
+import websockets
+
+import ws_cloud_server
+
+BROKER_HOST = "127.0.0.1"
+BROKER_PORT = 8766
+ROUTE_GRACE = 5  # extra seconds a routed command waits beyond its own timeout for the reply
+STREAM_LIMIT = 64 * 1024 * 1024  # longest message line; routed results can be far over asyncio's 64 KiB default
+
+
+class LocalBroker:
+    """
+    Agent registry and command router shared by the gateway workers
+
+    Messages (one JSON object per line):
+      worker -> broker  {"op": "hello", "worker_id"}
+                        {"op": "register" | "unregister", "agent_id"}
+                        {"op": "command", "request_id", "agent_id", "command", "timeout"}
+                        {"op": "reply", "to", "request_id", "result" | "error"}
+                        {"op": "lookup" | "stats", "request_id", ...}
+      broker -> worker  {"op": "command", "from", ...} forwarded to the agent's owner,
+                        {"op": "reply", "request_id", ...} back to the requester
+    """
+
+    def __init__(self, host=BROKER_HOST, port=BROKER_PORT):
+        self.host = host
+        self.port = port
+        self.registry = {}  # agent_id -> worker_id
+        self.workers = {}  # worker_id -> StreamWriter
+        self._server = None
+        self._handlers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=STREAM_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self.workers.values()):
+            writer.close()
+        # Let connection handlers finish on their own rather than be cancelled
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def stats(self):
+        per_worker = {worker_id: 0 for worker_id in self.workers}
+        for worker_id in self.registry.values():
+            per_worker[worker_id] = per_worker.get(worker_id, 0) + 1
+        return {"agents": len(self.registry), "workers": per_worker}
+
+    async def _serve(self, reader, writer):
+        worker_id = None
+        self._handlers.add(asyncio.current_task())
+        try:
+            async for message in _read_messages(reader):
+                try:
+                    worker_id = self._handle(message, worker_id, writer)
+                except (KeyError, TypeError, AttributeError) as e:
+                    print(f"[BROKER] Dropping malformed message from {worker_id}: {e!r}")
+        except ConnectionError:
+            pass
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                # The worker is gone, and so are the agent sockets it held
+                del self.workers[worker_id]
+                for agent_id in [a for a, w in self.registry.items() if w == worker_id]:
+                    del self.registry[agent_id]
+            writer.close()
+            self._handlers.discard(asyncio.current_task())
+
+    def _handle(self, message, worker_id, writer):
+        """Act on one message from a worker, returns the connection's (possibly new) worker_id"""
+        op = message.get("op")
+        if op == "hello":
+            worker_id = message["worker_id"]
+            self.workers[worker_id] = writer
+        elif op == "register":
+            self.registry[message["agent_id"]] = worker_id
+        elif op == "unregister":
+            # A late unregister from the old worker must not drop an agent that already moved
+            if self.registry.get(message["agent_id"]) == worker_id:
+                del self.registry[message["agent_id"]]
+        elif op == "command":
+            owner = self.workers.get(self.registry.get(message["agent_id"]))
+            if owner is None:
+                _send(writer, {"op": "reply", "request_id": message["request_id"],
+                               "error": f"Agent {message['agent_id']} not connected"})
+            else:
+                _send(owner, dict(message, **{"from": worker_id}))
+        elif op == "reply":
+            requester = self.workers.get(message["to"])
+            if requester is not None:
+                _send(requester, message)
+        elif op == "lookup":
+            _send(writer, {"op": "reply", "request_id": message["request_id"],
+                           "result": self.registry.get(message["agent_id"])})
+        elif op == "stats":
+            _send(writer, {"op": "reply", "request_id": message["request_id"], "result": self.stats()})
+        return worker_id
+
+
+def _send(writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+
+
+async def _read_messages(reader):
+    """
+    Yield each JSON message from a stream until EOF
+
+    A line over STREAM_LIMIT or one that is not valid JSON is skipped on its own;
+    the connection, and everything registered through it, stays up.
+    """
+    while True:
+        try:
+            line = await reader.readline()
+        except ValueError:  # over the limit: readline has already discarded the line
+            print(f"[BROKER] Dropping a message over {STREAM_LIMIT} bytes")
+            continue
+        if not line:
+            return
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            print(f"[BROKER] Dropping a message that is not JSON: {line[:80]!r}")
+
+
+class BrokerClient:
+    """
+    One worker's (or controller's) connection to the broker
+
+    `on_command(agent_id, command, timeout)` is awaited for commands routed to this
+    worker; its return value (or exception) goes back to the requester.
+    """
+
+    def __init__(self, worker_id, host=BROKER_HOST, port=BROKER_PORT, on_command=None):
+        self.worker_id = worker_id
+        self.host = host
+        self.port = port
+        self.on_command = on_command
+        self._writer = None
+        self._waiters = {}
+        self._ids = itertools.count()
+        self._tasks = set()
+
+    async def connect(self):
+        reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=STREAM_LIMIT)
+        self._send({"op": "hello", "worker_id": self.worker_id})
+        self._spawn(self._read_loop(reader))
+        return self
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+
+    def register(self, agent_id, connected=True):
+        """Presence hook: written immediately so register/unregister reach the broker in order"""
+        self._send({"op": "register" if connected else "unregister", "agent_id": agent_id})
+
+    async def request(self, agent_id, command, timeout=ws_cloud_server.COMMAND_TIMEOUT):
+        """Run a command on whichever worker holds the agent's socket"""
+        return await self._call({"op": "command", "agent_id": agent_id, "command": command,
+                                 "timeout": timeout}, timeout + ROUTE_GRACE)
+
+    async def lookup(self, agent_id):
+        """worker_id holding the agent, or None"""
+        return await self._call({"op": "lookup", "agent_id": agent_id}, ROUTE_GRACE)
+
+    async def stats(self):
+        return await self._call({"op": "stats"}, ROUTE_GRACE)
+
+    async def _call(self, message, timeout):
+        request_id = f"{self.worker_id}:{next(self._ids)}"
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = future
+        try:
+            self._send(dict(message, request_id=request_id))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiters.pop(request_id, None)
+
+    def _send(self, message):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError("not connected to the broker")
+        _send(self._writer, message)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _read_loop(self, reader):
+        try:
+            async for message in _read_messages(reader):
+                try:
+                    self._handle(message)
+                except (KeyError, TypeError, AttributeError) as e:
+                    print(f"[BROKER] {self.worker_id} dropping malformed message: {e!r}")
+        except ConnectionError:
+            pass
+        finally:
+            for future in self._waiters.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("broker connection lost"))
+
+    def _handle(self, message):
+        if message["op"] == "command":
+            self._spawn(self._run_command(message))
+        elif message["op"] == "reply":
+            future = self._waiters.get(message["request_id"])
+            if future and not future.done():
+                if "error" in message:
+                    future.set_exception(ConnectionError(message["error"]))
+                else:
+                    future.set_result(message["result"])
+
+    async def _run_command(self, message):
+        reply = {"op": "reply", "to": message["from"], "request_id": message["request_id"]}
+        try:
+            reply["result"] = await self.on_command(message["agent_id"], message["command"], message["timeout"])
+        except Exception as e:
+            reply["error"] = str(e) or type(e).__name__
+        try:
+            self._send(reply)
+        except ConnectionError:
+            pass
+
+
+broker = None  # this worker's BrokerClient
+
+
+async def route_command(agent_id, command_dict, timeout=ws_cloud_server.COMMAND_TIMEOUT):
+    """Run a command on an agent connected to any worker; local agents skip the broker"""
+    if agent_id in ws_cloud_server.connected_agents or broker is None:
+        return await ws_cloud_server.run_command(agent_id, command_dict, timeout)
+    return await broker.request(agent_id, command_dict, timeout)
+
+
+async def run_worker(worker_id, host="0.0.0.0", port=8765, broker_host=BROKER_HOST, broker_port=BROKER_PORT):
+    global broker
+    broker = BrokerClient(worker_id, broker_host, broker_port, on_command=ws_cloud_server.run_command)
+    await broker.connect()
+    ws_cloud_server.presence_hooks.append(broker.register)
+    # reuse_port: every worker binds the same port and the kernel balances new connections
+    async with websockets.serve(ws_cloud_server.handler, host, port, compression="deflate", reuse_port=True):
+        print(f"[GATEWAY] {worker_id} (pid {os.getpid()}) serving on port {port}")
+        eviction = ws_cloud_server.start_eviction()
+        try:
+            await asyncio.Future()
+        finally:
+            eviction.cancel()
+
+
+def _worker_main(worker_id, host, port, broker_host, broker_port):
+    try:
+        asyncio.run(run_worker(worker_id, host, port, broker_host, broker_port))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve_gateway(workers, host="0.0.0.0", port=8765, broker_port=BROKER_PORT):
+    """Run the broker in this process and `workers` gateway processes"""
+    local_broker = await LocalBroker(BROKER_HOST, broker_port).start()
+    print(f"[GATEWAY] Broker listening on {BROKER_HOST}:{local_broker.port}")
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_worker_main, daemon=True,
+                                 args=(f"worker-{i}", host, port, BROKER_HOST, local_broker.port))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    stopping = asyncio.Event()
+    try:
+        # Terminating the gateway must also stop its workers
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    except NotImplementedError:  # Windows
+        pass
+    try:
+        while all(process.is_alive() for process in processes) and not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+        if not stopping.is_set():
+            print("[GATEWAY] A worker exited, shutting down")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(5)
+        await local_broker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker WebSocket gateway for agents")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--broker-port", type=int, default=BROKER_PORT)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_gateway(args.workers, args.host, args.port, args.broker_port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()